@@ -0,0 +1,351 @@
+#!/usr/bin/python
+import sys, os, time, json, resource, matplotlib
+import argparse
+matplotlib.use("Agg")
+import numpy as np
+from mylib import *
+from replay import ReplayClock
+import plot_server as srv
+import plot_client as cli
+from plotlib import BlitManager, Decimator, window_max, VIEWS
+
+"""
+Microbenchmarks of the ingest and aggregation hot paths.
+Synthetic iperf report streams are generated for
+N clients x M ports x T seconds (the ports from 5001 alternate
+TCP and UDP: 5001, 5003, ... are TCP, 5002, 5004, ... UDP),
+then each stage is timed on the resulting state.
+Results can be saved as a baseline and compared with later runs.
+"""
+
+T_START = 1500000000 # unix time of the synthetic streams
+MIN_TIME = 0.2 # seconds of measure for each stage
+TOLERANCE = 0.2 # slowdown (fraction) reported as a regression
+
+#------------------------- SYNTHETIC STREAMS ---------------------------
+
+def client_ip(c):
+	return "10.{}.{}.{}".format((c >> 16) & 255, (c >> 8) & 255, c & 255)
+
+def iperf_tcp_line(stamp, c, port, intv1, rate):
+	return "{},10.255.255.254,{},{},{},{},{:.1f}-{:.1f},{},{}\n".format(
+		time.strftime("%Y%m%d%H%M%S", time.localtime(stamp)), port, client_ip(c),
+		30000 + c % 30000, c % 1000 + 3, intv1 - 1, intv1, int(rate / 8), int(rate))
+
+def iperf_udp_line(stamp, c, port, intv1, rate):
+	return "{},10.255.255.254,{},{},{},{},{:.1f}-{:.1f},{},{},0.011,0,85,0.000,0\n".format(
+		time.strftime("%Y%m%d%H%M%S", time.localtime(stamp)), port, client_ip(c),
+		30000 + c % 30000, c % 1000 + 3, intv1 - 1, intv1, int(rate / 8), int(rate))
+
+def bwm_ng_line(stamp, rate):
+	return "{};eth0;0.00;{:.2f};0;0;0;0;0;0;0;0;0.00;0.00;0;0\n".format(int(stamp), rate / 8)
+
+"""
+Return the reports of each second: a list of (t, [(port, line)], bwm line)
+"""
+def synthetic_reports(n_clients, n_ports, seconds):
+	reports = []
+	for s in range(1, seconds + 1):
+		stamp = T_START + s
+		lines = []
+		for p in range(n_ports):
+			port = 5001 + p
+			for c in range(n_clients):
+				rate = 10**6 * (1 + (c + s) % 7)
+				if p % 2 == 0:
+					lines.append((port, iperf_tcp_line(stamp, c, port, s, rate)))
+				else:
+					lines.append((port, iperf_udp_line(stamp, c, port, s, rate)))
+		reports.append((stamp, lines, bwm_ng_line(stamp, 10**7 * n_clients)))
+	return reports
+
+#------------------------- MEASURES ---------------------------
+
+"""
+Return the mean time [s] of a call of func,
+repeated for at least min_time seconds
+"""
+def measure(func, min_time=MIN_TIME):
+	n = 0
+	start = time.time()
+	while True:
+		func()
+		n += 1
+		elapsed = time.time() - start
+		if elapsed >= min_time:
+			return elapsed / n
+
+"""
+Server state fed by the handlers: return (data, singles, conns)
+"""
+def new_server_state(clock, binned=False):
+	set_clock(clock)
+	srv.t0 = T_START
+	srv.recorder = None
+	srv.grid = None
+	if binned:
+		srv.grid = TimeGrid(srv.IPERF_REPORT_INTERVAL, srv.HISTORY_WINDOW, ["tcp", "udp"])
+	return srv.set_data(), {}, {}
+
+"""
+Feed the reports to the server handlers.
+Return the time spent for each second of reports
+"""
+def ingest(reports, clock, data, singles, conns):
+	times = []
+	for stamp, lines, bwm_line in reports:
+		start = time.time()
+		clock.t = stamp
+		# the reports of a second of each port are read in a block
+		blocks = {}
+		for port, line in lines:
+			blocks.setdefault(port, []).append(line)
+		for port in sorted(blocks):
+			if port not in conns:
+				conns[port] = srv.new_iperf_conns()
+			if port % 2 == 1:
+				srv.handle_iperf_tcp_block(data, "".join(blocks[port]), conns[port], singles)
+			else:
+				srv.handle_iperf_udp_block(data, "".join(blocks[port]), conns[port], singles)
+		srv.handle_bwm_ng_line(data, bwm_line)
+		times.append(time.time() - start)
+	return times
+
+
+def run_benchmarks(n_clients, n_ports, seconds, binned=False):
+	results = {}
+	reports = synthetic_reports(n_clients, n_ports, seconds)
+	n_lines = sum(len(lines) + 1 for stamp, lines, bwm_line in reports)
+
+	# ingest: parsing, aggregation and death declarations
+	clock = ReplayClock(T_START)
+	data, singles, conns = new_server_state(clock, binned)
+	times = ingest(reports, clock, data, singles, conns)
+	elapsed = sum(times)
+	results["ingest"] = {
+		"us"	: 10**6 * elapsed / n_lines,
+		"rate"	: n_lines / elapsed,
+		"max_second" : max(times)
+	}
+
+	def stage(name, func):
+		t = measure(func)
+		results[name] = {"us" : 10**6 * t, "rate" : 1 / t}
+
+	now = reports[-1][0] - T_START
+	uids = [uid for uid in data if uid != "SUM"]
+
+	if not binned and len(uids) > 0:
+		series = data[uids[0]]
+
+		def update_sum():
+			clock.t += 1
+			t = clock.t - T_START
+			for uid in uids:
+				srv.update_sum(data[uid], t, 10**6, uid, "tcp", singles[uid])
+		stage("update_sum", update_sum)
+
+		def solve_singles():
+			for uid in uids:
+				singles[uid].solve(data[uid])
+		stage("solve_singles", solve_singles)
+
+		# a tick with no deaths: the live flows are not visited
+		stage("expire_flows", lambda: srv.expire_flows(data, now))
+
+		# y limit of a frame: windowed max of the totals
+		totals = [data[uid]["total"] for uid in uids]
+		stage("window_max", lambda: window_max(totals, now - srv.MAX_TIME_WINDOW))
+
+		t_array = series["total"].t
+		t_list = t_array.tolist()
+		stage("first_index_geq", lambda: first_index_geq(t_array, t_array[len(t_array) / 2]))
+		stage("first_index_geq_list", lambda: first_index_geq(t_list, t_list[len(t_list) / 2]))
+
+	# readers take the published snapshot: unchanged series are not copied again
+	publisher = srv.new_publisher(data, singles)
+	publisher.publish()
+	stage("publish", publisher.publish)
+	snapshot = publisher.latest
+
+	stage("count_users", lambda: srv.count_users(snapshot))
+
+	# per-user smoothing: after the first update, only the tail is filtered again
+	smoothers = {}
+	def smoother_update():
+		for uid in uids:
+			if uid not in smoothers:
+				smoothers[uid] = StreamingSmoother(1.0 / srv.DENSITY_LINSPACE, 
+					srv.SMOOTH_WINDOW, "hann", srv.HISTORY_WINDOW)
+			smoothers[uid].update(data[uid]["total"], 
+				srv.stable_horizon(data[uid]["total"], singles.get(uid)))
+	if not binned:
+		smoother_update()
+		stage("smoother_update", smoother_update)
+
+	stage("rate_to_int", lambda: rate_to_int("45.5m"))
+
+	# client: liveness of the tcp-probe flows, a record per flow and a tick
+	flows = {}
+	cli.flows = LivenessTracker(cli.DEATH_TOLERANCE)
+	for f in range(n_clients * n_ports):
+		flows["10.0.0.1:{}".format(30000 + f)] = TimeSeries(cli.HISTORY_WINDOW, 16)
+		flows["10.0.0.1:{}".format(30000 + f)].append(0, 10)
+	tick = [0.0]
+	def flows_seen():
+		tick[0] += 0.01
+		for src in flows:
+			cli.flows.seen(src, tick[0])
+	stage("flows_seen_client", flows_seen)
+	stage("update_death_flows_client", lambda: cli.update_death_flows(flows, tick[0], 0))
+
+	# level of detail of a dense tcp-probe flow (a record per ms), 1000 pixels
+	dense = TimeSeries(cli.HISTORY_WINDOW, cli.PROBE_CAPACITY)
+	for t in np.arange(0, cli.MAX_TIME_WINDOW, 0.001):
+		dense.append(t, 10 + t % 7)
+	decimator = Decimator(settle=cli.DEATH_TOLERANCE)
+	stage("decimate_first", lambda: Decimator().reduce(dense.t, dense.val,
+		0, cli.MAX_TIME_WINDOW, 1000))
+	stage("decimate_cached", lambda: decimator.reduce(dense.t, dense.val,
+		0, cli.MAX_TIME_WINDOW, 1000))
+
+	# plot update block and drawing of a frame, in each view of the users
+	x_lim_right = now + 2
+	x_lim_left = x_lim_right - srv.MAX_TIME_WINDOW
+	for view in VIEWS:
+		srv.view = view
+		suffix = "" if view == "lines" else "_" + view
+		fig, ax, lines, background = srv.init_figure([11, 8])
+		def plot_update():
+			if snapshot.grid is not None:
+				srv.update_grid_lines(snapshot.grid, snapshot.data["SUM"]["total"], lines, ax,
+					x_lim_left, x_lim_right, 1.1, background=background)
+			else:
+				srv.update_series_lines(snapshot.data, lines, ax, x_lim_left, x_lim_right, 1.1,
+					smoothers=smoothers, horizons=snapshot.horizons, background=background)
+			srv.print_legend(ax["tcp-udp"], srv.count_users(snapshot))
+		stage("plot_update" + suffix, plot_update)
+		stage("plot_draw" + suffix, lambda: fig.canvas.draw())
+
+		# blitting: only the lines are drawn on the cached background
+		renderer = BlitManager(fig)
+		renderer.update()
+		stage("plot_blit" + suffix, renderer.update)
+		matplotlib.pyplot.close(fig)
+	srv.view = "lines"
+
+	results["peak_rss_kb"] = {"us" : 0, "rate" : 0,
+		"kb" : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+	return results
+
+"""
+Steady state cost of one second of reports for n_clients
+"""
+def second_cost(n_clients, n_ports, binned=False):
+	seconds = srv.HISTORY_WINDOW + 5
+	reports = synthetic_reports(n_clients, n_ports, seconds)
+	clock = ReplayClock(T_START)
+	data, singles, conns = new_server_state(clock, binned)
+	times = ingest(reports, clock, data, singles, conns)
+	return np.mean(times[-5:])
+
+"""
+Find the number of clients for which one second of reports
+takes more than one second to be processed
+"""
+def find_ceiling(n_ports, max_clients, binned=False):
+	ok, ko = 0, None
+	n = 16
+	while ko is None and n <= max_clients:
+		cost = second_cost(n, n_ports, binned)
+		print "{} clients: {:.3f}s per second of reports".format(n, cost)
+		if cost < 1:
+			ok = n
+			n *= 2
+		else:
+			ko = n
+	if ko is None:
+		return ok
+	while ko - ok > max(1, ok / 10):
+		n = (ok + ko) / 2
+		cost = second_cost(n, n_ports, binned)
+		print "{} clients: {:.3f}s per second of reports".format(n, cost)
+		if cost < 1:
+			ok = n
+		else:
+			ko = n
+	return ok
+
+
+def print_results(results, baseline=None, tolerance=TOLERANCE):
+	print "\n{:<28}{:>14}{:>14}  {}".format("stage", "us/op", "ops/s", "vs base")
+	for name in sorted(results):
+		res = results[name]
+		if name == "peak_rss_kb":
+			continue
+		cmp_str = ""
+		if baseline is not None and name in baseline.get("stages", {}):
+			base = baseline["stages"][name]["us"]
+			if base > 0:
+				ratio = res["us"] / base
+				cmp_str = "{:.2f}x".format(ratio)
+				if ratio > 1 + tolerance:
+					cmp_str += " SLOWER"
+		print "{:<28}{:>14.2f}{:>14.0f}  {}".format(name, res["us"], res["rate"], cmp_str)
+	print "{:<28}{:>14}".format("peak RSS [kB]", results["peak_rss_kb"]["kb"])
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Benchmark the ingest and aggregation hot paths')
+
+	parser.add_argument('-n', dest='clients', nargs='?', default=50, type=int,
+		help='Number of clients')
+
+	parser.add_argument('-m', dest='ports', nargs='?', default=2, type=int,
+		help='Number of ports (even ports TCP, odd ports UDP)')
+
+	parser.add_argument('-T', dest='seconds', nargs='?', default=30, type=int,
+		help='Seconds of synthetic reports')
+
+	parser.add_argument('--binned', dest='binned', action='store_true',
+		help='Use the binned aggregation mode')
+	parser.set_defaults(binned=False)
+
+	parser.add_argument('-b', dest='baseline', nargs='?', default='bench_baseline.json',
+		help='Baseline results file')
+
+	parser.add_argument('--save', dest='save', action='store_true',
+		help='Save the results as the new baseline')
+	parser.set_defaults(save=False)
+
+	parser.add_argument('--ceiling', dest='ceiling', action='store_true',
+		help='Find the number of clients the server can keep up with')
+	parser.set_defaults(ceiling=False)
+
+	parser.add_argument('--max-clients', dest='max_clients', nargs='?', default=10000, type=int,
+		help='Max number of clients for the ceiling search')
+
+	args = parser.parse_args()
+
+	if args.ceiling:
+		n = find_ceiling(args.ports, args.max_clients, args.binned)
+		print "\nThe server keeps up with {} clients x {} ports".format(n, args.ports)
+		sys.exit(0)
+
+	params = {"clients" : args.clients, "ports" : args.ports,
+		"seconds" : args.seconds, "binned" : args.binned}
+	print "Benchmark: {clients} clients x {ports} ports x {seconds} s (binned: {binned})".format(**params)
+	results = run_benchmarks(args.clients, args.ports, args.seconds, args.binned)
+
+	baseline = None
+	if os.path.exists(args.baseline) and not args.save:
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+		if baseline.get("params") != params:
+			print "Baseline parameters differ: {}".format(baseline.get("params"))
+	print_results(results, baseline)
+
+	if args.save:
+		with open(args.baseline, "w") as f:
+			json.dump({"params" : params, "stages" : results}, f, indent=2, sort_keys=True)
+		print "\nBaseline saved in {}".format(args.baseline)
@@ -0,0 +1,646 @@
+#!/usr/bin/python
+import sys, os, time, re, math, random, threading
+import argparse
+from plotlib import VIEWS, TOP_K
+
+"""
+End-to-end load harness of plot_server and plot_client.
+The measurement tools (iperf, bwm-ng, ping, tcp-probe) are replaced
+by local fake producers, so the programs can be load-tested on a
+single box with no network and no root privileges:
+
+	loadgen.py emit KIND ...   fake producer, writes the output of a tool
+	loadgen.py server ...      runs plot_server against the fake producers
+	loadgen.py client ...      runs plot_client against the fake producers
+
+The producers emit realistic output for thousands of virtual clients
+and flows: churn (flows ending and starting), -nan UDP reports,
+iperf summation lines and out-of-order intervals.
+The harness reports the ingested lines/s, the delay between a report
+and its parsing, and the contention on the data semaphore.
+"""
+
+SERVER_IP = "10.255.255.254"
+CLIENT_IP = "10.255.255.253"
+
+LAG_LIMIT = 2 # seconds of delay of a report: the program does not keep up
+
+#------------------------- OUTPUT OF THE TOOLS ---------------------------
+
+# address of the virtual client c
+def client_ip(c):
+	return "10.{}.{}.{}".format((c >> 16) & 255, (c >> 8) & 255, (c & 255) + 1)
+
+def iperf_time(stamp):
+	return time.strftime("%Y%m%d%H%M%S", time.localtime(stamp))
+
+"""
+20150803124132,10.100.13.214,5001,10.100.13.162,56695,4,0.0-1.0,1005453312,463275664
+"""
+def iperf_tcp_line(stamp, ip, port, cport, conn, intv0, intv1, rate):
+	return "{},{},{},{},{},{},{:.1f}-{:.1f},{},{}\n".format(iperf_time(stamp),
+		SERVER_IP, port, ip, cport, conn, intv0, intv1, int(rate * (intv1 - intv0) / 8), int(rate))
+
+"""
+20150803222713,192.168.100.4,5002,192.168.100.2,36823,3,5.0-6.0,24990,199920,0.011,0,17,0.000,0
+20160525183306,192.168.1.77,5001,192.168.1.52,54274,5,21.0-22.0,0,0,0.000,0,0,-nan,0
+"""
+def iperf_udp_line(stamp, ip, port, cport, conn, intv0, intv1, rate):
+	if rate <= 0:
+		return "{},{},{},{},{},{},{:.1f}-{:.1f},0,0,0.000,0,0,-nan,0\n".format(iperf_time(stamp),
+			SERVER_IP, port, ip, cport, conn, intv0, intv1)
+	datagrams = int(rate * (intv1 - intv0) / 8 / 1470) + 1
+	return "{},{},{},{},{},{},{:.1f}-{:.1f},{},{},0.011,0,{},0.000,0\n".format(iperf_time(stamp),
+		SERVER_IP, port, ip, cport, conn, intv0, intv1, int(rate * (intv1 - intv0) / 8), int(rate),
+		datagrams)
+
+"""
+1437515226;eth0;1620.00;123595.00;125215.00;24719;324;25.00;110.00;135.00;22;5;0.00;0.00;0;0
+"""
+def bwm_ng_line(stamp, intf, rate_out, rate_in):
+	return "{};{};{:.2f};{:.2f};{:.2f};0;0;0.00;0.00;0.00;0;0;0.00;0.00;0;0\n".format(
+		int(stamp), intf, rate_out / 8, rate_in / 8, (rate_out + rate_in) / 8)
+
+"""
+[1437417582.711328] 64 bytes from 10.100.13.214: icmp_seq=21 ttl=64 time=0.104 ms
+"""
+def ping_line(stamp, server_ip, seq, rtt):
+	return "[{:.6f}] 64 bytes from {}: icmp_seq={} ttl=64 time={:.3f} ms\n".format(
+		stamp, server_ip, seq, rtt)
+
+"""
+0.000605295 10.100.13.162:45758 10.100.13.214:5001 32 0xf76a3a5b 0xf7692adb 48 41 292992 1 29312
+"""
+def tcp_probe_line(t, src, dst, cwnd, ssthresh, srtt):
+	return "{:.9f} {} {} 32 0x{:08x} 0x{:08x} {} {} 292992 {} 29312\n".format(
+		t, src, dst, random.getrandbits(32), random.getrandbits(32), cwnd, ssthresh, srtt)
+
+#------------------------- FAKE PRODUCERS ---------------------------
+# Each producer returns the lines of a tick (every interval seconds)
+
+"""
+iperf -s -yC on a port: a report per connection every second.
+Clients with more connections also have a summation line (TCP).
+With churn, connections end (with their final report over the whole
+connection, discarded by the parser) and restart from interval 0.0.
+With disorder, some reports are delayed to the next tick
+and the reports of a tick are not sorted by client
+"""
+class IperfProducer(object):
+	interval = 1
+
+	def __init__(self, args):
+		self.args = args
+		self.udp = args.kind == "iperf-udp"
+		self.next_cport = 30000
+		self.next_conn = 3
+		self.delayed = []
+		# client --> list of [client port, connection id, start tick], None if not active
+		self.flows = [self.new_flows(0) for c in range(args.clients)]
+
+	def new_flows(self, tick):
+		flows = []
+		for f in range(self.args.flows):
+			flows.append([self.next_cport, self.next_conn, tick])
+			self.next_cport = 30000 + (self.next_cport - 29999) % 30000
+			self.next_conn += 1
+		return flows
+
+	def rate(self, c, tick):
+		# each client has its own slowly varying rate
+		return self.args.rate * (1 + 0.5 * math.sin(tick / 7.0 + c)) * random.uniform(0.9, 1.1)
+
+	def lines(self, stamp, tick):
+		args = self.args
+		port = args.port
+		lines, self.delayed = self.delayed, []
+		line_of = iperf_udp_line if self.udp else iperf_tcp_line
+
+		for c in range(args.clients):
+			flows = self.flows[c]
+			if flows is None:
+				if random.random() < args.churn:
+					self.flows[c] = self.new_flows(tick)
+				continue
+			ip = client_ip(c)
+			total = 0
+			for cport, conn, start in flows:
+				rate = self.rate(c, tick)
+				if self.udp and random.random() < args.nan:
+					rate = 0
+				total += rate
+				line = line_of(stamp, ip, port, cport, conn, tick - start - 1, tick - start, rate)
+				if random.random() < args.disorder:
+					self.delayed.append(line)
+				else:
+					lines.append(line)
+			if not self.udp and len(flows) > 1:
+				lines.append(iperf_tcp_line(stamp, ip, 0, 0, -1,
+					tick - flows[0][2] - 1, tick - flows[0][2], total))
+
+			if random.random() < args.churn:
+				for cport, conn, start in flows:
+					lines.append(line_of(stamp, ip, port, cport, conn, 0, tick - start,
+						self.rate(c, tick)))
+				self.flows[c] = None
+
+		if args.disorder > 0:
+			random.shuffle(lines)
+		return lines
+
+"""
+bwm-ng -o csv: a report of the interface (and the total) every second
+"""
+class BwmNgProducer(object):
+	interval = 1
+
+	def __init__(self, args):
+		self.args = args
+
+	def lines(self, stamp, tick):
+		args = self.args
+		rate = args.clients * args.flows * args.ports * args.rate * random.uniform(0.8, 1.2)
+		return [bwm_ng_line(stamp, args.intf, rate, rate / 50),
+			bwm_ng_line(stamp, "total", rate, rate / 50)]
+
+"""
+ping -D: a reply every second
+"""
+class PingProducer(object):
+	interval = 1
+
+	def __init__(self, args):
+		self.args = args
+
+	def lines(self, stamp, tick):
+		rtt = random.lognormvariate(math.log(self.args.rtt), 0.3)
+		return [ping_line(stamp, self.args.server_ip, tick, rtt)]
+
+"""
+/proc/net/tcpprobe: a record per ACK of each flow,
+times relative to the insertion of the module.
+Windows grow by one segment per ACK and are halved on losses
+"""
+class TcpProbeProducer(object):
+	interval = 0.1
+
+	def __init__(self, args):
+		self.args = args
+		self.next_port = 30000
+		self.dst = "{}:{}".format(SERVER_IP, args.port)
+		# flow --> [source, cwnd, ssthresh]
+		self.flows = [self.new_flow() for f in range(args.clients * args.flows)]
+
+	def new_flow(self):
+		src = "{}:{}".format(CLIENT_IP, self.next_port)
+		self.next_port = 30000 + (self.next_port - 29999) % 30000
+		return [src, 10, 2**31 - 1]
+
+	def lines(self, stamp, tick):
+		args = self.args
+		acks = max(1, int(args.acks * self.interval))
+		t_end = tick * self.interval
+		records = []
+		for i in range(len(self.flows)):
+			flow = self.flows[i]
+			for t in sorted(random.uniform(t_end - self.interval, t_end) for a in range(acks)):
+				if random.random() < 0.01:
+					flow[2] = max(2, flow[1] / 2)
+					flow[1] = flow[2]
+				else:
+					flow[1] += 1
+				records.append((t, tcp_probe_line(t, flow[0], self.dst, flow[1], flow[2],
+					int(args.rtt * 1000))))
+			if random.random() < args.churn * self.interval:
+				self.flows[i] = self.new_flow()
+		records.sort()
+		return [line for t, line in records]
+
+PRODUCERS = {
+	"iperf-tcp"	: IperfProducer,
+	"iperf-udp"	: IperfProducer,
+	"bwm-ng"	: BwmNgProducer,
+	"ping"		: PingProducer,
+	"tcpprobe"	: TcpProbeProducer,
+}
+
+"""
+Write the output of a producer in real time.
+The producer terminates with the program that launched it
+"""
+def emit(args):
+	random.seed(args.seed)
+	producer = PRODUCERS[args.kind](args)
+	parent = os.getppid()
+	# on a whole second: the whole-second timestamps of the lines 
+	# are the exact end times of the reports
+	start = math.floor(time.time())
+	tick = 0
+	while args.duration <= 0 or tick * producer.interval < args.duration:
+		tick += 1
+		delay = start + tick * producer.interval - time.time()
+		if delay > 0:
+			time.sleep(delay)
+		if os.getppid() != parent:
+			break
+		try:
+			sys.stdout.write("".join(producer.lines(start + tick * producer.interval, tick)))
+			sys.stdout.flush()
+		except IOError:
+			break
+
+#------------------------- COMMAND SOURCE ---------------------------
+
+"""
+Command source (see mylib.set_command_source) that replaces
+the measurement tools with the fake producers of this file.
+Commands requiring root (sudo) are skipped,
+killall only kills the producers started by this harness
+"""
+class FakeSource(object):
+
+	def __init__(self, args, n_clients):
+		self.args = args
+		self.n_clients = n_clients
+		self.tag = os.getpid()
+		self.seed = args.seed
+
+	def producer(self, kind, *options):
+		args = self.args
+		self.seed += 1
+		return "{} {} emit {} -n {} -f {} -r {} -c {} --churn {} --disorder {} --nan {} --acks {} --rtt {} --seed {} {} --tag {}".format(
+			sys.executable, os.path.abspath(__file__), kind, self.n_clients, args.flows, args.rate,
+			args.server_ip, args.churn, args.disorder, args.nan, args.acks, args.rtt,
+			self.seed, " ".join(options), self.tag)
+
+	def __call__(self, command):
+		m = re.match(r"iperf -s .*-p ?(\d+)", command)
+		if m is not None:
+			kind = "iperf-udp" if " -u" in command else "iperf-tcp"
+			return self.producer(kind, "-p", m.group(1))
+
+		m = re.match(r"bwm-ng .*-I (\S+)", command)
+		if m is not None:
+			return self.producer("bwm-ng", "-i", m.group(1), "--ports", str(self.args.ports))
+
+		if command.startswith("ping "):
+			return self.producer("ping")
+
+		if command == "cat /proc/net/tcpprobe":
+			return self.producer("tcpprobe", "-p", str(self.args.tcp_port))
+
+		m = re.search(r'grep "(\S+)"', command)
+		if m is not None and command.startswith("for pid in"):
+			kind = "tcpprobe" if m.group(1) == "cat" else m.group(1)
+			return 'pkill -f "loadgen.py emit {}.*--tag {}$"'.format(kind, self.tag)
+
+		return None
+
+#------------------------- HARNESS ---------------------------
+
+"""
+Semaphore measuring how long the threads wait to acquire it
+"""
+class TimedSemaphore(object):
+
+	def __init__(self, value=1):
+		self._sem = threading.Semaphore(value)
+		self._lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		self.acquisitions = 0
+		self.contended = 0 # acquisitions that had to wait
+		self.wait = 0.0
+		self.max_wait = 0.0
+
+	def __enter__(self):
+		if self._sem.acquire(False):
+			waited = 0.0
+		else:
+			start = time.time()
+			self._sem.acquire()
+			waited = time.time() - start
+		with self._lock:
+			self.acquisitions += 1
+			if waited > 0:
+				self.contended += 1
+				self.wait += waited
+				self.max_wait = max(self.max_wait, waited)
+		return self
+
+	def __exit__(self, *exc):
+		self._sem.release()
+
+	acquire = __enter__
+
+	def release(self):
+		self._sem.release()
+
+"""
+Counters of the lines handled by a parser:
+count and delay from the timestamp of the report
+"""
+class IngestStats(object):
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self.lines = {}
+		self.max_lag = {}
+		self._stamps = {}
+		self.aggregators = []
+		self.shards = [] # SharedTimeGrid of the workers of a sharded server
+
+	"""
+	Keep track of the aggregators created by module
+	"""
+	def watch_aggregators(self, module):
+		stats = self
+		base = module.Aggregator
+		class WatchedAggregator(base):
+			def __init__(self, *args, **kwargs):
+				base.__init__(self, *args, **kwargs)
+				stats.aggregators.append(self)
+		module.Aggregator = WatchedAggregator
+
+	"""
+	Wrap the handler name of module: stamp_of returns
+	the unix timestamp of a line (None if unknown),
+	lines_of the number of lines it handles (a block)
+	"""
+	def wrap(self, module, name, kind, stamp_of, lines_of=lambda line: 1):
+		handler = getattr(module, name)
+		self.lines[kind] = 0
+		self.max_lag[kind] = 0.0
+		def counted(data, line, *args):
+			result = handler(data, line, *args)
+			try:
+				stamp = stamp_of(line)
+			except (ValueError, IndexError):
+				stamp = None
+			with self._lock:
+				self.lines[kind] += lines_of(line)
+				if stamp is not None:
+					self.max_lag[kind] = max(self.max_lag[kind], time.time() - stamp)
+			return result
+		setattr(module, name, counted)
+		return handler
+
+	# the end of the interval of the report (see emit)
+	def iperf_stamp(self, line):
+		key = line[:14]
+		if key not in self._stamps:
+			self._stamps[key] = time.mktime(time.strptime(key, "%Y%m%d%H%M%S"))
+		return self._stamps[key]
+
+	# the last report of a block
+	def iperf_block_stamp(self, block):
+		return self.iperf_stamp(block[block.rfind("\n", 0, len(block) - 1) + 1:])
+
+	def bwm_ng_stamp(self, line):
+		return int(line.split(";", 1)[0])
+
+	def ping_stamp(self, line):
+		return float(line[1:line.index("]")])
+
+def count_lines(block):
+	return block.count("\n")
+
+"""
+Print lines/s and contention every second
+"""
+def monitor(stats, sem, stop, interval=1):
+	last = dict(stats.lines)
+	last_wait = 0.0
+	while not stop.wait(interval):
+		lines = dict(stats.lines)
+		rates = ", ".join("{} {}/s".format(kind, lines[kind] - last[kind]) for kind in sorted(lines))
+		print "[loadgen] {} | lock wait {:.1f}%".format(rates, 100 * (sem.wait - last_wait) / interval)
+		last = lines
+		last_wait = sem.wait
+
+
+def print_report(n_clients, stats, sem, elapsed):
+	total = sum(stats.lines.values())
+	max_lag = max(stats.max_lag.values()) if len(stats.max_lag) > 0 else 0
+	print "\n{} clients: {} lines in {:.1f}s ({:.0f} lines/s)".format(
+		n_clients, total, elapsed, total / elapsed)
+	for kind in sorted(stats.lines):
+		print "  {:<12}{:>10} lines  {:>10.0f} lines/s  max delay {:.2f}s".format(
+			kind, stats.lines[kind], stats.lines[kind] / elapsed, stats.max_lag[kind])
+	mean_wait = 1000 * sem.wait / sem.contended if sem.contended > 0 else 0
+	print "  semaphore: {} acquisitions, {} contended ({:.1f}%), wait {:.3f}s (mean {:.2f}ms, max {:.2f}ms)".format(
+		sem.acquisitions, sem.contended, 100.0 * sem.contended / max(1, sem.acquisitions),
+		sem.wait, mean_wait, 1000 * sem.max_wait)
+	for aggregator in stats.aggregators:
+		print "  aggregator: {} records in {} batches, max backlog {} queued items".format(
+			aggregator.records, aggregator.batches, aggregator.max_backlog)
+	for i, shard in enumerate(stats.shards):
+		print "  shard {}: {} records ({:.0f} records/s), {} dropped".format(
+			i, shard.records(), shard.records() / elapsed, shard.dropped())
+	if max_lag > LAG_LIMIT:
+		print "  NOT keeping up: reports parsed {:.1f}s after they were produced".format(max_lag)
+	else:
+		print "  keeping up"
+	return {"clients" : n_clients, "lines/s" : total / elapsed, "max_lag" : max_lag,
+		"contended" : sem.contended, "wait" : sem.wait}
+
+
+def run_server_load(args, n_clients, stats, sem):
+	import plot_server as srv
+	srv.sem_data = sem
+	stats.watch_aggregators(srv)
+	stats.wrap(srv, "handle_iperf_tcp_block", "iperf-tcp", stats.iperf_block_stamp, count_lines)
+	stats.wrap(srv, "handle_iperf_udp_block", "iperf-udp", stats.iperf_block_stamp, count_lines)
+	stats.wrap(srv, "handle_bwm_ng_line", "bwm-ng", stats.bwm_ng_stamp)
+	stats.wrap(srv, "handle_net_dev_sample", "net-dev", lambda t: t)
+	srv.run_server(args.intf, args.tcp_ports, args.udp_ports, args.duration,
+		args.plot, False, 0, 0, args.window_size, args.binned, blit=args.blit, n_shards=args.n_shards,
+		sample_period=args.sample_period, use_bwm_ng=args.use_bwm_ng, group=args.group_by,
+		view_kind=args.view, top=args.top_k)
+	# the lines parsed by the workers are not counted: report the records of their grids
+	stats.shards = srv.shards or []
+
+def run_client_load(args, n_clients, stats, sem):
+	import plot_client as cli
+	cli.sem_data = sem
+	stats.watch_aggregators(cli)
+	stats.wrap(cli, "handle_bwm_ng_line", "bwm-ng", stats.bwm_ng_stamp)
+	stats.wrap(cli, "handle_net_dev_sample", "net-dev", lambda t: t)
+	stats.wrap(cli, "handle_ping_line", "ping", stats.ping_stamp)
+	stats.wrap(cli, "handle_tcp_probe_block", "tcpprobe", lambda block: None, count_lines)
+	stats.wrap(cli, "handle_tcp_info_sample", "tcp-info", lambda t: t)
+	# no keyboard: the run ends after the duration
+	cli.keyboard_listener_thread = lambda *args: None
+	timer = threading.Timer(args.duration, cli.stop_server)
+	timer.start()
+	cli.run_program(args.intf, args.server_ip, args.tcp_port, args.udp_port, args.window_size,
+		blit=args.blit, sample_period=args.sample_period, use_bwm_ng=args.use_bwm_ng,
+		tcp_info_period=args.tcp_info_period, use_ping=args.use_ping, view_kind=args.view, top=args.top_k)
+
+
+def run_load(args):
+	# imported here: the producers do not need them
+	from mylib import set_command_source
+	if not args.plot and args.command == "client":
+		# the client always plots (the server does not without --plot)
+		import matplotlib
+		matplotlib.use("Agg")
+		"""
+		Interactive mode on Agg draws at once at every change of an artist
+		(even between the x and the y of a line): nothing is shown anyway
+		"""
+		import matplotlib.pyplot as plt
+		plt.ion = plt.ioff
+
+	if args.command == "server":
+		args.ports = len(args.tcp_ports) + len(args.udp_ports)
+		run = run_server_load
+	else:
+		args.ports = 1
+		run = run_client_load
+
+	results = []
+	for n_clients in args.clients:
+		set_command_source(FakeSource(args, n_clients))
+
+		stats = IngestStats()
+		sem = TimedSemaphore()
+		stop = threading.Event()
+		reporter = threading.Thread(target=monitor, args=(stats, sem, stop))
+		reporter.daemon = True
+		if args.verbose:
+			reporter.start()
+
+		start = time.time()
+		try:
+			run(args, n_clients, stats, sem)
+		finally:
+			stop.set()
+		results.append(print_report(n_clients, stats, sem, time.time() - start))
+
+		# restore the original handlers for the next run
+		for module_name in ["plot_server", "plot_client"]:
+			if module_name in sys.modules:
+				reload(sys.modules[module_name])
+
+	if len(results) > 1:
+		print "\n{:>10}{:>14}{:>12}{:>12}".format("clients", "lines/s", "delay [s]", "wait [s]")
+		for res in results:
+			print "{clients:>10}{lines/s:>14.0f}{max_lag:>12.2f}{wait:>12.3f}".format(**res)
+		kept = [res["clients"] for res in results if res["max_lag"] <= LAG_LIMIT]
+		if len(kept) > 0:
+			print "\nThe {} keeps up with {} clients".format(args.command, max(kept))
+
+
+def add_load_options(parser, runs=True):
+	if runs:
+		parser.add_argument('-n', dest='clients', nargs='+', default=[100], type=int,
+			help='Number of virtual clients (more values: a run for each value)')
+	else:
+		parser.add_argument('-n', dest='clients', nargs='?', default=100, type=int,
+			help='Number of virtual clients')
+
+	parser.add_argument('-f', dest='flows', nargs='?', default=2, type=int,
+		help='Flows of each client on each port')
+
+	parser.add_argument('-r', dest='rate', nargs='?', default=10**6, type=float,
+		help='Mean rate of each flow [bit/s]')
+
+	parser.add_argument('-c', dest='server_ip', nargs='?', default=SERVER_IP,
+		help='Server IP address (ping)')
+
+	parser.add_argument('--churn', dest='churn', nargs='?', default=0.01, type=float,
+		help='Probability that a client stops (or restarts) in each second')
+
+	parser.add_argument('--disorder', dest='disorder', nargs='?', default=0.01, type=float,
+		help='Probability that a report is delayed to the next second')
+
+	parser.add_argument('--nan', dest='nan', nargs='?', default=0.02, type=float,
+		help='Probability of a -nan UDP report')
+
+	parser.add_argument('--acks', dest='acks', nargs='?', default=100, type=int,
+		help='tcp-probe records per second of each flow')
+
+	parser.add_argument('--rtt', dest='rtt', nargs='?', default=0.5, type=float,
+		help='Mean RTT [ms]')
+
+	parser.add_argument('--seed', dest='seed', nargs='?', default=1, type=int,
+		help='Seed of the random generator')
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Load test plot_server and plot_client with fake producers')
+	subparsers = parser.add_subparsers(dest='command')
+
+	emit_parser = subparsers.add_parser('emit', help='Fake producer: write the output of a tool')
+	emit_parser.add_argument('kind', choices=sorted(PRODUCERS))
+	add_load_options(emit_parser, runs=False)
+	emit_parser.add_argument('-p', dest='port', nargs='?', default=5001, type=int,
+		help='Port of the iperf server (iperf, tcpprobe)')
+	emit_parser.add_argument('-i', dest='intf', nargs='?', default='eth0',
+		help='Interface name (bwm-ng)')
+	emit_parser.add_argument('--ports', dest='ports', nargs='?', default=1, type=int,
+		help='Number of iperf ports sharing the interface (bwm-ng)')
+	emit_parser.add_argument('-d', dest='duration', nargs='?', default=-1, type=float,
+		help='Seconds of output. Default until the parent terminates')
+	emit_parser.add_argument('--tag', dest='tag', nargs='?', default=0, type=int,
+		help='Pid of the harness that launched the producer')
+
+	for side in ['server', 'client']:
+		side_parser = subparsers.add_parser(side, help='Load test plot_{}'.format(side))
+		add_load_options(side_parser)
+		side_parser.add_argument('-d', dest='duration', nargs='?', default=20, type=int,
+			help='Duration of each run [seconds]')
+		side_parser.add_argument('-i', dest='intf', nargs='?', default='eth0',
+			help='Interface name')
+		side_parser.add_argument('-w', dest='window_size', nargs=2, default=[11,8], type=int,
+			help='Width and height of the window [inch]')
+		side_parser.add_argument('--plot', dest='plot', action='store_true',
+			help='Show the plot (default: headless)')
+		side_parser.set_defaults(plot=False)
+		side_parser.add_argument('--blit', dest='blit', action='store_true',
+			help='Redraw only the lines at each frame')
+		side_parser.set_defaults(blit=False)
+		side_parser.add_argument('--view', dest='view', choices=VIEWS, default='lines',
+			help='Draw a line for each flow, or only the top flows and the others in a collection or heatmap')
+		side_parser.add_argument('--top', dest='top_k', nargs='?', default=TOP_K, type=int,
+			help='Flows drawn as lines in the collection and heatmap views')
+		side_parser.add_argument('-v', dest='verbose', action='store_true',
+			help='Print lines/s and lock wait every second')
+		side_parser.set_defaults(verbose=False)
+		side_parser.add_argument('--sample-period', dest='sample_period', nargs='?', default=0.2, type=float,
+			help='Seconds between two samples of the interface counters')
+		side_parser.add_argument('--bwm-ng', dest='use_bwm_ng', action='store_true',
+			help='Run the fake bwm-ng instead of sampling /proc/net/dev')
+		side_parser.set_defaults(use_bwm_ng=False)
+		if side == 'server':
+			side_parser.add_argument('-t', dest='tcp_ports', nargs='+', default=[5001], type=int,
+				help='List of listening TCP ports')
+			side_parser.add_argument('-u', dest='udp_ports', nargs='+', default=[5201], type=int,
+				help='List of listening UDP ports')
+			side_parser.add_argument('--binned', dest='binned', action='store_true',
+				help='Aggregate rates in aligned bins of the iperf report interval')
+			side_parser.set_defaults(binned=False)
+			side_parser.add_argument('--shards', dest='n_shards', nargs='?', default=0, type=int,
+				help='Parse the iperf ports in this many worker processes')
+			side_parser.add_argument('--group-by', dest='group_by', choices=["host", "connection"], default='host',
+				help='Plot a user for each client host or for each connection')
+		else:
+			side_parser.add_argument('-t', dest='tcp_port', nargs='?', default=5001, type=int,
+				help='TCP server port')
+			side_parser.add_argument('-u', dest='udp_port', nargs='?', default=5201, type=int,
+				help='UDP server port')
+			side_parser.add_argument('--tcp-info', dest='tcp_info_period', nargs='?', default=None,
+				const=0.05, type=float,
+				help='Sample tcp_info of the real flows to the TCP port instead of the fake tcp-probe')
+			side_parser.add_argument('--ping', dest='use_ping', action='store_true',
+				help='Run also the fake ping')
+			side_parser.set_defaults(use_ping=False)
+
+	args = parser.parse_args()
+
+	if args.command == 'emit':
+		emit(args)
+	else:
+		run_load(args)
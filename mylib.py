@@ -1,18 +1,74 @@
-import os, re, pexpect, subprocess, math, time
+import os, re, pexpect, subprocess, math, time, bisect, threading, traceback, Queue, copy
+import select, shlex, distutils.spawn, multiprocessing, ctypes, ctypes.util
 import numpy as np
 
 FNULL = open(os.devnull, "w")
 
+# default number of samples kept by a TimeSeries
+SERIES_CAPACITY = 4096
+
+# parsed records waiting for the aggregator: when full, the parsers wait
+QUEUE_SIZE = 2**16
+
+# max bytes read at once from the output of a program (see ProcessMux)
+READ_CHUNK = 2**16
+
+# max wait of the process multiplexer for new output [ms]
+POLL_TIMEOUT = 100
+
+# max keys (users) of a SharedTimeGrid
+SHARD_KEYS = 4096
+
 """
-Given a sorted list,
+Given a sorted list (or NumPy array),
 find the first index where value > threshold
 if it does not exist (threshold > all values), return -1
+Binary search: O(log n)
 """
 def first_index_geq(elements, reference):
-	for index, elem in enumerate(elements):
-		if elem > reference:
-			return index
-	return -1
+	if isinstance(elements, np.ndarray):
+		index = int(np.searchsorted(elements, reference, side="right"))
+	else:
+		index = bisect.bisect_right(elements, reference)
+	if index == len(elements):
+		return -1
+	return index
+
+"""
+Clock used to timestamp the samples: the wall clock,
+or a virtual clock when captured logs are replayed
+"""
+_clock = time.time
+
+def clock():
+	return _clock()
+
+def set_clock(new_clock):
+	global _clock
+	_clock = new_clock
+
+"""
+Seconds of CLOCK_MONOTONIC: not affected by the changes of
+the system time (time.time() where it is not available)
+"""
+class _timespec(ctypes.Structure):
+	_fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+CLOCK_MONOTONIC = 1
+
+try:
+	_clock_gettime = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True).clock_gettime
+	_clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+except (OSError, AttributeError):
+	_clock_gettime = None
+
+def monotonic():
+	if _clock_gettime is None:
+		return time.time()
+	ts = _timespec()
+	if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+		return time.time()
+	return ts.tv_sec + ts.tv_nsec * 1e-9
 
 def get_other(prot):
 	if prot == "tcp":
@@ -71,14 +127,1306 @@ def num_to_rate_int(rate_int):
 		return str(int(rate_int / 10**6)) + "m"
 	return str(int(rate_int / 10**9)) + "g"
 
+"""
+Extreme (max, or min with sign=-1) of the samples of a series
+from a time on: a monotonic deque of the samples greater than 
+all the samples after them (nan are skipped).
+The extreme from t_left on is the first of them at or after 
+t_left (binary search). A sample is pushed and popped at most
+once, so appending and evicting cost O(1) amortised per sample.
+A sample inserted in the middle, or moved towards the extreme,
+can only pop others: it is inserted in O(log n + popped).
+Other changes make the deque stale (see rebuild)
+"""
+class MonotonicDeque(object):
+
+	def __init__(self, sign=1):
+		self.sign = sign
+		self.t = []
+		self.key = [] # -sign * val, strictly increasing (for bisect)
+		self.stale = False # to be rebuilt from the samples
+
+	def __len__(self):
+		return len(self.t)
+
+	"""
+	Drop the samples not greater than the one of key
+	"""
+	def _truncate(self, key):
+		n = bisect.bisect_left(self.key, key)
+		if n < len(self.key):
+			del self.t[n:]
+			del self.key[n:]
+
+	def push(self, t, val):
+		key = -self.sign * float(val)
+		if key != key or self.stale:
+			return
+		self._truncate(key)
+		self.t.append(t)
+		self.key.append(key)
+
+	"""
+	Push a batch of samples (sorted by t): the samples greater than
+	all the ones after them in the batch are found with a single 
+	running max from the end
+	"""
+	def extend(self, ts, vals):
+		keys = -self.sign * np.asarray(vals, dtype=np.float64)
+		if len(keys) == 0 or self.stale:
+			return
+		keys[np.isnan(keys)] = np.inf
+		after = np.empty_like(keys) # min key of the samples after each one
+		after[-1] = np.inf
+		after[:-1] = np.minimum.accumulate(keys[:0:-1])[::-1]
+		keep = keys < after
+		if not keep.any():
+			return
+		keys = keys[keep]
+		self._truncate(keys[0])
+		self.t.extend(np.asarray(ts)[keep].tolist())
+		self.key.extend(keys.tolist())
+
+	"""
+	Insert a sample at any time t: it is kept if greater than the
+	samples after it, and drops the ones before it not greater.
+	A sample already at t (its old value) is replaced
+	"""
+	def insert(self, t, val):
+		key = -self.sign * float(val)
+		if key != key or self.stale:
+			return
+		i = bisect.bisect_left(self.t, t)
+		j = i + 1 if i < len(self.t) and self.t[i] == t else i
+		if j < len(self.key) and self.key[j] <= key:
+			return
+		n = bisect.bisect_left(self.key, key, 0, i)
+		self.t[n:j] = [t]
+		self.key[n:j] = [key]
+
+	"""
+	The values of the samples at ts changed from old to new:
+	the ones moved towards the extreme are inserted again,
+	any other change makes the deque stale
+	"""
+	def update(self, ts, old, new):
+		if self.stale:
+			return
+		ts, old, new = np.atleast_1d(ts), np.atleast_1d(old), np.atleast_1d(new)
+		if np.any(~(self.sign * (new - old) >= 0) & ~np.isnan(old)):
+			self.stale = True
+			return
+		for t, val in zip(ts.tolist(), new.tolist()):
+			self.insert(t, val)
+
+	"""
+	Rebuild the deque from all the samples ts, vals
+	"""
+	def rebuild(self, ts, vals):
+		self.t, self.key, self.stale = [], [], False
+		self.extend(ts, vals)
+
+	"""
+	Drop the samples before t
+	"""
+	def evict(self, t):
+		n = bisect.bisect_left(self.t, t)
+		if n > 0:
+			del self.t[:n]
+			del self.key[:n]
+
+	"""
+	Return the extreme of the samples from t_left on (None if no sample)
+	"""
+	def since(self, t_left):
+		i = bisect.bisect_left(self.t, t_left)
+		if i == len(self.t):
+			return None
+		return -self.sign * self.key[i]
+
+	def copy(self):
+		other = MonotonicDeque(self.sign)
+		other.stale = self.stale
+		if not self.stale:
+			other.t = list(self.t)
+			other.key = list(self.key)
+		return other
+
+"""
+Return the samples t, val (sorted by t) thinned to the min and max
+samples of each bucket of width seconds, aligned to the absolute
+time (in time order, once if they are the same sample): the peaks
+of a dense series are kept with at most two samples per bucket.
+Samples with at most two per bucket on average are returned as they are
+"""
+def thin_min_max(t, val, width):
+	if len(t) <= 2 or len(t) <= 2 * (math.floor(t[-1] / width) - math.floor(t[0] / width) + 1):
+		return t, val
+	k = np.floor(t / width).astype(np.int64)
+	starts = np.r_[0, np.flatnonzero(np.diff(k)) + 1]
+	ends = np.r_[starts[1:], len(k)]
+	# by bucket, then by value: the first of a bucket is its min, the last its max
+	order = np.lexsort((val, k))
+	keep = np.unique(np.r_[order[starts], order[ends - 1]])
+	return t[keep], val[keep]
+
+"""
+Bounded time series of (t, val) samples, sorted by t.
+Samples are stored in preallocated NumPy buffers 
+(float64 timestamps, float32 values): samples older than
+window seconds with respect to the newest one are evicted,
+and at most capacity samples are kept, so the memory
+does not grow with the duration of the run.
+The live samples are always contiguous in the buffers: 
+t and val are zero-copy views that can be handed to Line2D.set_data.
+With extremes the series keeps its windowed max and min
+(see max_since): appends update them in O(1), late inserts and
+set_val towards the extreme in O(log n) (see MonotonicDeque.insert).
+The other changes (delete, set_val away from the extreme) 
+rebuild the extreme at its next read
+"""
+class TimeSeries(object):
+
+	def __init__(self, window, capacity=SERIES_CAPACITY, extremes=False):
+		self.window = window
+		self.capacity = capacity
+		# twice the capacity: the live samples are moved back 
+		# to the beginning only when the end is reached
+		self._t = np.zeros(2 * capacity, dtype=np.float64)
+		self._val = np.zeros(2 * capacity, dtype=np.float32)
+		self._begin = 0
+		self._end = 0
+		self.version = 0 # incremented at each change
+		self._frozen = None # last frozen copy (see freeze)
+		self._max, self._min = None, None # MonotonicDeque of the extremes
+		if extremes:
+			self._max, self._min = MonotonicDeque(1), MonotonicDeque(-1)
+
+	def __len__(self):
+		return self._end - self._begin
+
+	@property
+	def t(self):
+		return self._t[self._begin:self._end]
+
+	@property
+	def val(self):
+		return self._val[self._begin:self._end]
+
+	def last_t(self):
+		return self._t[self._end - 1]
+
+	def last_val(self):
+		return self._val[self._end - 1]
+
+	"""
+	Return the views (t, val) of the samples from t_left on,
+	plus the last sample before t_left (the line enters from the left border)
+	"""
+	def window_view(self, t_left):
+		begin = self._begin + int(np.searchsorted(self.t, t_left))
+		begin = max(self._begin, begin - 1)
+		return self._t[begin:self._end], self._val[begin:self._end]
+
+	"""
+	Evict the samples outside the time window (and the oldest ones 
+	if the series is full), then make room for n new samples
+	"""
+	def _make_room(self, t, n=1):
+		begin = self._begin
+		if self._end > self._begin:
+			limit = max(t, self.last_t()) - self.window
+			if self._t[self._begin] < limit:
+				self._begin += int(np.searchsorted(self.t, limit))
+
+		if self._end - self._begin > self.capacity - n:
+			self._begin = self._end - (self.capacity - n)
+
+		if self._begin != begin and self._max is not None:
+			first_t = self._t[self._begin] if self._end > self._begin else t
+			self._max.evict(first_t)
+			self._min.evict(first_t)
+
+		if self._end + n > len(self._t):
+			n = self._end - self._begin
+			self._t[:n] = self._t[self._begin:self._end]
+			self._val[:n] = self._val[self._begin:self._end]
+			self._begin = 0
+			self._end = n
+
+	def append(self, t, val):
+		self._make_room(t)
+		self._t[self._end] = t
+		self._val[self._end] = val
+		self._end += 1
+		self.version += 1
+		if self._max is not None:
+			self._max.push(t, self._val[self._end - 1])
+			self._min.push(t, self._val[self._end - 1])
+
+	"""
+	Append a batch of samples (sorted, not older than the last one)
+	"""
+	def extend(self, ts, vals):
+		ts = np.asarray(ts)
+		vals = np.asarray(vals)
+		if len(ts) == 0:
+			return
+		begin = max(int(np.searchsorted(ts, ts[-1] - self.window)), len(ts) - self.capacity)
+		ts, vals = ts[begin:], vals[begin:]
+		n = len(ts)
+		self._make_room(ts[-1], n)
+		self._t[self._end:self._end + n] = ts
+		self._val[self._end:self._end + n] = vals
+		self._end += n
+		self.version += 1
+		if self._max is not None:
+			vals = self._val[self._end - n:self._end]
+			self._max.extend(ts, vals)
+			self._min.extend(ts, vals)
+
+	"""
+	Insert a sample in position index (relative to the live samples)
+	"""
+	def insert(self, index, t, val):
+		if index < 0 or index >= len(self):
+			self.append(t, val)
+			return
+		old_len = len(self)
+		self._make_room(t)
+		# evicted samples shift the position of the insertion
+		index = max(0, index - (old_len - len(self)))
+		pos = self._begin + index
+		self._t[pos + 1:self._end + 1] = self._t[pos:self._end]
+		self._val[pos + 1:self._end + 1] = self._val[pos:self._end]
+		self._t[pos] = t
+		self._val[pos] = val
+		self._end += 1
+		self.version += 1
+		if self._max is not None:
+			self._max.insert(t, self._val[pos])
+			self._min.insert(t, self._val[pos])
+
+	"""
+	Delete the samples in positions [begin, end)
+	"""
+	def delete(self, begin, end):
+		begin = self._begin + max(0, begin)
+		end = self._begin + min(end, len(self))
+		if end <= begin:
+			return
+		n = self._end - end
+		self._t[begin:begin + n] = self._t[end:self._end]
+		self._val[begin:begin + n] = self._val[end:self._end]
+		self._end = begin + n
+		self.version += 1
+		if self._max is not None:
+			self._max.stale = self._min.stale = True
+
+	"""
+	Overwrite the values in positions pos (relative to the live samples)
+	"""
+	def set_val(self, pos, vals):
+		old = self.val[pos].copy() if self._max is not None else None
+		self.val[pos] = vals
+		self.version += 1
+		if self._max is not None:
+			self._max.update(self.t[pos], old, self.val[pos])
+			self._min.update(self.t[pos], old, self.val[pos])
+
+	"""
+	Return the extreme deque, rebuilt if stale
+	"""
+	def _fresh(self, extreme):
+		if extreme.stale:
+			extreme.rebuild(self.t, self.val)
+		return extreme
+
+	"""
+	Return the max of the samples from t_left on
+	(None if there are none, or the series has no extremes)
+	"""
+	def max_since(self, t_left):
+		if self._max is None:
+			return None
+		return self._fresh(self._max).since(t_left)
+
+	"""
+	Return the min of the samples from t_left on (see max_since)
+	"""
+	def min_since(self, t_left):
+		if self._min is None:
+			return None
+		return self._fresh(self._min).since(t_left)
+
+	"""
+	Insert a sample keeping the series sorted by t.
+	Samples arriving in order are appended in O(1), 
+	late samples only shift the samples that follow them
+	"""
+	def insort(self, t, val):
+		if self._end == self._begin or t >= self._t[self._end - 1]:
+			self.append(t, val)
+		else:
+			self.insert(int(np.searchsorted(self.t, t, side="right")), t, val)
+
+	"""
+	Return the position of the sample with timestamp t, -1 if not present
+	Binary search: O(log n)
+	"""
+	def index(self, t):
+		index = int(np.searchsorted(self.t, t))
+		if index < len(self) and self._t[self._begin + index] == t:
+			return index
+		return -1
+
+	"""
+	Return a read-only copy of the live samples.
+	The copy is made once per version: a series that did not
+	change since the last freeze returns the same copy
+	(with its own extremes: a stale one is rebuilt by its reader)
+	"""
+	def freeze(self):
+		if self._frozen is None or self._frozen.version != self.version:
+			frozen = copy.copy(self)
+			if self._max is not None:
+				frozen._max, frozen._min = self._max.copy(), self._min.copy()
+			frozen._t = self.t.copy()
+			frozen._val = self.val.copy()
+			frozen._t.setflags(write=False)
+			frozen._val.setflags(write=False)
+			frozen._begin, frozen._end = 0, len(self)
+			frozen._frozen = frozen
+			self._frozen = frozen
+		return self._frozen
+
+"""
+Dense integer ids of flows: each new key (e.g. the tuple 
+(ip, port, connection id) of a connection) gets the next id,
+so the state of the flows is kept in arrays indexed by id 
+(see add_array) instead of dicts keyed by strings.
+label(key) is the name of the flow shown to the users
+(e.g. its host), computed once per flow ("label" array).
+With a timeout the flows not seen (see seen) for timeout seconds
+are released by expire: their ids are reused by the new keys,
+so the arrays are bounded by the flows alive at the same time
+"""
+class FlowRegistry(object):
+
+	def __init__(self, label=None, capacity=64, timeout=None):
+		self.label = label if label is not None else (lambda key: key)
+		self.keys = [] # key of each id (None if released)
+		self._ids = {} # key --> id
+		self._free = [] # released ids
+		self._arrays = {} # name --> (buffer, fill value)
+		self._capacity = capacity
+		self.liveness = LivenessTracker(timeout) if timeout is not None else None
+		self.add_array("label", object, None)
+
+	def __len__(self):
+		return len(self.keys) - len(self._free)
+
+	"""
+	Add an array of a value per flow (fill for the new flows)
+	"""
+	def add_array(self, name, dtype, fill):
+		self._arrays[name] = (np.full(self._capacity, fill, dtype=dtype), fill)
+
+	"""
+	View of the array of the registered flows (writable)
+	"""
+	def __getitem__(self, name):
+		return self._arrays[name][0][:len(self.keys)]
+
+	"""
+	Id of key (registered if new)
+	"""
+	def intern(self, key):
+		i = self._ids.get(key)
+		if i is None:
+			if len(self._free) > 0:
+				i = self._free.pop()
+				self.keys[i] = key
+			else:
+				i = len(self.keys)
+				if i == self._capacity:
+					for name, (buf, fill) in self._arrays.items():
+						self._arrays[name] = (np.concatenate((buf, np.full_like(buf, fill))), fill)
+					self._capacity *= 2
+				self.keys.append(key)
+			self._ids[key] = i
+			self._arrays["label"][0][i] = self.label(key)
+		return i
+
+	"""
+	Release the flow of id i: its values are reset to the fill values
+	and the id is reused by the next new key
+	"""
+	def release(self, i):
+		del self._ids[self.keys[i]]
+		self.keys[i] = None
+		for buf, fill in self._arrays.values():
+			buf[i] = fill
+		self._free.append(i)
+		if self.liveness is not None:
+			self.liveness.forget(i)
+
+	"""
+	The flows of ids are alive at times stamps
+	"""
+	def seen(self, ids, stamps):
+		for i, t in zip(ids.tolist(), stamps.tolist()):
+			self.liveness.seen(i, t)
+
+	"""
+	Release the flows dead at time now: return their keys
+	"""
+	def expire(self, now):
+		released = []
+		for i, last_t in self.liveness.advance(now):
+			released.append(self.keys[i])
+			self.release(i)
+		return released
+
+	"""
+	Array of the ids of keys (the new ones are registered)
+	"""
+	def ids(self, keys):
+		ids = map(self._ids.get, keys)
+		if None in ids:
+			ids = map(self.intern, keys)
+		return np.array(ids, dtype=int)
+
+"""
+Rates aggregated on a shared clock, in aligned bins of bin_width seconds
+(bin k is centered in k * bin_width - phase).
+Each key (e.g. a user) has a row of bins for each name in rows 
+(e.g. a protocol), so per-row, per-key and all-keys totals 
+are plain array additions.
+The grid keeps the last window seconds: the live bins are 
+contiguous in the buffer and views are zero-copy
+"""
+class TimeGrid(object):
+
+	def __init__(self, bin_width, window, rows, phase=0.0, capacity=64):
+		self.bin_width = float(bin_width)
+		self.phase = phase
+		self.n_bins = int(math.ceil(window / self.bin_width))
+		self.rows = dict((row, i) for i, row in enumerate(rows))
+		self.keys = {} # key --> position in the grid
+		# twice the window: bins are moved back only when the end is reached
+		self._vals = np.zeros((capacity, len(rows), 2 * self.n_bins), dtype=np.float32)
+		self._first = None # absolute bin of column 0
+		self._end = 0 # column after the newest bin
+
+	def bin_of(self, t):
+		return int(math.floor((t + self.phase) / self.bin_width + 0.5))
+
+	def _begin(self):
+		return max(0, self._end - self.n_bins)
+
+	"""
+	Move the end of the grid to the bin of t
+	"""
+	def advance(self, t):
+		self._advance_bin(self.bin_of(t))
+
+	def _advance_bin(self, b):
+		if self._first is None:
+			self._first = b - self.n_bins + 1
+		col = b - self._first
+		if col >= self._vals.shape[2]:
+			# keep the last n_bins bins (up to b) at the beginning of the buffer
+			new_first = b - self.n_bins + 1
+			shift = new_first - self._first
+			n = max(0, self._end - shift)
+			if n > 0:
+				self._vals[:, :, :n] = self._vals[:, :, shift:shift + n]
+			self._vals[:, :, n:] = 0
+			self._first = new_first
+			self._end = n
+			col = b - self._first
+		self._end = max(self._end, col + 1)
+
+	"""
+	Add val to the bin of t. Samples older than the window are dropped
+	"""
+	def add(self, key, row, t, val):
+		self.advance(t)
+		col = self.bin_of(t) - self._first
+		if col < self._begin():
+			return
+		i = self._key_index(key) # before indexing: a new key may grow the grid
+		self._vals[i, self.rows[row], col] += val
+
+	"""
+	Position of key in the grid (added if new)
+	"""
+	def _key_index(self, key):
+		if key not in self.keys:
+			if len(self.keys) == self._vals.shape[0]:
+				self._vals = np.concatenate((self._vals, np.zeros_like(self._vals)))
+			self.keys[key] = len(self.keys)
+		return self.keys[key]
+
+	"""
+	Add the live bins of other, a grid with the same bins and rows
+	"""
+	def merge(self, other):
+		if other._first is None:
+			return
+		self._advance_bin(other._first + other._end - 1)
+		# absolute bins of other still in the window
+		first = max(other._first + other._begin(), self._first + self._begin())
+		last = other._first + other._end
+		if first >= last:
+			return
+		keys = other.keys.items()
+		mine = [self._key_index(key) for key, i in keys]
+		theirs = [i for key, i in keys]
+		self._vals[mine, :, first - self._first:last - self._first] += \
+			other._vals[theirs, :, first - other._first:last - other._first]
+
+	"""
+	Return a new empty grid with the same bins and rows
+	"""
+	def empty_like(self, capacity=64):
+		rows = sorted(self.rows, key=self.rows.get)
+		return TimeGrid(self.bin_width, self.n_bins * self.bin_width, rows, self.phase, capacity)
+
+	"""
+	Center of the live bins
+	"""
+	def times(self):
+		if self._first is None:
+			return np.zeros(0)
+		cols = np.arange(self._begin(), self._end)
+		return (cols + self._first) * self.bin_width - self.phase
+
+	def view(self, key, row):
+		return self._vals[self.keys[key], self.rows[row], self._begin():self._end]
+
+	"""
+	Sum of all the rows of a key
+	"""
+	def key_total(self, key):
+		return self._vals[self.keys[key], :, self._begin():self._end].sum(axis=0)
+
+	"""
+	Sum of all the rows of all the keys
+	"""
+	def total(self):
+		return self._vals[:len(self.keys), :, self._begin():self._end].sum(axis=(0, 1))
+
+	"""
+	Return the keys with some traffic in the last duration seconds (up to t)
+	"""
+	def active_keys(self, t, duration):
+		if self._first is None:
+			return []
+		begin = max(self._begin(), self.bin_of(t - duration) - self._first)
+		recent = self._vals[:len(self.keys), :, begin:self._end].sum(axis=(1, 2))
+		return [key for key, i in self.keys.items() if recent[i] > 0]
+
+	"""
+	Return a read-only copy of the live bins
+	"""
+	def freeze(self):
+		frozen = copy.copy(self)
+		begin = self._begin()
+		frozen.keys = dict(self.keys)
+		frozen._vals = self._vals[:len(self.keys), :, begin:self._end].copy()
+		frozen._vals.setflags(write=False)
+		if self._first is not None:
+			frozen._first = self._first + begin
+		frozen._end = self._end - begin
+		return frozen
+
+"""
+Sum of grids with the same bins and rows, in a new grid
+"""
+def merge_grids(grids):
+	merged = grids[0].empty_like(max(1, sum(len(grid.keys) for grid in grids)))
+	for grid in grids:
+		merged.merge(grid)
+	return merged
+
+"""
+TimeGrid in shared memory, written by one process (e.g. a shard
+of the server) and read by others with read().
+The bins, the end of the grid and the names of the keys are in
+shared arrays, protected by a sequence lock: the writer wraps its
+changes (e.g. a batch of records) in begin_write() and end_write(),
+which make the sequence number odd during the changes; a reader 
+copies the bins and retries if the number changed meanwhile.
+The writer never waits for the readers.
+Records of keys beyond capacity are dropped (see dropped())
+"""
+class SharedTimeGrid(TimeGrid):
+
+	# positions in the header
+	SEQ, FIRST, END, KEYS, RECORDS, DROPPED = range(6)
+
+	def __init__(self, bin_width, window, rows, phase=0.0, capacity=SHARD_KEYS, key_size=64):
+		TimeGrid.__init__(self, bin_width, window, rows, phase, capacity=1)
+		shape = (capacity, len(rows), 2 * self.n_bins)
+		self._shared_vals = multiprocessing.RawArray(ctypes.c_float, int(np.prod(shape)))
+		self._vals = np.ctypeslib.as_array(self._shared_vals).reshape(shape)
+		self._shared_header = multiprocessing.RawArray(ctypes.c_int64, 6)
+		self._header = np.ctypeslib.as_array(self._shared_header)
+		self._names = multiprocessing.RawArray(ctypes.c_char, capacity * key_size)
+		self.key_size = key_size
+		self._added = 0 # records added since begin_write
+		self._dropped = 0
+		self._last_read = self.empty_like()
+
+	"""
+	Records added by the writer
+	"""
+	def records(self):
+		return int(self._header[self.RECORDS])
+
+	def dropped(self):
+		return int(self._header[self.DROPPED])
+
+	def begin_write(self):
+		self._header[self.SEQ] += 1
+
+	def add(self, key, row, t, val):
+		if key not in self.keys and len(self.keys) == self._vals.shape[0]:
+			self._dropped += 1
+			return
+		TimeGrid.add(self, key, row, t, val)
+		self._added += 1
+
+	"""
+	Publish the end of the grid and the names of the new keys
+	"""
+	def end_write(self):
+		header = self._header
+		if len(self.keys) > header[self.KEYS]:
+			for key, i in self.keys.items():
+				if i >= header[self.KEYS]:
+					self._names[i * self.key_size:(i + 1) * self.key_size] = \
+						key[:self.key_size].ljust(self.key_size, "\0")
+			header[self.KEYS] = len(self.keys)
+		if self._first is not None:
+			header[self.FIRST] = self._first
+		header[self.END] = self._end
+		header[self.RECORDS] += self._added
+		header[self.DROPPED] += self._dropped
+		self._added = self._dropped = 0
+		header[self.SEQ] += 1
+
+	"""
+	Return a consistent copy (a TimeGrid) of the live bins.
+	If the writer does not complete its change within timeout 
+	seconds (e.g. it died), return the last copy
+	"""
+	def read(self, timeout=1.0):
+		header = self._header
+		deadline = time.time() + timeout
+		while True:
+			seq = int(header[self.SEQ])
+			if seq % 2 == 1:
+				if time.time() > deadline:
+					return self._last_read
+				time.sleep(0) # a change is in progress
+				continue
+			first, end, n = int(header[self.FIRST]), int(header[self.END]), int(header[self.KEYS])
+			begin = max(0, end - self.n_bins)
+			names = self._names.raw[:n * self.key_size]
+			vals = self._vals[:n, :, begin:end].copy()
+			if int(header[self.SEQ]) == seq:
+				break
+		grid = self.empty_like()
+		if n > 0:
+			grid.keys = dict((names[i * self.key_size:(i + 1) * self.key_size].rstrip("\0"), i) 
+				for i in range(n))
+			grid._vals = vals
+			grid._first = first + begin
+			grid._end = end - begin
+		self._last_read = grid
+		return grid
+
+"""
+Liveness of keys (e.g. flows): a key seen at time t dies if it
+is not seen again within timeout seconds.
+The deadlines are kept in a timer wheel of slots of resolution
+seconds: seen() moves a key to the slot of its new deadline,
+advance() pops the slots expired up to now (a key dies at most
+resolution seconds late). The cost of a sample is O(1), the cost
+of a tick depends only on the keys that die.
+seen() returns the last time of a dead key coming back
+(revived), None otherwise; advance() returns the (key, last time)
+of the keys that died.
+With forget_after (e.g. the history window), a key dead for
+forget_after seconds is dropped: if seen again it is a new key
+"""
+class LivenessTracker(object):
+
+	def __init__(self, timeout, resolution=None, forget_after=None):
+		self.timeout = timeout
+		self.resolution = resolution if resolution is not None else timeout / 8.0
+		self.forget_after = forget_after
+		self.last = {} # key --> last time seen
+		self.dead = set()
+		self._slot = {} # key --> slot of its deadline
+		self._wheel = {} # slot --> keys
+		self._next = None # next slot to expire
+
+	def __len__(self):
+		return len(self.last) - len(self.dead)
+
+	def is_alive(self, key):
+		return key in self.last and key not in self.dead
+
+	def alive_keys(self):
+		return [key for key in self.last if key not in self.dead]
+
+	def seen(self, key, t):
+		last = self.last.get(key)
+		if last is not None and t <= last:
+			return None # late sample
+		self.last[key] = t
+		self._schedule(key, t + self.timeout)
+		if key in self.dead:
+			self.dead.discard(key)
+			return last
+		return None
+
+	def _schedule(self, key, deadline):
+		slot = int(math.ceil(deadline / self.resolution))
+		if self._next is not None:
+			slot = max(slot, self._next) # the slots before are expired
+		if self._slot.get(key) == slot:
+			return
+		self._unschedule(key)
+		self._wheel.setdefault(slot, set()).add(key)
+		self._slot[key] = slot
+
+	def _unschedule(self, key):
+		slot = self._slot.pop(key, None)
+		if slot is not None:
+			keys = self._wheel[slot]
+			keys.discard(key)
+			if len(keys) == 0:
+				del self._wheel[slot]
+
+	"""
+	Stop tracking key (e.g. a released flow)
+	"""
+	def forget(self, key):
+		self._unschedule(key)
+		self.last.pop(key, None)
+		self.dead.discard(key)
+
+	def advance(self, now):
+		last_slot = int(math.floor(now / self.resolution))
+		if self._next is not None and last_slot < self._next:
+			return []
+		if self._next is None or last_slot - self._next > len(self._wheel):
+			# long jump (or first tick): visit only the used slots
+			slots = sorted(slot for slot in self._wheel if slot <= last_slot)
+		else:
+			slots = range(self._next, last_slot + 1)
+		died = []
+		for slot in slots:
+			for key in self._wheel.pop(slot, ()):
+				del self._slot[key]
+				if key in self.dead:
+					# dead for forget_after seconds
+					del self.last[key]
+					self.dead.discard(key)
+					continue
+				self.dead.add(key)
+				died.append((key, self.last[key]))
+				if self.forget_after is not None:
+					self._schedule(key, self.last[key] + self.timeout + self.forget_after)
+		self._next = last_slot + 1
+		return died
+
+"""
+Frozen copy of a data structure: nested dicts of TimeSeries
+and TimeGrid (other values are kept as they are)
+"""
+def freeze(data):
+	if isinstance(data, dict):
+		return dict((key, freeze(value)) for key, value in data.items())
+	if isinstance(data, (TimeSeries, TimeGrid)):
+		return data.freeze()
+	return data
+
+"""
+Incremental smoother of a TimeSeries.
+The series is resampled (linear interpolation) on a grid of step
+seconds aligned to the absolute time, then filtered with:
+	- hann: Hann FIR of window samples, centered
+	- ewma: exponentially weighted moving average (alpha = 2 / (window + 1))
+	- sma : causal moving average of window samples
+The samples before the horizon given by the caller do not change any more:
+their resampled values go through the filter once, and the filter keeps
+its state (the last window - 1 inputs, or the last EWMA output).
+Only the tail after the horizon is filtered again at each update,
+from the saved state: the cost is proportional to the new samples.
+The smoothed series is published in smoothed (final values)
+plus tail_t, tail_val (provisional values)
+"""
+class StreamingSmoother(object):
+
+	KINDS = ["hann", "ewma", "sma"]
+
+	def __init__(self, step, window, kind="hann", history=60):
+		if kind not in self.KINDS:
+			raise ValueError("Unknown smoothing {}".format(kind))
+		self.step = step
+		self.window = max(1, window)
+		self.kind = kind
+		self.history = history
+		if kind == "hann":
+			w = np.hanning(self.window + 2)[1:-1] # no zero weights at the borders
+			self.kernel = w / w.sum()
+			self.delay = self.window / 2
+		else:
+			self.kernel = np.ones(self.window) / self.window
+			self.delay = 0
+		self.alpha = 2.0 / (self.window + 1)
+		self.reset()
+
+	def reset(self):
+		self.smoothed = TimeSeries(self.history)
+		self.tail_t = np.zeros(0)
+		self.tail_val = np.zeros(0)
+		self._next = None # grid index of the next final input
+		self._inputs = np.zeros(0) # last window - 1 final inputs (FIR state)
+		self._last = None # last final output (EWMA state)
+
+	"""
+	Filter the inputs x of the grid indexes k0, k0+1...
+	from the current state: return (grid indexes, outputs, new state).
+	With final, the outputs that the next inputs could change are not returned
+	"""
+	def _filter(self, k0, x, final):
+		if self.kind == "ewma":
+			y = np.empty(len(x))
+			last = self._last
+			for i in range(len(x)):
+				last = x[i] if last is None else self.alpha * x[i] + (1 - self.alpha) * last
+				y[i] = last
+			return k0 + np.arange(len(x)), y, last
+
+		history = self._inputs
+		first = len(history) == 0
+		if first:
+			# first inputs: the series is extended with its first value
+			history = np.repeat(x[:1], self.window - 1)
+		z = np.concatenate((history, x))
+		if not final:
+			# provisional tail: extended with its last value
+			z = np.concatenate((z, np.repeat(z[-1:], self.delay)))
+		if len(z) < self.window:
+			return np.zeros(0, dtype=int), np.zeros(0), history
+		y = np.convolve(z, self.kernel, mode="valid")
+		# the output of a window is the one of its sample delay from the end
+		k = k0 - len(history) + self.window - 1 - self.delay + np.arange(len(y))
+		if first:
+			y, k = y[k >= k0], k[k >= k0]
+		if not final:
+			return k, y, None
+		return k, y, z[len(z) - (self.window - 1):]
+
+	"""
+	Smooth the new samples of series.
+	horizon: the samples of series before it will not change any more
+	"""
+	def update(self, series, horizon):
+		if len(series) == 0:
+			return
+		t, val = series.t, series.val
+		first = int(math.ceil(t[0] / self.step))
+		if self._next is None or self._next < first:
+			# first update, or the samples to be resampled have been evicted
+			self.reset()
+			self._next = first
+
+		# final grid points: before the last sample preceding the horizon
+		stable = int(np.searchsorted(t, horizon)) - 1
+		k_stable = self._next
+		if stable >= 0:
+			k_stable = max(self._next, int(math.ceil(t[stable] / self.step)))
+		k_last = int(math.floor(t[-1] / self.step))
+
+		grid = np.arange(self._next, k_stable) * self.step
+		if len(grid) > 0:
+			k, y, state = self._filter(self._next, np.interp(grid, t, val), True)
+			if self.kind == "ewma":
+				self._last = state
+			else:
+				self._inputs = state
+			self.smoothed.extend(k * self.step, y)
+			self._next = k_stable
+
+		# provisional tail (also the outputs still waiting for the next inputs)
+		grid = np.arange(k_stable, k_last + 1) * self.step
+		self.tail_t, self.tail_val = np.zeros(0), np.zeros(0)
+		if len(grid) > 0 or len(self._inputs) > 0:
+			k, y, state = self._filter(k_stable, np.interp(grid, t, val), False)
+			self.tail_t, self.tail_val = k * self.step, y
+
+	"""
+	Return (t, val) of the smoothed series from t_left on
+	"""
+	def view(self, t_left):
+		t, val = self.smoothed.window_view(t_left)
+		return np.concatenate((t, self.tail_t)), np.concatenate((val, self.tail_val))
+
+"""
+Single writer of the data structure.
+The parser threads only parse their lines and put the records in a
+bounded queue; one aggregator thread takes them in batches (up to 
+max_batch records) and applies each batch with apply_batch(records), 
+holding lock for the whole batch instead of once per line.
+After each batch the publisher (if any) is updated, and the 
+pending changes are published when the queue is idle.
+Parsing does not wait for the readers of the data (e.g. the plot)
+"""
+class Aggregator(object):
+
+	def __init__(self, apply_batch, lock, maxsize=QUEUE_SIZE, max_batch=4096, publisher=None):
+		self.apply_batch = apply_batch
+		self.lock = lock
+		self.publisher = publisher
+		self.max_batch = max_batch
+		self.queue = Queue.Queue(maxsize)
+		self.batches = 0
+		self.records = 0
+		self.max_backlog = 0 # max items (records or blocks) found in the queue
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+
+	def start(self):
+		self._thread.start()
+
+	"""
+	Called by the parser threads: wait only if the queue is full
+	"""
+	def put(self, record):
+		self.queue.put((record,))
+
+	"""
+	Put the records of a block parsed at once: 
+	a single item of the queue
+	"""
+	def put_batch(self, records):
+		if len(records) > 0:
+			self.queue.put(records)
+
+	def _run(self):
+		while not self._stop.is_set() or not self.queue.empty():
+			try:
+				batch = list(self.queue.get(timeout=0.1))
+			except Queue.Empty:
+				if self.publisher is not None:
+					with self.lock:
+						self.publisher.flush()
+				continue
+			self.max_backlog = max(self.max_backlog, self.queue.qsize() + 1)
+			try:
+				while len(batch) < self.max_batch:
+					batch.extend(self.queue.get_nowait())
+			except Queue.Empty:
+				pass
+			try:
+				with self.lock:
+					self.apply_batch(batch)
+					if self.publisher is not None:
+						self.publisher.update()
+			except Exception:
+				traceback.print_exc()
+			self.batches += 1
+			self.records += len(batch)
+		if self.publisher is not None:
+			with self.lock:
+				self.publisher.flush()
+
+	"""
+	Apply the records still in the queue, then terminate
+	"""
+	def stop(self):
+		self._stop.set()
+		self._thread.join()
+
+"""
+Records of parsers running in the thread that applies them 
+(e.g. the ProcessMux of a worker process): put() collects
+the records, flush() applies them with apply_batch(records).
+Cheaper than an Aggregator when there is no other writer thread
+"""
+class RecordBatch(object):
+
+	def __init__(self, apply_batch):
+		self.apply_batch = apply_batch
+		self.records = []
+
+	def put(self, record):
+		self.records.append(record)
+
+	def put_batch(self, records):
+		self.records.extend(records)
+
+	def flush(self):
+		if len(self.records) > 0:
+			records, self.records = self.records, []
+			self.apply_batch(records)
+
+"""
+Immutable state of the data published at clock time t:
+the fields returned by the snapshot function become attributes
+"""
+class Snapshot(object):
+
+	def __init__(self, version, t, fields):
+		self.version = version
+		self.t = t
+		self.__dict__.update(fields)
+
+"""
+Double-buffered publication of the data for the readers 
+(plot, checks, exporters).
+The writer, holding the lock of the data, calls update() after
+its changes: at most once per interval seconds make_snapshot()
+builds the fields of a new Snapshot (frozen series, see freeze),
+which replaces latest with a single assignment.
+Readers take latest without the lock: what they read never 
+changes, and unchanged series are shared between snapshots
+"""
+class Publisher(object):
+
+	def __init__(self, make_snapshot, interval):
+		self.make_snapshot = make_snapshot
+		self.interval = interval
+		self.latest = None # last Snapshot (None before the first publication)
+		self.version = 0
+		self._dirty = False
+		self._published = None # clock time of the last publication
+
+	"""
+	Called by the writer after a change
+	"""
+	def update(self):
+		self._dirty = True
+		if self._published is None or clock() - self._published >= self.interval:
+			self.publish()
+
+	"""
+	Publish the changes not published yet
+	"""
+	def flush(self):
+		if self._dirty:
+			self.publish()
+
+	def publish(self):
+		self.version += 1
+		self._published = clock()
+		self.latest = Snapshot(self.version, self._published, self.make_snapshot())
+		self._dirty = False
+
+"""
+Command source: maps the command line of a measurement tool 
+(iperf, bwm-ng, ping, tcp-probe, sudo...) to the command actually executed.
+None means the command is skipped.
+By default commands are executed as they are; a load test
+replaces the tools with local fake producers (see loadgen.py)
+"""
+_command_source = None
+
+def set_command_source(source):
+	global _command_source
+	_command_source = source
+
+def resolve_command(command):
+	if _command_source is None:
+		return command
+	return _command_source(command)
+
 """
 Executes a programm (command string) and returns output lines
 """
 def runPexpect(exe):
+	exe = resolve_command(exe)
+	if exe is None:
+		return
 	child = pexpect.spawn(exe, timeout=None)
 	for line in child:
 		yield line
 
+"""
+Event loop running several programs and reading their output
+from one thread (instead of a pexpect thread per program).
+The output of each program (stderr merged) goes through a plain pipe,
+line buffered by stdbuf -oL when available: the loop polls all the
+pipes, reads what is ready in chunks of up to chunk bytes, splits the
+lines in bulk and hands each source the list of its complete lines.
+A program added with restart=True is started again restart_delay
+seconds after it terminates; all the programs are terminated
+when stop is set. after_dispatch (if any) is called after the
+lines of each poll are dispatched (e.g. see RecordBatch)
+"""
+class ProcessMux(object):
+
+	def __init__(self, stop, chunk=READ_CHUNK, restart_delay=1.0, after_dispatch=None):
+		self.stop = stop
+		self.chunk = chunk
+		self.restart_delay = restart_delay
+		self.after_dispatch = after_dispatch
+		self.lines = 0 # lines dispatched
+		self.restarts = 0
+		self._sources = {} # fd --> source of the running programs
+		self._waiting = [] # (restart time, source) of the terminated programs
+		self._poll = select.poll()
+		self._stdbuf = distutils.spawn.find_executable("stdbuf")
+
+	"""
+	Run command (see resolve_command) and call handler(lines) 
+	with its output lines, without line terminators.
+	With blocks, handler(block) receives instead the string of the
+	complete lines read at once (terminators included): bulk parsers
+	split it themselves.
+	Return False if the command is skipped
+	"""
+	def add(self, name, command, handler, restart=False, blocks=False):
+		command = resolve_command(command)
+		if command is None:
+			return False
+		self._start({
+			"name"		: name,
+			"command"	: command,
+			"handler"	: handler,
+			"restart"	: restart,
+			"blocks"	: blocks
+		})
+		return True
+
+	def _start(self, source):
+		args = shlex.split(source["command"])
+		if self._stdbuf is not None:
+			args = [self._stdbuf, "-oL"] + args
+		try:
+			proc = subprocess.Popen(args, stdout=subprocess.PIPE, 
+				stderr=subprocess.STDOUT, close_fds=True)
+		except OSError as e:
+			print "{}: cannot execute {} ({})".format(source["name"], source["command"], e)
+			self._schedule(source)
+			return
+		source["proc"] = proc
+		source["partial"] = "" # last line, not complete yet
+		fd = proc.stdout.fileno()
+		self._sources[fd] = source
+		self._poll.register(fd, select.POLLIN | select.POLLHUP | select.POLLERR)
+
+	"""
+	Restart a terminated program later, if required
+	"""
+	def _schedule(self, source):
+		if source["restart"] and not self.stop.is_set():
+			self._waiting.append((time.time() + self.restart_delay, source))
+		else:
+			print "{} terminated".format(source["name"])
+
+	def _dispatch(self, source, lines):
+		if source["blocks"]:
+			self.lines += lines.count("\n")
+		else:
+			self.lines += len(lines)
+		try:
+			source["handler"](lines)
+		except Exception:
+			traceback.print_exc()
+
+	def _read(self, fd):
+		source = self._sources[fd]
+		try:
+			chunk = os.read(fd, self.chunk)
+		except OSError:
+			chunk = ""
+		if len(chunk) == 0:
+			self._terminated(fd)
+			return
+		if source["blocks"]:
+			block = source["partial"] + chunk
+			end = block.rfind("\n") + 1
+			source["partial"] = block[end:]
+			if end > 0:
+				self._dispatch(source, block[:end])
+			return
+		lines = (source["partial"] + chunk).split("\n")
+		source["partial"] = lines.pop()
+		if len(lines) > 0:
+			self._dispatch(source, lines)
+
+	def _terminated(self, fd):
+		source = self._sources.pop(fd)
+		self._poll.unregister(fd)
+		if len(source["partial"]) > 0:
+			if source["blocks"]:
+				self._dispatch(source, source["partial"] + "\n")
+			else:
+				self._dispatch(source, [source["partial"]])
+		source["proc"].stdout.close()
+		source["proc"].wait()
+		self._schedule(source)
+
+	"""
+	Terminate a program, kill it if it does not exit within timeout seconds
+	"""
+	def _terminate(self, proc, timeout=1.0):
+		try:
+			proc.terminate()
+			deadline = time.time() + timeout
+			while proc.poll() is None and time.time() < deadline:
+				time.sleep(0.01)
+			if proc.poll() is None:
+				proc.kill()
+				proc.wait()
+		except OSError:
+			pass # already terminated
+
+	"""
+	Dispatch the output of the programs until stop is set 
+	(or no program is left), then terminate them
+	"""
+	def run(self):
+		while not self.stop.is_set() and (len(self._sources) > 0 or len(self._waiting) > 0):
+			try:
+				events = self._poll.poll(POLL_TIMEOUT)
+			except select.error:
+				continue # interrupted by a signal
+			for fd, event in events:
+				if fd in self._sources:
+					self._read(fd)
+			if self.after_dispatch is not None and len(events) > 0:
+				self.after_dispatch()
+
+			now = time.time()
+			ready = [source for t, source in self._waiting if t <= now]
+			self._waiting = [(t, source) for t, source in self._waiting if t > now]
+			for source in ready:
+				self.restarts += 1
+				self._start(source)
+		self.close()
+
+	def close(self):
+		for fd in self._sources.keys():
+			source = self._sources.pop(fd)
+			self._poll.unregister(fd)
+			self._terminate(source["proc"])
+			source["proc"].stdout.close()
+			print "{} terminated".format(source["name"])
+		for t, source in self._waiting:
+			print "{} terminated".format(source["name"])
+		self._waiting = []
+
 """
 Executes a command in background (no output!)
 """
@@ -91,13 +1439,15 @@ def launch_bg(command, do_print=False):
 Execute a command in the shell
 """
 def cmd(command):
-	subprocess.call(command, shell=True) 
+	command = resolve_command(command)
+	if command is not None:
+		subprocess.call(command, shell=True) 
 
 """
 Execute a sudo command in the shell
 """
 def sudo_cmd(command):
-	subprocess.call("sudo {}".format(command), shell=True) 
+	cmd("sudo {}".format(command))
 
 """ 
 Effectivelly kill all process with given name 
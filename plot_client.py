@@ -1,11 +1,12 @@
 #!/usr/bin/python
 
-import sys, time, datetime, getopt, subprocess, os, threading, pexpect, tty, termios, re, matplotlib
-import matplotlib.pyplot as plt
+import sys, time, datetime, getopt, subprocess, os, threading, pexpect, tty, termios, re
 import numpy as np
 import argparse
-from matplotlib.font_manager import FontProperties
 from mylib import *
+from recorder import Recorder
+from plotlib import *
+from sampler import NetDevSampler, TcpInfoSampler, SAMPLE_PERIOD
 
 UPDATE_INTERVAL = 1					
 sem_data 		= threading.Semaphore(1) 	# semaphore for operations on data
@@ -13,6 +14,12 @@ stop 			= threading.Event() 		# set if the program is running
 pause			= threading.Event()			# set if the graph is in pause
 screenshot 		= threading.Event() 		# set if a screenshot is required
 global t0 	# unix timestamp of the reference instant
+recorder 		= None 					# Recorder of the parsed samples (None if not recording)
+aggregator		= None					# Aggregator applying the parsed records (None: applied by the parsers)
+publisher		= None					# Publisher of the snapshots read by the plot
+flows			= None					# LivenessTracker of the cwnd of the flows (see update_death_flows)
+view			= "lines"				# view of the flows: a line each, or the top_k and the others in a FlowView
+top_k			= TOP_K					# flows drawn as lines in the collection view (named in the heatmap)
 
 """
 The graph keeps expanding until MAX_TIME_WINDOW [seconds],
@@ -20,6 +27,44 @@ then starts to slide and delete out-of-graph data
 """
 MAX_TIME_WINDOW = 30
 
+# with blitting, the x window moves by steps of X_STEP seconds
+X_STEP = MAX_TIME_WINDOW / 4.0
+
+# seconds of samples kept in memory for each series
+HISTORY_WINDOW = MAX_TIME_WINDOW + 2
+
+# subplots of the flows, drawn in a FlowView with the collection and heatmap views
+FLOW_KEYS = ["cwnd", "rtt"]
+
+# seconds of a bin of the heatmaps of the flows
+FLOW_BIN_WIDTH = MAX_TIME_WINDOW / 120.0
+
+# tcp-probe produces a sample per ACK: the samples of a flow are stored
+# thinned to the min and max of each PROBE_RESOLUTION seconds (see thin_min_max)
+PROBE_RESOLUTION = 0.001
+
+# samples of a flow: the whole history window at any ACK rate
+# (two per bucket, twice for the buckets split between two blocks)
+PROBE_CAPACITY = 4 * int(HISTORY_WINDOW / PROBE_RESOLUTION)
+
+# columns of a tcp-probe record parsed into arrays (see parse_tcp_probe_block)
+TCP_PROBE_COLUMNS = {
+	"t"			: 0,
+	"cwnd"		: 6,
+	"ssthresh"	: 7,
+	"snd_wnd"	: 8,
+	"srtt"		: 9
+}
+TCP_PROBE_SRC = 1		# column of the source IP:port
+SRTT_TO_MS = 1e-3		# srtt of tcp-probe (3.15 and later) and tcp_info is in us
+TCP_PROBE_MIN_COLS = 10	# records before 3.12 have no rcv_wnd
+
+# default seconds between two samples of tcp_info (instead of tcp-probe)
+TCP_INFO_PERIOD = 0.05
+
+# seconds between two snapshots of the data published for the plot
+PUBLISH_INTERVAL = UPDATE_INTERVAL / 2.0
+
 IPERF_REPORT_INTERVAL = 1
 
 # time with no reports to considered a user as dead
@@ -30,188 +75,356 @@ Prepare the system to collect tcp flows information
 """
 def insert_tcp_probe_module(tcp_server_port):
 	# instruct linux to forget previous tcp sessions
-	subprocess.call("sudo sysctl -w net.ipv4.tcp_no_metrics_save=1", shell=True) 
+	sudo_cmd("sysctl -w net.ipv4.tcp_no_metrics_save=1")
 	# insert a new tcp_probe module
-	subprocess.call("sudo modprobe tcp_probe port={} full=1".format(tcp_server_port), shell=True) 
+	sudo_cmd("modprobe tcp_probe port={} full=1".format(tcp_server_port))
 	# obtain permits to modify the tcp-probe output file
-	subprocess.call("sudo chmod 444 /proc/net/tcpprobe", shell=True) 
+	sudo_cmd("chmod 444 /proc/net/tcpprobe")
 
 
 """
-Thread that execute, parse and write ping (rtt measure)
+Start ping (path rtt, besides the srtt of the flows): 
+mux dispatches its reports
 """
-def ping_thread(data, server_ip):
+def ping_source(mux, data, server_ip):
 	cmd = "ping -i {} -D {}".format(UPDATE_INTERVAL, server_ip)
 
-	samples = data["samples"][server_ip]
+	def handle_lines(lines):
+		for line in lines:
+			handle_ping_line(data, line, server_ip)
 
-	for line in runPexpect(cmd):
-		if stop.is_set():
-			break
-		"""
-		example line: 
-		1                   2  3     4    5              6           7      8
-		[1437417582.711328] 64 bytes from 10.100.13.214: icmp_seq=21 ttl=64 time=0.104 ms
-		"""
-		cols = line.split(" ")
-		if len(cols) == 9 and line[0] == "[": #only reports, not the final average			
-			stamp = float((cols[0])[1:len(cols[0])-1])-t0
-			cols2 = cols[7].split("=")
-			
-			if len(cols2) != 2:
-				continue
-			
-			rtt = float(cols2[1])
-			
-			with sem_data:
-				samples["t"].append(stamp)
-				samples["val"].append(rtt)
-				if rtt > data["max"]:
-					data["max"] = rtt
-					data["t_max"] = stamp
+	mux.add("ping", cmd, handle_lines, restart=True)
 
+"""
+Parse a ping report and update data
+"""
+def handle_ping_line(data, line, server_ip):
+	"""
+	example line: 
+	1                   2  3     4    5              6           7      8
+	[1437417582.711328] 64 bytes from 10.100.13.214: icmp_seq=21 ttl=64 time=0.104 ms
+	"""
+	cols = line.split(" ")
+	if len(cols) == 9 and line[0] == "[": #only reports, not the final average			
+		stamp = float((cols[0])[1:len(cols[0])-1])-t0
+		cols2 = cols[7].split("=")
+		
+		if len(cols2) != 2:
+			return
+		
+		rtt = float(cols2[1])
+
+		submit(data, ("rtt", server_ip, stamp, rtt))
 
 """
-Thread that execute, parse and write bwm-ng (bandwidth measure)
+Start bwm-ng (bandwidth measure): mux dispatches its reports
 """
-def bwm_ng_thread(data, intf):
+def bwm_ng_source(mux, data, intf):
 	cmd ="bwm-ng -u bits -T rate -t {} -I {} -d 0 -c 0 -o csv".format(UPDATE_INTERVAL*1000, intf)
 
-	samples = data["samples"][intf]	
+	def handle_lines(lines):
+		for line in lines:
+			handle_bwm_ng_line(data, line, intf)
 
-	for line in runPexpect(cmd):
-		if stop.is_set():
-			break
-		"""
-		example lines: 
-		0          1    2       3         4         5     6   7     8      9      10 11 12  13  14 15
-		1437515226;eth0;1620.00;123595.00;125215.00;24719;324;25.00;110.00;135.00;22;5;0.00;0.00;0;0
-		1437515226;total;1620.00;123595.00;125215.00;24719;324;25.00;110.00;135.00;22;5;0.00;0.00;0;0
-
-		0: unix timestamp	*
-		1: interface
-		2: bytes_out/s 		*
-		3: bytes_in/s
-		4: bytes_total/s
-		5: bytes_in
-		6: bytes_out
-		7: packets_out/s
-		8: packets_in/s
-		9: packets_total/s
-		10: packets_in
-		11: packets_out
-		12: errors_out/s
-		13: errors_in/s
-		14: errors_in
-		15: errors_out 
-
-		Timestamps has a resolution in seconds, so we take a report every second
-
-		The first (like) 10 timestamps comes at 1ms distance, 
-		the others every 1sec
-
-		Also if passing the -u bits option, rate remains is in byte/s
+	mux.add("bwm-ng", cmd, handle_lines, restart=True)
 
-		"""
-		if line.find("total") != -1 : # only reports, not the total
-			continue
+"""
+Parse a bwm-ng report and update data
+"""
+def handle_bwm_ng_line(data, line, intf):
+	"""
+	example lines: 
+	0          1    2       3         4         5     6   7     8      9      10 11 12  13  14 15
+	1437515226;eth0;1620.00;123595.00;125215.00;24719;324;25.00;110.00;135.00;22;5;0.00;0.00;0;0
+	1437515226;total;1620.00;123595.00;125215.00;24719;324;25.00;110.00;135.00;22;5;0.00;0.00;0;0
+
+	0: unix timestamp	*
+	1: interface
+	2: bytes_out/s 		*
+	3: bytes_in/s
+	4: bytes_total/s
+	5: bytes_in
+	6: bytes_out
+	7: packets_out/s
+	8: packets_in/s
+	9: packets_total/s
+	10: packets_in
+	11: packets_out
+	12: errors_out/s
+	13: errors_in/s
+	14: errors_in
+	15: errors_out 
+
+	Timestamps has a resolution in seconds, so we take a report every second
+
+	The first (like) 10 timestamps comes at 1ms distance, 
+	the others every 1sec
+
+	Also if passing the -u bits option, rate remains is in byte/s
 
-		cols = line.split(";")
-		stamp = int(cols[0])-t0 
-		rate = float(cols[2])*8 # conversion byte/s --> bit/s
-		with sem_data:
-			samples["t"].append(stamp)
-			samples["val"].append(rate)
-			if rate > data["max"]:
-				data["max"] = rate
-				data["t_max"] = stamp
+	"""
+	if line.find("total") != -1 : # only reports, not the total
+		return
+
+	cols = line.split(";")
+	stamp = int(cols[0])-t0 
+	rate = float(cols[2])*8 # conversion byte/s --> bit/s
+
+	submit(data, ("txrate", intf, stamp, rate))
+
+"""
+Handle a sample of the interface counters (see NetDevSampler):
+the output rate of the interface is txrate
+"""
+def handle_net_dev_sample(data, t, rx, tx, intf):
+	if not np.isnan(tx[0]):
+		submit(data, ("txrate", intf, t - t0, tx[0]))
 
 """
-Thread that execute, parse and write tcp-probe (congestion window measure)
+Start reading tcp-probe (congestion window measure): mux dispatches 
+its records in blocks, parsed at once
 """
-def tcp_probe_thread(data):
+def tcp_probe_source(mux, data):
 	cmd = "cat /proc/net/tcpprobe"
 
 	# Create the dictionary for the summation of windows
-	# data["samples"]["SUM"] = {"t":[], "val":[] }
-
-	samples = data["samples"]
-
-	cwnd_min = 0
-
-	for line in runPexpect(cmd):
-		if stop.is_set():
-			break
-		""" 
-		example line:
-		0           1                   2                  3  4          5          6  7  8      9 10
-		0.000605295 10.100.13.162:45758 10.100.13.214:5001 32 0xf76a3a5b 0xf7692adb 48 41 292992 1 29312
-		source code: http://lxr.free-electrons.com/source/net/ipv4/tcp_probe.c?v=3.12
-		0: Time in seconds					*
-		1: Source IP:Port 					*
-		2: Dest IP: Port
-		3: Packet length (bytes)
-		4: snd_nxt
-		5: snd_una
-		6: snd_cwnd							*
-		7: ssthresh 						
-		8: snd_wnd 							
-		9: srtt  							
-		10: rcv_wnd (3.12 and later)
-		"""
+	# data["samples"]["SUM"] = TimeSeries(HISTORY_WINDOW)
 
-		cols = line.split(" ")
-		stamp = float(cols[0])
-		src = str(cols[1])
-		cwnd = int(cols[6])
+	cwnd_min = [0]
 
-		with sem_data:	
+	def handle_block(block):
+		cwnd_min[0] = handle_tcp_probe_block(data, block, cwnd_min[0])
 
-			"""
-			Since tcp-probe does not advise of a flow termination,
-			we should declare it dead after some time without information
-			and write a zero in that point.
-			The min is to have a more realistic initial window ("zero")
-			(notable only with low rates)
-			"""
-			cwnd_min = min(cwnd, cwnd_min)
+	mux.add("tcp-probe", cmd, handle_block, restart=True, blocks=True)
+
+"""
+Parse a block of tcp-probe records (complete lines) into columns.
+Return (srcs, columns): srcs is the list of the flows, columns maps
+the names of TCP_PROBE_COLUMNS and "flow" (index in srcs) to arrays
+with a value per record. Lines with missing columns or
+non-numeric values are skipped
+"""
+def parse_tcp_probe_block(block):
+	""" 
+	example line:
+	0           1                   2                  3  4          5          6  7  8      9 10
+	0.000605295 10.100.13.162:45758 10.100.13.214:5001 32 0xf76a3a5b 0xf7692adb 48 41 292992 1 29312
+	source code: http://lxr.free-electrons.com/source/net/ipv4/tcp_probe.c?v=3.12
+	0: Time in seconds					*
+	1: Source IP:Port 					*
+	2: Dest IP: Port
+	3: Packet length (bytes)
+	4: snd_nxt
+	5: snd_una
+	6: snd_cwnd							*
+	7: ssthresh 						
+	8: snd_wnd 							
+	9: srtt  							
+	10: rcv_wnd (3.12 and later)
+	"""
+	tokens = block.split()
+	n_cols = len(block[:block.find("\n")].split())
+	if n_cols < TCP_PROBE_MIN_COLS or len(tokens) != n_cols * block.count("\n"):
+		# lines of different lengths (e.g. truncated): keep the common columns
+		n_cols = TCP_PROBE_MIN_COLS
+		tokens = [token for row in (line.split() for line in block.splitlines())
+			if len(row) >= n_cols for token in row[:n_cols]]
+
+	try:
+		return tcp_probe_columns(tokens, n_cols)
+	except ValueError:
+		# parse the lines one by one to skip the malformed ones
+		rows = [tokens[i:i + n_cols] for i in range(0, len(tokens), n_cols)]
+		valid = []
+		for row in rows:
+			try:
+				tcp_probe_columns(row, n_cols)
+				valid.extend(row)
+			except ValueError:
+				pass
+		return tcp_probe_columns(valid, n_cols)
 
-			# if there is a new connection, create its record
-			if src not in data["samples"]:
-				samples[src]= {"t":[], "val":[]}
+"""
+Flows and columns of the tokens of whole lines of n_cols columns
+(see parse_tcp_probe_block). Raise ValueError if a value is not a number
+"""
+def tcp_probe_columns(tokens, n_cols):
+	srcs = tokens[TCP_PROBE_SRC::n_cols]
+	names = sorted(set(srcs))
+	if len(names) == 1:
+		flow = np.zeros(len(srcs), dtype=int)
+	else:
+		index = dict((name, i) for i, name in enumerate(names))
+		flow = np.array([index[src] for src in srcs], dtype=int)
+
+	columns = dict((name, np.array(tokens[col::n_cols], dtype=float)) 
+		for name, col in TCP_PROBE_COLUMNS.items())
+	columns["flow"] = flow
+	return names, columns
+
+"""
+Parse a block of tcp-probe records and update data:
+a cwnd record for each flow, with the arrays of its samples.
+Return the updated min window
+"""
+def handle_tcp_probe_block(data, block, cwnd_min):
+	srcs, columns = parse_tcp_probe_block(block)
+	if len(srcs) == 0:
+		return cwnd_min
+	return submit_flow_columns(data, srcs, columns, cwnd_min)
 
-			# Save data 	
-			samples[src]["t"].append(stamp)
-			samples[src]["val"].append(cwnd)
+"""
+Submit a cwnd and an rtt record for each flow of srcs, with the 
+arrays of its samples in columns (see parse_tcp_probe_block).
+Return the updated min window
+"""
+def submit_flow_columns(data, srcs, columns, cwnd_min):
+	"""
+	Since tcp-probe does not advise of a flow termination,
+	we should declare it dead after some time without information
+	and write a zero in that point.
+	The min is to have a more realistic initial window ("zero")
+	(notable only with low rates)
+	"""
+	cwnd = columns["cwnd"]
+	cwnd_min = min(int(cwnd.min()), cwnd_min)
+	rtt = columns["srtt"] * SRTT_TO_MS
 
-			update_death_flows(samples, stamp, cwnd_min)
+	# the records of each flow, in their order
+	order = np.argsort(columns["flow"], kind="mergesort")
+	bounds = np.searchsorted(columns["flow"][order], np.arange(1, len(srcs)))
+	for src, rows in zip(srcs, np.split(order, bounds)):
+		t = columns["t"][rows]
+		submit(data, ("cwnd", src, t, cwnd[rows], cwnd_min))
+		submit(data, ("rtt", src, t, rtt[rows]))
+
+	return cwnd_min
+
+"""
+Sampler of the tcp_info of the flows to tcp_port, 
+an alternative to tcp-probe for the cwnd plot (see TcpInfoSampler):
+it requires neither the tcp_probe module nor sudo
+"""
+def tcp_info_sampler(data, tcp_port, period=TCP_INFO_PERIOD):
+	cwnd_min = [0]
+
+	def handle_sample(t, srcs, columns):
+		cwnd_min[0] = handle_tcp_info_sample(data, t, srcs, columns, cwnd_min[0])
+
+	return TcpInfoSampler(tcp_port, handle_sample, stop, period)
+
+"""
+Handle a sample of the tcp_info of the flows: a sample of each flow
+Return the updated min window
+"""
+def handle_tcp_info_sample(data, t, srcs, columns, cwnd_min):
+	if len(srcs) == 0:
+		return cwnd_min
+	columns["t"] = np.full(len(srcs), t - t0)
+	return submit_flow_columns(data, srcs, columns, cwnd_min)
+
+"""
+Parse a single tcp-probe record (see handle_tcp_probe_block)
+"""
+def handle_tcp_probe_line(data, line, cwnd_min):
+	return handle_tcp_probe_block(data, line.rstrip("\n") + "\n", cwnd_min)
+
+"""
+Apply a batch of parsed records (key, src, t, val).
+The records of the flows (cwnd and rtt) carry the arrays of 
+their samples (t and val); cwnd records also the min window.
+The death of the flows is checked once per batch
+"""
+def apply_records(data, records):
+	cwnd_last = None # last (t, cwnd_min) of the batch
+	for record in records:
+		key, src, stamp, val = record[:4]
+		if key == "cwnd":
+			apply_cwnd_samples(data, src, stamp, val, record[4])
+			if cwnd_last is None or stamp[-1] > cwnd_last[0]:
+				cwnd_last = (stamp[-1], record[4])
+			continue
+		if isinstance(stamp, np.ndarray):
+			apply_flow_samples(data, key, src, stamp, val)
+			continue
 
-			if cwnd > data["max"]:
-				data["max"] = cwnd
-				data["t_max"] = stamp
-			#update_cwnd_sum(data,stamp)
+		if recorder is not None:
+			recorder.record(key + "/" + src, stamp, val)
 
+		# Save data
+		data[key]["samples"][src].append(stamp, val)
+		#update_cwnd_sum(data,stamp)
 
+	if cwnd_last is not None:
+		update_death_flows(data["cwnd"]["samples"], *cwnd_last)
+
+"""
+Append the arrays of cwnd samples of the flow src (in time order)
+"""
+def apply_cwnd_samples(data, src, stamps, vals, cwnd_min):
+	samples = data["cwnd"]["samples"]
+	# declare the deaths up to the first sample: 
+	# a flow back after a death starts from a zero
+	update_death_flows(samples, stamps[0], cwnd_min)
+	if flows.seen(src, stamps[0]) is not None:
+		series = samples[src]
+		if series.last_t() < stamps[0] - IPERF_REPORT_INTERVAL:
+			series.append(stamps[0] - IPERF_REPORT_INTERVAL, cwnd_min)
+	apply_flow_samples(data, "cwnd", src, stamps, vals)
+	flows.seen(src, stamps[-1])
+
+"""
+Append the arrays of samples of the flow src (in time order) 
+to the series of key. All the samples are recorded, the series 
+keeps them thinned to PROBE_RESOLUTION
+"""
+def apply_flow_samples(data, key, src, stamps, vals):
+	if recorder is not None:
+		recorder.record_batch(key + "/" + src, stamps, vals)
+	stamps, vals = thin_min_max(stamps, vals, PROBE_RESOLUTION)
+
+	samples = data[key]["samples"]
+	# if there is a new connection, create its record
+	if src not in samples:
+		samples[src] = TimeSeries(HISTORY_WINDOW, PROBE_CAPACITY, extremes=True)
+
+	samples[src].extend(stamps, vals)
+
+"""
+Hand a parsed record to the aggregator,
+or apply it at once if there is no aggregator (e.g. replay)
+"""
+def submit(data, record):
+	if aggregator is not None:
+		aggregator.put(record)
+	else:
+		with sem_data:
+			apply_records(data, [record])
+			if publisher is not None:
+				publisher.update()
+
+"""
+Publisher of the snapshots of data (frozen series).
+The first snapshot is published at once: the plot takes 
+the layout of the subplots from it
+"""
+def new_publisher(data):
+	publisher = Publisher(lambda: {"data" : freeze(data)}, PUBLISH_INTERVAL)
+	publisher.publish()
+	return publisher
 
 """
 data is data[key]["samples"]
 if the last sample is too far, 
 we create a null sample just after the last sample.
-The last sample is considered the dead point
-Apply this only to summation line
+The last sample is considered the dead point.
+flows reports only the flows dying at stamp (once per death),
+instead of checking all of them
 """
 def update_death_flows(data, stamp, cwnd_min):
-	for src in data:
-		if len(data[src]["t"]) <= 0:
-			continue
-
-		if len(data[src]["t"]) > 0:
-			# Take the last istant
-			last_t = data[src]["t"][-1]
-			# If it's too far, put a "zero" just after the last sample
-			if abs(stamp - last_t) >= DEATH_TOLERANCE:
-				data[src]["t"].append(last_t + IPERF_REPORT_INTERVAL) 	
-				data[src]["val"].append(cwnd_min)	
+	for src, last_t in flows.advance(stamp):
+		# put a "zero" just after the last sample
+		data[src].append(last_t + IPERF_REPORT_INTERVAL, cwnd_min)
 
 
 
@@ -368,7 +581,20 @@ def keyboard_listener_thread(server_ip, tcp_server_port, udp_server_port):
 		
 
 
-def execute_matplotlib(data, w_size):
+"""
+Main plot cycle.
+Each frame draws the latest snapshot of publisher:
+the plot never takes the lock of the data.
+With blit, the lines are blitted on a cached background and
+the x window moves by steps: the whole figure is redrawn
+only when the limits change or a flow appears.
+With the collection and heatmap views, only the top_k flows of 
+each FlowView (by max in the window) keep their line and 
+legend entry: the others are drawn by the view
+"""
+def execute_matplotlib(publisher, w_size, blit=False):
+	# imported here: the parsers (replay, bench) do not need matplotlib
+	import matplotlib.pyplot as plt, matplotlib.ticker
 	
 	x_lim_left = 0 
 	x_lim_right = 1
@@ -377,6 +603,7 @@ def execute_matplotlib(data, w_size):
 	lines = {} # lines to plot
 	ax = {} # axes or subplots
 	
+	data = publisher.latest.data
 	fig = plt.figure(1, figsize=w_size)
 	plt.ion()
 
@@ -403,26 +630,63 @@ def execute_matplotlib(data, w_size):
 		top=0.94, 
 		right=0.94)
 
+	"""
+	Initialize lines (created once, then only updated)
+	and their level of detail: cwnd records arrive at every ACK
+	"""
+	lod = {} # (key, src) --> Decimator of the line
+	for key in data:
+		lines[key] = {}
+	background = {} # key --> FlowView of the flows (none with the lines view)
+	if view != "lines":
+		for key in FLOW_KEYS:
+			background[key] = FlowView(ax[key], view, FLOW_BIN_WIDTH,
+				fmt=mkformatter if key == "cwnd" else None)
+			if view == "heatmap":
+				ax[key].set_title("{} [{}]".format(data[key]["title"], data[key]["ylabel"]))
+				ax[key].set_ylabel("flows")
+	heatmap = view == "heatmap"
+
+	# the series of the interface and of ping (the flows come later;
+	# in a heatmap ping is a row)
+	for key in ["txrate", "rtt"]:
+		if heatmap and key in background:
+			continue
+		for src in data[key]["samples"]:
+			lines[key][src], = ax[key].plot([],[], label=key, color="black")
+	fixed = dict((key, set(lines[key])) for key in lines) # lines always drawn
+	legends = {} # key --> flows in the legend of a collection
+
 	plt.show()
 
+	renderer = None
+	if blit:
+		renderer = BlitManager(fig)
+
 	while not stop.is_set():
 
 		time.sleep(IPERF_REPORT_INTERVAL)
 
 		if screenshot.is_set():
-			plt.savefig('plot-{}.pdf'.format(time.time()), format="PDF")
+			if renderer is not None:
+				renderer.savefig('plot-{}.pdf'.format(time.time()), format="PDF")
+			else:
+				plt.savefig('plot-{}.pdf'.format(time.time()), format="PDF")
 			screenshot.clear()
 
 		if pause.is_set():
 			continue
 
-		now = int(time.time()-t0)
+		now = int(clock()-t0)
 
 		
 		"""
 		Update axis and do reset
 		"""
-		x_lim_right = int(now + wtw)
+		if renderer is not None:
+			x_lim_right = stepped(now + wtw, X_STEP)
+		else:
+			x_lim_right = int(now + wtw)
 
 		"""
 		If x_lim_right exceed MAX_TIME_WINDOW,
@@ -433,187 +697,264 @@ def execute_matplotlib(data, w_size):
 		if x_lim_right > MAX_TIME_WINDOW:
 			x_lim_left = x_lim_right - MAX_TIME_WINDOW 
 
-
-		"""
-		Initialize lines
-		"""
-		for key in ["txrate", "rtt"]:
-			lines[key] = {}
-			for src in data[key]["samples"]:
-				lines[key][src], = ax[key].plot([],[], label=key, color="black")
-
 		"""
 		Update lines
 		"""
-		with sem_data:
-			for key in data:
+		data = publisher.latest.data
+		for key in data:
+			samples = data[key]["samples"]
 
-				"""
-				Update axis
-				"""
-				ax[key].set_ylim(0, data[key]["max"] * wus)
-				ax[key].set_xlim(x_lim_left, x_lim_right)
+			"""
+			Flows drawn as lines: all of them, or the top_k
+			with a background (in a heatmap they are named)
+			"""
+			shown = samples
+			if key in background:
+				active = [src for src in samples if len(samples[src]) > 0 
+					and samples[src].last_t() >= x_lim_left]
+				top = sorted(top_keys(dict((src, samples[src].max_since(x_lim_left)) 
+					for src in active if src not in fixed[key]), top_k))
+				shown = fixed[key] if heatmap else fixed[key] | set(top)
+				for src in [src for src in lines[key] if src not in shown]:
+					ax[key].lines.remove(lines[key].pop(src))
 
-				for src in data[key]["samples"]:
+			"""
+			Update axis: the top is the max of the visible samples
+			(a heatmap sets its own)
+			"""
+			if not heatmap or key not in background:
+				y_top = window_max(samples.values(), x_lim_left, data[key]["min_top"])
+				set_limits(ax[key], x_lim_left, x_lim_right, y_top * wus, sticky=blit)
 
-					"""
-					Add new lines
-					"""
-					if key not in lines:
-						lines[key] = {}
+			for src in shown:
 
-					if src not in lines[key]:
-						lines[key][src], = ax[key].plot([], [], label=src)
+				"""
+				Add new lines
+				"""
+				if src not in lines[key]:
+					lines[key][src], = ax[key].plot([], [], label=src)
 
-					"""
-					Update lines
-					"""
-					lines[key][src].set_data(
-						data[key]["samples"][src]["t"],
-						data[key]["samples"][src]["val"]
-						)
+				"""
+				Update lines
+				"""
+				if (key, src) not in lod:
+					lod[(key, src)] = Decimator(settle=DEATH_TOLERANCE)
+				t, val = data[key]["samples"][src].window_view(x_lim_left)
+				lines[key][src].set_data(*lod[(key, src)].reduce(t, val,
+					x_lim_left, x_lim_right, int(ax[key].bbox.width)))
+
+			if key not in background:
+				continue
 
-		fig.canvas.draw()
+			"""
+			Update the background: the other flows, decimated
+			in a collection, binned in a heatmap
+			"""
+			others = []
+			for src in sorted(active):
+				if src in shown:
+					continue
+				t, val = samples[src].window_view(x_lim_left)
+				if not heatmap:
+					if (key, src) not in lod:
+						lod[(key, src)] = Decimator(settle=DEATH_TOLERANCE)
+					t, val = lod[(key, src)].reduce(t, val, x_lim_left, x_lim_right, int(ax[key].bbox.width))
+				others.append((src, t, val))
+			background[key].update(others, x_lim_left, x_lim_right, top)
+
+			# compact legend of the highlighted flows
+			if not heatmap and legends.get(key) != top:
+				if len(top) > 0:
+					ax[key].legend(handles=[lines[key][src] for src in top], loc="upper left", 
+						fontsize="x-small", ncol=2)
+				elif ax[key].get_legend() is not None:
+					ax[key].get_legend().remove()
+				legends[key] = top
+
+		if renderer is not None:
+			renderer.update()
+		else:
+			fig.canvas.draw()
 
 	plt.close()
 	print "Matplotlib terminated"
 
 
-
-# """
-# if the max was taken outside the visualized graph,
-# update max looking all the array
-# """
-# def update_maxs(data, x_lim_left):
-# 	for key in data:
-# 		if data[key]["t_max"]<x_lim_left:
-# 			# one line data
-# 			if "t" in data[key]["samples"]:
-# 				if len(data[key]["samples"]["val"])>0:
-# 					new_max = max(data[key]["samples"]["val"])
-# 					pos_max = (data[key]["samples"]["val"]).index(new_max)
-# 					data[key]["max"] = new_max
-# 					data[key]["t_max"] = data[key]["samples"]["t"][pos_max]
-# 			# only for cwnd sum
-# 			else:
-# 				if len(data[key]["samples"]["SUM"]["val"])>0:
-# 					new_max = max(data[key]["samples"]["SUM"]["val"])
-# 					pos_max = (data[key]["samples"]["SUM"]["val"]).index(new_max)
-# 					data[key]["max"] = new_max
-# 					data[key]["t_max"] = data[key]["samples"]["SUM"]["t"][pos_max]
-
-def set_data(intf, server_ip):
+"""
+The rtt of the flows is their srtt; with ping, the rtt of 
+the path to server_ip is also plotted
+"""
+def set_data(intf, server_ip, ping=False):
+	global flows
+	flows = LivenessTracker(DEATH_TOLERANCE, forget_after=HISTORY_WINDOW)
 	data = {
 		"txrate" : {
 			"title" 	: "Transmission Rate",
 			"ylabel" 	: "bit/s",
 			"position" 	: 311,
-			"max" 		: 1,
-			"t_max"		: 1,
-			"samples" 	: { intf: {"t":[], "val":[]} }
+			"min_top" 	: 1, # smallest top of the y axis
+			"samples" 	: { intf: TimeSeries(HISTORY_WINDOW, extremes=True) }
 			
 		},
 		"cwnd" : {
 			"title" 	: "Congestion Window",
 			"ylabel" 	: "Byte",
 			"position" 	: 312,
-			"max" 		: 1,
-			"t_max"		: 1,
+			"min_top" 	: 1,
 			"min"		: 1000000, 
-			"samples" 	: {}, # dict of "src" = {"t":[], "val":[]}
+			"samples" 	: {}, # dict of "src" = TimeSeries
 		},
 		"rtt" : {
 			"title" 	: "RTT",
 			"ylabel" 	: "ms",
 			"xlabel"	: "time [s]",
 			"position" 	: 313,
-			"max" 		: 0.0005,
-			"t_max"		: 1,
-			"samples" 	: { server_ip: {"t":[], "val":[]} }		
+			"min_top" 	: 0.0005,
+			"samples" 	: {} # dict of "src" = TimeSeries (and server_ip with ping)
 		}
 	}
+	if ping:
+		data["rtt"]["samples"][server_ip] = TimeSeries(HISTORY_WINDOW, extremes=True)
 	return data
 
 
-# """
-# Delete all samples before x_lim_left
-# """
-# def drop_data(data, x_lim_left):
-# 	for key in data:
-# 		# one line data
-# 		if "t" in data[key]["samples"]:
-# 			index = first_index_geq(data[key]["samples"]["t"],x_lim_left)
-# 			del (data[key]["samples"]["t"])[:index]
-# 			del (data[key]["samples"]["val"])[:index]
-# 		else:
-# 			for src in data[key]["samples"]:
-# 				index = first_index_geq(data[key]["samples"][src]["t"],x_lim_left)
-# 				del data[key]["samples"][src]["t"][:index]
-# 				del data[key]["samples"][src]["val"][:index]
-			
-
-
 def stop_server():
 	print "Stopping the server..."
 	stop.set()
 
-def run_program(intf, server_ip, tcp_port, udp_port, window_size):
+def run_program(intf, server_ip, tcp_port, udp_port, window_size, record_file=None, blit=False,
+	sample_period=SAMPLE_PERIOD, use_bwm_ng=False, tcp_info_period=None, use_ping=False,
+	view_kind="lines", top=TOP_K):
+	global view, top_k
+	view, top_k = view_kind, top
 	pause.clear() # clear the pause plot event
 	stop.clear() # clear the stop event
 	screenshot.clear()
-	data = set_data(intf, server_ip) # initialize the data structure
-	insert_tcp_probe_module(tcp_port)
+	data = set_data(intf, server_ip, use_ping) # initialize the data structure
+	if tcp_info_period is None:
+		insert_tcp_probe_module(tcp_port)
 	global t0 # use a single global initial time stamp
 	t0 = time.time() # t0 is now
 
+	global recorder
+	recorder = None
+	if record_file is not None:
+		recorder = Recorder(record_file)
+
+	# the plot takes the published snapshots, not data
+	global publisher
+	publisher = new_publisher(data)
+
+	# the parsers only parse: the aggregator applies their records
+	global aggregator
+	aggregator = Aggregator(lambda records: apply_records(data, records), sem_data,
+		publisher=publisher)
+	aggregator.start()
+
 	#--------------Start all threads here---------------------
 
+	# one thread reads the output of tcp-probe and ping (and bwm-ng)
+	mux = ProcessMux(stop)
+	if use_ping:
+		ping_source(mux, data, server_ip)
+
 	threads = {
-		"txrate"	: threading.Thread(target=bwm_ng_thread, args=(data["txrate"], intf)),
-		"cwnd"		: threading.Thread(target=tcp_probe_thread, args=(data["cwnd"],)),
-		"rtt" 		: threading.Thread(target=ping_thread, args=(data["rtt"], server_ip)),		
+		"mux"		: threading.Thread(target=mux.run),
 		"keyboard"  : threading.Thread(target=keyboard_listener_thread, args=(server_ip, tcp_port, udp_port))	
 	}
 
+	if tcp_info_period is None:
+		tcp_probe_source(mux, data)
+	else:
+		print "\nSampling tcp_info of the flows to port {} every {}s".format(tcp_port, tcp_info_period)
+		threads["tcp-info"] = threading.Thread(target=tcp_info_sampler(data, tcp_port, tcp_info_period).run)
+
+	if use_bwm_ng:
+		bwm_ng_source(mux, data, intf)
+	else:
+		sampler = NetDevSampler([intf],
+			lambda t, rx, tx: handle_net_dev_sample(data, t, rx, tx, intf), stop, sample_period)
+		threads["sampler"] = threading.Thread(target=sampler.run)
+
 	try:
 		for t in threads:
 			threads[t].start()
 
 		# main thread
-		execute_matplotlib(data, window_size)
+		execute_matplotlib(publisher, window_size, blit)
 
 	except (KeyboardInterrupt):
 		print "Server interrupted by the user..."
 		stop_server()
 	finally:
 		print "Server terminated!"
+		stop.set()
+		threads["mux"].join()
 
 		programs = ["ping", "cat", "iperf", "bwm-ng"]
 		for prog in programs:
 			killall(prog)
-		subprocess.call("sudo modprobe -r tcp_probe", shell=True) 
+		if tcp_info_period is None:
+			sudo_cmd("modprobe -r tcp_probe")
+		aggregator.stop()
+		aggregator = None
+		if recorder is not None:
+			recorder.close()
+			print "Samples recorded in {}".format(record_file)
 		
 
 
 
 
-parser = argparse.ArgumentParser(description='Plot outgoing iPerf connections')
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Plot outgoing iPerf connections')
+
+	parser.add_argument('-i', dest='intf', nargs='?', default='wlp8s0',
+		help='The network interface name transmitting data')
+
+	parser.add_argument('-c', dest='server_ip', nargs='?', default="192.168.1.12", 
+		help='Server IP address')
+
+	parser.add_argument('-t', dest='tcp_port', nargs='?', default=5001, type=int, 
+		help='TCP server port')
+
+	parser.add_argument('-u', dest='udp_port', nargs='?', default=5201, type=int, 
+		help='UDP server port')
+
+	parser.add_argument('-w', dest='window_size', nargs=2, default=[11,8], type=int, 
+		help='Width and height of the window [inch]')
+
+	parser.add_argument('--record', dest='record_file', nargs='?', default=None,
+		help='Record the parsed samples in a binary file')
+
+	parser.add_argument('--blit', dest='blit', action='store_true',
+		help='Redraw only the lines at each frame (faster rendering)')
+	parser.set_defaults(blit=False)
+
+	parser.add_argument('--sample-period', dest='sample_period', nargs='?', default=SAMPLE_PERIOD, type=float,
+		help='Seconds between two samples of the interface counters')
 
-parser.add_argument('-i', dest='intf', nargs='?', default='wlp8s0',
-	help='The network interface name transmitting data')
+	parser.add_argument('--bwm-ng', dest='use_bwm_ng', action='store_true',
+		help='Measure the interface with bwm-ng instead of reading /proc/net/dev')
+	parser.set_defaults(use_bwm_ng=False)
 
-parser.add_argument('-c', dest='server_ip', nargs='?', default="192.168.1.12", 
-	help='Server IP address')
+	parser.add_argument('--tcp-info', dest='tcp_info_period', nargs='?', default=None, 
+		const=TCP_INFO_PERIOD, type=float,
+		help='Sample tcp_info of the flows every TCP_INFO_PERIOD seconds (default {}) '
+			'instead of reading tcp-probe (no tcp_probe module, no sudo)'.format(TCP_INFO_PERIOD))
 
-parser.add_argument('-t', dest='tcp_port', nargs='?', default=5001, type=int, 
-	help='TCP server port')
+	parser.add_argument('--ping', dest='use_ping', action='store_true',
+		help='Plot also the rtt of the path measured by ping (besides the srtt of the flows)')
+	parser.set_defaults(use_ping=False)
 
-parser.add_argument('-u', dest='udp_port', nargs='?', default=5201, type=int, 
-	help='UDP server port')
+	parser.add_argument('--view', dest='view', choices=VIEWS, default='lines',
+		help='Draw a line for each flow, or only the top flows and the others in a single collection or heatmap')
 
-parser.add_argument('-w', dest='window_size', nargs=2, default=[11,8], type=int, 
-	help='Width and height of the window [inch]')
+	parser.add_argument('--top', dest='top_k', nargs='?', default=TOP_K, type=int,
+		help='Flows drawn as lines in the collection view (named in the heatmap)')
 
-args = parser.parse_args()
+	args = parser.parse_args()
 
-run_program(args.intf, args.server_ip, args.tcp_port, args.udp_port, args.window_size)
\ No newline at end of file
+	run_program(args.intf, args.server_ip, args.tcp_port, args.udp_port, args.window_size,
+		args.record_file, args.blit, args.sample_period, args.use_bwm_ng, args.tcp_info_period,
+		args.use_ping, args.view, args.top_k)
@@ -1,19 +1,21 @@
 #!/usr/bin/python
-import sys, time, getopt, threading, matplotlib, inspect
+import sys, time, getopt, threading, multiprocessing, inspect, bisect
 import argparse
-import matplotlib.pyplot as plt
 import numpy as np
 from threading import Timer
 from mylib import *
-from numpy import ones,vstack
-from numpy.linalg import lstsq
-from scipy import interpolate
+from recorder import Recorder
+from plotlib import *
+from sampler import NetDevSampler, SAMPLE_PERIOD
 
 """
 This program executes an iperf TCP, UDP server and
 shows the bandwidth used by each source IP.
 Since it aggregate flows, an iperf client must create at least 
 2 connection to be displayed.  
+matplotlib is imported only to plot: without it (--no-plot, or
+imported by other tools) the parsers and the aggregation start
+without loading it
 """
 
 # ---------------- GLOBAL VARS -------------------------
@@ -22,6 +24,18 @@ stop = threading.Event() # event to stop every thread
 pause = threading.Event() # event to pause the visualizations
 screenshot = threading.Event()
 global t0   # unix timestamp of the reference instant
+grid = None # TimeGrid of the binned aggregation mode (None otherwise)
+shards = None # SharedTimeGrid of each worker of a sharded server (None otherwise)
+shards_grid = None # last merge of the grids of the shards (None if not sharded)
+recorder = None # Recorder of the parsed samples (None if not recording)
+smoothing = "hann" # filter of the per-user smoothed rates (see StreamingSmoother)
+group_by = "host" # users of the plot: a host or each of its connections (see flow_label)
+view = "lines" # view of the users: a line each, or the top_k and the others in a FlowView
+top_k = TOP_K # users drawn as lines in the collection and heatmap views
+aggregator = None # Aggregator applying the parsed records (None: applied by the parsers)
+publisher = None # Publisher of the snapshots read by the plot and the checks
+flows = None # LivenessTracker of the series (uid, prot) of the users (see expire_flows, revive_series)
+users = None # LivenessTracker of the active users
 
 # -------------------- CONSTANTS -----------------------
 IPERF_REPORT_INTERVAL = 1
@@ -37,6 +51,15 @@ then data and graph are reset and the plot begins to slide
 """
 MAX_TIME_WINDOW = 10
 
+# with blitting, the x window moves by steps of X_STEP seconds
+X_STEP = MAX_TIME_WINDOW / 4.0
+
+# seconds between two snapshots of the data published for the readers
+PUBLISH_INTERVAL = IPERF_REPORT_INTERVAL / 4.0
+
+# seconds of samples kept in memory for each series
+HISTORY_WINDOW = 2 * MAX_TIME_WINDOW
+
 SMOOTH_WINDOW = 10 # number of samples to be smoothed
 DENSITY_LINSPACE = 4 # resampling frequency
 BITRATE_MIN = 10*10**3 # min 10kb/s or it's just noise
@@ -66,87 +89,48 @@ def print_legend(subplot, num_flows):
 Check if the number of active users is the expected value.
 In not, stop the server
 """
-def check_number_of_users(data, expected_users):
-	if count_users(data) != expected_users:
+def check_number_of_users(publisher, expected_users):
+	if count_users(publisher.latest) != expected_users:
 		print "Less users than expected, aborting..."
 		stop_server()
 
 
-# Count the number of active flows
-def count_users(data):
-	num = 0
-	clients_id = []
-	with sem_data:
-		now = time.time()-t0
-		for src in data:
-			if src != "SUM":
-				for key in data[src]:
-					if (len(data[src][key]["t"]) > 0 and 
-						abs(now - data[src][key]["t"][-1]) <= DEATH_TOLERANCE and 
-						data[src][key]["val"][-1] > 0):
-						clients_id.append(src)
-						break
-		num = len(clients_id)
-	return num
-
-"""
-Returns a smoothed list
-"""
-def smooth(list_x, smooth_window):
-	if smooth_window < 3:
-		return list_x
-
-	if len(list_x) < smooth_window:
-		return list_x
-	x = np.array(list_x)
-	s = np.r_[x[smooth_window-1:0:-1],x,x[-1:- smooth_window:-1]]
-	w = eval('np.'+ 'hanning' +'(smooth_window)')
-	y = np.convolve(w / w.sum(), s , mode='valid')
-	sm =  list(y[(smooth_window / 2 - 1):-(smooth_window / 2)])
-	len_sm = len(sm)
-	len_x = len(list_x)
-	if len_sm == len_x:
-		return sm
-	if len_sm<len_x:
-		sm += [0] * (len_x - len_sm)
-		return sm
-	else:
-		return sm[:len_x]
-
-
-#------------------------------ SUM OF FLOWS -------------------------------------#
+# Count the number of active flows in a published snapshot (no lock needed)
+def count_users(snapshot):
+	if snapshot is None:
+		return 0
+	if snapshot.grid is not None:
+		return len(snapshot.grid.active_keys(clock()-t0, DEATH_TOLERANCE))
+	return snapshot.users
 
 """
-Given a user's timesample, 
-find if its TCP or UDP and in which position it is
-data is data[uid]
+Instant before which the total of a user does not change any more:
+pending singles can still be solved, and late reports are
+inserted up to DEATH_TOLERANCE before the last sample
 """
-def index_of_timestamp(data, t):
-	prot = "tcp"
-	index = -1
-	try:
-		index = data[prot]["t"].index(t)
-	except ValueError:
-		prot = "udp"
-		index = data[prot]["t"].index(t)    
-	finally:
-		return [prot,index]
+def stable_horizon(total, singles=None):
+	horizon = total.last_t() - DEATH_TOLERANCE
+	if singles is not None and len(singles) > 0:
+		horizon = min(horizon, singles.pending[0])
+	return horizon
+
+
+#------------------------------ SUM OF FLOWS -------------------------------------#
 
 """
 Delete samples around t and insert the new sample in the right position
 data is data[uid][prot]
 """
 def delete_data_around_t(data, t):
-	begin = first_index_geq(data["t"], t-T) 
-	end = first_index_geq(data["t"], t+T)
+	begin = first_index_geq(data.t, t-T) 
+	end = first_index_geq(data.t, t+T)
 	if end - begin > 0:
-		if t not in data["t"]:
-			del(data["t"][begin:end])
-			del(data["val"][begin:end])
+		index_t = data.index(t)
+		if index_t < 0:
+			data.delete(begin, end)
 		else:
-			index_t = data["t"].index(t)
-			del(data["t"][begin:index_t])
-			del(data["val"][index_t+1:end])
+			data.delete(index_t+1, end)
+			data.delete(begin, index_t)
 
 
 """
@@ -154,59 +138,16 @@ insert t,val in the correct position of data
 data is data[uid][protocol]
 """
 def insert_sample(data, t, val):
-	"""
-	if it was dead, put a 0 before the new value
-	"""
-	if (len(data["val"]) > 0 and 
-		data["val"][-1] == 0 and
-		t - data["t"][-1] >= DEATH_TOLERANCE):
-
-		data["t"].append(t - IPERF_REPORT_INTERVAL)
-		data["val"].append(0)
-
-	if t not in data["t"]:
-		index = first_index_geq(data["t"],t)
-		if index == -1:
-			data["t"].append(t)
-			data["val"].append(val)
-		else:
-			data["t"].insert(index,t)
-			data["val"].insert(index,val)
+	index = data.index(t)
+	if index < 0:
+		data.insort(t, val)
 	else:
-		index = data["t"].index(t)
-		data["val"][index] += val
+		data.set_val(index, data.val[index] + val)
 
 """
-Given 2 points A,B that defines the rect y
-return the value of y(t)
-"""
-def interpolate_val(x1, y1, x2, y2, t):
-	x_coords = (x1,x2)
-	y_coords = (y1,y2)
-	A = vstack([x_coords,ones(len(x_coords))]).T
-	m, c = lstsq(A, y_coords)[0]
-	return ( m * t ) + c
-
-
-"""
-return -1 if a line cannot be traced
-data is data[uid][prot]
-"""
-def get_interpolated_val(data, t):
-	i = first_index_geq(data["t"], t)
-	if i <= 0:
-		return -1
-	x1 = data["t"][i-1]
-	x2 = data["t"][i]
-	y1 = data["val"][i-1]
-	y2 = data["val"][i]
-	return interpolate_val(x1, y1, x2, y2, t)
-
-"""
-Append a zero sample if the last received sample is too far 
-(declaration of a dead)
-Return True if a dead is declared, False otherwise
-Data is data[uid][prot]
+Append a zero sample to the series whose last received sample 
+is too far (declaration of a dead): flows reports only the series
+expiring at time t, instead of checking all of them
 
 iPerf TCP behavior:
 produce reports only for received packets 
@@ -220,83 +161,133 @@ When a user stop to send data, begin to produce NAN regularly:
 ==> check values!!!
 ==> do not save nan samples and check like tcp
 """
-def update_death_flows(data, t):
-	if len(data["t"]) > 0:
-		last_t = data["t"][-1]
-		last_val = data["val"][-1]
-		if abs(t - last_t) >= DEATH_TOLERANCE and last_val != 0:
-			data["t"].append(last_t + IPERF_REPORT_INTERVAL)
-			data["val"].append(0)
-			return True
-	return False
+def expire_flows(data, t):
+	for (uid, prot), last_t in flows.advance(t):
+		series = data[uid][prot]
+		if len(series) > 0 and series.last_val() != 0:
+			series.append(series.last_t() + IPERF_REPORT_INTERVAL, 0)
+	users.advance(t)
+
+"""
+Put a 0 before the sample at t of a series back after its death
+(flows.seen reports it revived): the series is not drawn 
+as a ramp from its death
+"""
+def revive_series(series, t):
+	if len(series) > 0 and series.last_t() < t - IPERF_REPORT_INTERVAL:
+		series.append(t - IPERF_REPORT_INTERVAL, 0)
 
 #------------------------------ SINGLES -------------------------------------#
 # Singles are timestamps of sums executed without an element for each uid
 
 """
-Declare as singles the totals between [t1,t2]
-data is data[uid][total]["t"]
+Pending singles of a user, kept sorted by timestamp.
+A single is solved adding to its total the value of the other
+protocol, linearly interpolated at the same instant: 
+all the solvable singles are solved together with np.interp.
+Singles not solved within MAX_TIME_WINDOW expire
 """
-def declare_as_singles(data, t1, t2, singles):
-	begin = first_index_geq(data,t1) 
-	if begin<0:
-		return
-	
-	end = first_index_geq(data,t2)
-	if end<0:
-		end = len(data)
-	for i in range(begin,end):
-		if data[i] not in singles:
-			singles.append(data[i])
-
-"""
-Delete old singles and order the list
-"""
-def delete_old_singles(singles):
-	# list(set()) eliminate duplicates
-	s = sorted(list(set(singles)))
-	last_t = s[-1]
-	first_valid = first_index_geq(s, last_t - MAX_TIME_WINDOW)
-	if first_valid>0:
-		del s[:first_valid]
-	return s
-
-"""
-Solve the list of singles
-A single is a timestamp corresponding to 
-a total executed with only a protocol
-data is data[uid]
-"""
-def solve_singles(data, singles):
-	solved_singles = []
-	for single in singles:
-		prot, index = index_of_timestamp(data, single)
-		other_val = get_interpolated_val(data[get_other(prot)],single)
-		
-		if other_val <= 0 or index < 0:
-			continue
+class Singles(object):
+
+	def __init__(self):
+		self.pending = [] # sorted timestamps of unsolved totals
+
+	def __len__(self):
+		return len(self.pending)
+
+	"""
+	Declare as singles the totals in (t1,t2]
+	total is data[uid]["total"]
+	"""
+	def declare(self, total, t1, t2):
+		begin = first_index_geq(total.t, t1)
+		if begin < 0:
+			return
+		end = first_index_geq(total.t, t2)
+		if end < 0:
+			end = len(total)
+		for t in total.t[begin:end].tolist():
+			i = bisect.bisect_left(self.pending, t)
+			if i == len(self.pending) or self.pending[i] != t:
+				self.pending.insert(i, t)
+
+	"""
+	Delete the singles older than t - MAX_TIME_WINDOW
+	"""
+	def expire(self, t):
+		del self.pending[:bisect.bisect_left(self.pending, t - MAX_TIME_WINDOW)]
+
+	"""
+	Solve the pending singles
+	data is data[uid]
+	"""
+	def solve(self, data):
+		tcp, udp, total = data["tcp"], data["udp"], data["total"]
+		if len(tcp) == 0 or len(udp) == 0:
+			return
+
+		"""
+		A single can be solved only if the other protocol
+		has a sample after it: check only the singles before 
+		the last sample of the two protocols
+		"""
+		bound = max(tcp.last_t(), udp.last_t())
+		n = bisect.bisect_left(self.pending, bound)
+		if n == 0:
+			return
+		ts = np.array(self.pending[:n])
+
+		pos_tcp, in_tcp = match_timestamps(tcp, ts)
+		pos_udp, in_udp = match_timestamps(udp, ts)
+		pos_total, in_total = match_timestamps(total, ts)
 
-		current_val = data[prot]["val"][index]
-		
-		# Index of the single in "total"
-		index_in_total = data["total"]["t"].index(single)	
-		
 		"""
 		I the sum was done using only tcp, add upd
 		and viceversa
 		"""
-		data["total"]["val"][index_in_total] = current_val + other_val
+		current_val = np.where(in_tcp, tcp.val[pos_tcp], udp.val[pos_udp])
+		other_val = np.where(in_tcp, 
+			interpolate_series(udp, ts), 
+			interpolate_series(tcp, ts))
+
+		solved = (in_tcp | in_udp) & in_total & (other_val > 0)
+		if not solved.any():
+			return
+		total.set_val(pos_total[solved], current_val[solved] + other_val[solved])
 
-		solved_singles.append(single)
+		# Update the list of singles deleting solved ones
+		self.pending[:n] = ts[~solved].tolist()
+
+"""
+Return the positions of the timestamps ts in series
+and a mask of the ones effectively present
+"""
+def match_timestamps(series, ts):
+	if len(series) == 0:
+		return np.zeros(len(ts), dtype=int), np.zeros(len(ts), dtype=bool)
+	pos = np.minimum(np.searchsorted(series.t, ts), len(series) - 1)
+	return pos, series.t[pos] == ts
 
-	# Update the list of singles deleting solved ones
-	s = list(singles)
-	for single in solved_singles:
-		del s[s.index(single)]
-	return s
+"""
+Linear interpolation of series at the instants ts.
+Return -1 where a line cannot be traced 
+(no sample before or after the instant)
+"""
+def interpolate_series(series, ts):
+	vals = np.interp(ts, series.t, series.val)
+	vals[(ts < series.t[0]) | (ts >= series.last_t())] = -1
+	return vals
 
 
 def update_sum(data, t, val, uid, prot, singles):
+	add_sample(data, t, val, prot, singles)
+	settle_singles(data, t, singles)
+
+"""
+Insert a sample of prot and add it to the total.
+The totals summed without the other protocol are declared as singles
+"""
+def add_sample(data, t, val, prot, singles):
 
 	other = get_other(prot)
 	
@@ -310,293 +301,438 @@ def update_sum(data, t, val, uid, prot, singles):
 	insert_sample(data["total"], t, val)
 
 	# declare as singles all totals in the burned interval
-	declare_as_singles(data["total"]["t"], t-T, t+T, singles)
+	singles.declare(data["total"], t-T, t+T)
 
 	# see if the other flow (same IP address, other protocol) is dead and declare it
 	#if update_death_flows(data[other], t):
 		# if something changed, declare these points as singles
-	#	declare_as_singles(data["total"]["t"], data[other]["t"][-2], data[other]["t"][-1], singles)
+	#	singles.declare(data["total"], data[other].t[-2], data[other].t[-1])
 
-	# update singles: sort and delete samples too old
-	singles = delete_old_singles(singles)
+"""
+Delete the singles too old at time t and try to solve the others
+"""
+def settle_singles(data, t, singles):
+	# delete singles too old
+	singles.expire(t)
 
 	# try to solve all singles
-	singles = solve_singles(data,singles)
-	# print "After solution, {}".format(len(singles))
+	singles.solve(data)
 
-	return singles
-	#print "End with {}".format(data[prot]["t"])
+"""
+Apply a batch of parsed records (prot, uid, t, val):
+prot is "tcp", "udp" or "SUM" (bwm-ng, uid is None).
+The singles of each user are solved once per batch
+"""
+def apply_records(data, singles, records):
+	last_t = {} # last sample of each user in the batch
+	for prot, uid, t, val in records:
+		if recorder is not None:
+			recorder.record(prot if uid is None else prot + "/" + uid, t, val)
+
+		if prot == "SUM":
+			data["SUM"]["total"].append(t, val)
+			expire_flows(data, int(clock()-t0))
+			continue
+
+		if grid is not None:
+			grid.add(uid, prot, t, val)
+			continue
+
+		if uid not in data:
+			data[uid] = new_client_data()
+		if uid not in singles:
+			singles[uid] = Singles()
+		for name in (prot, "total"):
+			if flows.seen((uid, name), t) is not None:
+				revive_series(data[uid][name], t)
+		add_sample(data[uid], t, val, prot, singles[uid])
+		last_t[uid] = max(t, last_t.get(uid, t))
+		if val > 0:
+			users.seen(uid, t)
+
+	for uid in last_t:
+		settle_singles(data[uid], last_t[uid], singles[uid])
+
+"""
+Hand a parsed record to the aggregator,
+or apply it at once if there is no aggregator (e.g. replay)
+"""
+def submit(data, singles, record):
+	if aggregator is not None:
+		aggregator.put(record)
+	else:
+		with sem_data:
+			apply_records(data, singles, [record])
+			if publisher is not None:
+				publisher.update()
+
+"""
+Hand the records of a block to the aggregator at once (see submit)
+"""
+def submit_batch(data, singles, records):
+	if aggregator is not None:
+		aggregator.put_batch(records)
+	else:
+		with sem_data:
+			apply_records(data, singles, records)
+			if publisher is not None:
+				publisher.update()
+
+"""
+Copy of the binned rates for the readers: the grid of this
+process plus the last merge of the shards (sharded server)
+"""
+def read_grid():
+	if grid is None:
+		return None
+	if shards_grid is None:
+		return grid.freeze()
+	return merge_grids([grid, shards_grid])
+
+"""
+Publisher of the snapshots of data: the frozen data, 
+the binned rates (binned mode, see read_grid), the stable 
+horizon of the total of each user (see stable_horizon)
+and the number of active users
+"""
+def new_publisher(data, singles):
+	def make_snapshot():
+		if grid is None:
+			expire_flows(data, clock()-t0)
+		horizons = {}
+		for uid in data:
+			if uid != "SUM" and len(data[uid]["total"]) > 0:
+				horizons[uid] = stable_horizon(data[uid]["total"], singles.get(uid))
+		return {
+			"data"		: freeze(data),
+			"grid"		: read_grid(),
+			"horizons"	: horizons,
+			"users"		: len(users)
+		}
+	return Publisher(make_snapshot, PUBLISH_INTERVAL)
 	
 #-------------------------- DATA MANAGEMENT -------------------------------
 
 # initialize the data structure
 # data = {
-# 		"tcp"       : {"t":[], "val":[]},
-# 		"udp"       : {"t":[], "val":[]},
-# 		"total"     : {"t":[], "val":[]}
+# 		"tcp"       : TimeSeries,
+# 		"udp"       : TimeSeries,
+# 		"total"     : TimeSeries
 # 	}
-# the user "SUM" has only the dict "total"
+# the user "SUM" has only the series "total"
+# (the liveness of the series is reset as well)
 def set_data():
+	global flows, users
+	flows = LivenessTracker(DEATH_TOLERANCE, forget_after=HISTORY_WINDOW)
+	users = LivenessTracker(DEATH_TOLERANCE, forget_after=HISTORY_WINDOW)
 	data = {}
-	data["SUM"] = {"total": {"t":[], "val":[]}}
+	data["SUM"] = {"total": TimeSeries(HISTORY_WINDOW, extremes=True)}
 	return data
 
 # create the dict for a new client
 def new_client_data():
 	data = {
-		"tcp"       : {"t":[], "val":[]},
-		"udp"       : {"t":[], "val":[]},
-		"total"     : {"t":[], "val":[]},
+		"tcp"       : TimeSeries(HISTORY_WINDOW),
+		"udp"       : TimeSeries(HISTORY_WINDOW),
+		"total"     : TimeSeries(HISTORY_WINDOW, extremes=True),
 	}
 	return data
 
 #------------------------------ THREADS -------------------------------------#
 """
-Return true if the TCP line is valid, false otherwise
-Example:
-0			   1            2 3            4 5  6        7       8
-20160525170508,192.168.1.77,0,192.168.1.52,0,-1,9.0-10.0,1455352,11642816
-"""
-def is_tcp_sum_line(cols):
-	# Is a summation line?
-	if (cols[2], cols[4], cols[5][0]) != ("0","0", "-"):
-		return False
-	return True
-
-def is_valid_tcp_line(cols, report_interval):
-	# Valid length
-	if len(cols) != 9:
-		return False
-
-	# Is a valid report interval? 
-	# There are also end of transmission reports...
-	intvs = cols[6].split("-")
-	intv0 = float(intvs[0])
-	intv1 = float(intvs[1])
-	if intv1 - intv0 != float(report_interval):
-		return False
-	return True
-
-
-def iperf_tcp_thread(data, port,singles):
-	print "\niPerf TCP server listening on port {}".format(port)
-	report_interval = IPERF_REPORT_INTERVAL
-	cmd = "iperf -s -i{} -fk -yC -p{}".format(report_interval, port)
+iperf -yC reports, parsed in blocks (see parse_iperf_block)
+
+TCP example:
+0              1             2    3             4     5    6     7          8
+20150803124132,10.100.13.214,5001,10.100.13.162,56695,4,0.0-17.4,1005453312,463275664
+20160525170508,192.168.1.77,0,192.168.1.52,0,-1,9.0-10.0,1455352,11642816 (summation)
+
+0: timestamp
+1: server_ip
+2: server_port
+3: client_ip
+4: client_port
+5: connection id (for iperf)
+6: time-interval
+7: bytes transferred in the interval
+8: rate in the interval
+
+UDP example:
+0              1             2    3             4     5    6      7      8       9     10 11  12    13
+20150803222713,192.168.100.4,5002,192.168.100.2,36823,3, 5.0-6.0, 24990, 199920, 0.011,0, 17, 0.000,0
+20160525171330,192.168.1.77, 5001,192.168.1.52, 57997,5,20.0-21.0,130830,1046640,1.945,0, 89, 0.000,0
+20160525183306,192.168.1.77, 5001,192.168.1.52, 54274,5,21.0-22.0,0,     0,      0.000,0, 0,  -nan, 0
 
-	tzeros = {} # first timestamp of each user
-	
-	for line in runPexpect(cmd):
-		if stop.is_set():
-			break
-		"""
-		example line: 
-		0              1             2    3             4     5    6     7          8
-		20150803124132,10.100.13.214,5001,10.100.13.162,56695,4,0.0-17.4,1005453312,463275664
-
-		0: timestamp
-		1: server_ip
-		2: server_port
-		3: client_ip
-		4: client_port
-		5: connection id (for iperf)
-		6: time-interval
-		7: bytes transferred in the interval
-		8: rate in the interval
-		"""
-		cols = line.split(",")
+0-8: as TCP
+9:  jitter
+10: lost datagrams
+11: total datagrams
+12: lost percentage
+13: out-of-order datagrams
+"""
+IPERF_COLUMNS = {
+	"tcp" : {
+		"server_port"	: 2,
+		"client_port"	: 4,
+		"conn_id"		: 5,
+		"bytes"			: 7,
+		"bps"			: 8
+	},
+	"udp" : {
+		"server_port"	: 2,
+		"client_port"	: 4,
+		"conn_id"		: 5,
+		"bytes"			: 7,
+		"bps"			: 8,
+		"jitter"		: 9,
+		"lost"			: 10,
+		"datagrams"		: 11,
+		"loss"			: 12,
+		"out_of_order"	: 13
+	}
+}
+IPERF_LENGTH = {"tcp" : 9, "udp" : 14} # columns of a report
+IPERF_CLIENT_IP = 3
+IPERF_INTERVAL = 6
 
-		if not is_valid_tcp_line(cols,report_interval):
-			continue
+GROUP_BY = ["host", "connection"]
 
-		if is_tcp_sum_line(cols):
-			continue
+# iperf prints the intervals with one decimal
+INTERVAL_TOLERANCE = 0.01
 
-		uid, val_tcp = str(cols[3]), float(cols[8])
+"""
+Parse a block of iperf reports of prot (complete lines) into 
+the columns of its valid reports: "client_ip" (list), "intv0", 
+"intv1" and the columns of IPERF_COLUMNS[prot] (arrays).
+Valid reports are of the report interval (not the end of 
+transmission), not summation lines (TCP), not -nan and 
+without out-of-order datagrams (UDP).
+Malformed lines (e.g. truncated) are skipped
+"""
+def parse_iperf_block(block, prot, report_interval=IPERF_REPORT_INTERVAL):
+	n_cols = IPERF_LENGTH[prot]
+	# the tokens of all the lines (the block ends with a line terminator)
+	tokens = block.replace("\n", ",").split(",")[:-1]
+	try:
+		if len(tokens) != n_cols * block.count("\n"):
+			raise ValueError("lines of other lengths")
+		return iperf_columns(tokens, prot, report_interval)
+	except ValueError:
+		# parse the lines one by one to skip the malformed ones
+		parsed = []
+		for line in block.splitlines():
+			try:
+				parsed.append(iperf_columns(line.split(","), prot, report_interval))
+			except ValueError:
+				pass
+		columns = iperf_columns([], prot, report_interval)
+		for name in columns:
+			if len(parsed) > 0:
+				columns[name] = sum([c[name] for c in parsed], []) if name == "client_ip" \
+					else np.concatenate([c[name] for c in parsed])
+		return columns
 
-		"""
-		The unix timestamp is used only for the first packet
-		of each connection:
-		it is associated to iperf 0.0 time
-		"""
-		stamp = time.time()-t0
+"""
+Columns of the valid reports of the tokens of whole lines of prot
+(see parse_iperf_block). Raise ValueError if a line is malformed
+"""
+def iperf_columns(tokens, prot, report_interval):
+	n_cols = IPERF_LENGTH[prot]
+	if len(tokens) % n_cols != 0:
+		raise ValueError("{} columns expected".format(n_cols))
+	columns = dict((name, np.array(tokens[col::n_cols], dtype=float)) 
+		for name, col in IPERF_COLUMNS[prot].items())
+
+	# intervals "begin-end"
+	intvs = "-".join(tokens[IPERF_INTERVAL::n_cols]).split("-") if len(tokens) > 0 else []
+	if len(intvs) != 2 * len(columns["bps"]):
+		raise ValueError("invalid interval")
+	intvs = np.array(intvs, dtype=float)
+	columns["intv0"], columns["intv1"] = intvs[0::2], intvs[1::2]
+
+	valid = np.abs(columns["intv1"] - columns["intv0"] - report_interval) < INTERVAL_TOLERANCE
+	if prot == "tcp":
+		summation = (columns["server_port"] == 0) & (columns["client_port"] == 0) & (columns["conn_id"] < 0)
+		valid &= ~summation
+	else:
+		valid &= ~np.isnan(columns["loss"]) & (columns["out_of_order"] == 0)
 
-		with sem_data:
-			if uid not in data:
-				data[uid] = new_client_data()
-			
-			intvs = cols[6].split("-")
-			intv0 = float(intvs[0])
-			intv1 = float(intvs[1])
+	for name in columns:
+		columns[name] = columns[name][valid]
+	columns["client_ip"] = [ip for ip, ok in zip(tokens[IPERF_CLIENT_IP::n_cols], valid.tolist()) if ok]
+	return columns
 
-			if intv0 == 0.0 or uid not in tzeros:
-				tzeros[uid] = stamp - report_interval
+"""
+User of a connection (ip, port, connection id) of an iperf server:
+its host, or the connection itself ("ip:port") with group_by "connection"
+"""
+def flow_label(key):
+	if group_by == "connection":
+		return "{}:{}".format(key[0], int(key[1]))
+	return key[0]
 
-			stamp = tzeros[uid] + intv1
+"""
+Registry of the connections of an iperf server (see FlowRegistry),
+with the time of the iperf 0.0 of each connection
+("tzero", nan until its first report).
+A connection without reports for HISTORY_WINDOW is released:
+its samples are out of the window, and its id is reused
+"""
+def new_iperf_conns():
+	conns = FlowRegistry(flow_label, timeout=HISTORY_WINDOW)
+	conns.add_array("tzero", float, np.nan)
+	return conns
 
-			if uid not in singles:
-				singles[uid] = []
+"""
+Parse a block of iperf reports of prot and update data: 
+the records of the block are submitted at once.
+conns is the registry of the connections of the iperf server
+(see new_iperf_conns)
+"""
+def handle_iperf_block(data, block, conns, singles, prot):
+	report_interval = IPERF_REPORT_INTERVAL
 
-			singles[uid] = update_sum(data[uid], 
-				t=stamp, val=val_tcp, uid=uid, prot="tcp", singles=singles[uid])
+	columns = parse_iperf_block(block, prot, report_interval)
+	if len(columns["client_ip"]) == 0:
+		return
+	ids = conns.ids(zip(columns["client_ip"], columns["client_port"].tolist(), 
+		columns["conn_id"].tolist()))
+	uids = conns["label"][ids].tolist()
 
-	print "iPerf TCP server (port {}) terminated".format(port)
+	"""
+	The unix timestamp is used only for the first report
+	of each connection: it is associated to iperf 0.0 time.
+	UDP is connectionless so the first report may be lost:
+	we take as t0 the first datagram effectively arrived.
+	conns belongs to the source of the port: no lock needed
+	"""
+	now = clock() - t0
+	tzeros = conns["tzero"]
+	starts = (columns["intv0"] == 0.0) | np.isnan(tzeros[ids])
+	tzeros[ids[starts]] = now - report_interval
+	stamps = tzeros[ids] + columns["intv1"]
+	conns.seen(ids, stamps)
+	conns.expire(now)
 
-"""
-Return true if the UDP line is valid, false otherwise
-Example
-0              1             2    3             4     5    6      7      8       9     10 11  12    13
-20150803222713,192.168.100.4,5002,192.168.100.2,36823,3, 5.0-6.0, 24990, 199920, 0.011,0, 17, 0.000,0
-20160525171330,192.168.1.77, 5001,192.168.1.52, 57997,5,20.0-21.0,130830,1046640,1.945,0, 89, 0.000,0
-20160525183306,192.168.1.77, 5001,192.168.1.52, 54274,5,21.0-22.0,0,     0,      0.000,0, 0,  -nan, 0
+	submit_batch(data, singles, zip([prot] * len(uids), uids, stamps.tolist(), columns["bps"].tolist()))
 
-"""
-def is_valid_iperf_udp_line(cols, report_interval):
-	
-	# Valid length
-	if len(cols) != 14 or int(cols[13]) != 0:
-		return False
+def handle_iperf_tcp_block(data, block, conns, singles):
+	handle_iperf_block(data, block, conns, singles, "tcp")
 
-	# NaN lines
-	if cols[12] == "-nan":
-		return False
+def handle_iperf_udp_block(data, block, conns, singles):
+	handle_iperf_block(data, block, conns, singles, "udp")
 
+"""
+Parse a single iperf report (see handle_iperf_block)
+"""
+def handle_iperf_tcp_line(data, line, conns, singles):
+	handle_iperf_tcp_block(data, line.rstrip("\n") + "\n", conns, singles)
 
-	# Is a valid report interval? 
-	intvs = cols[6].split("-")
-	intv0 = float(intvs[0])
-	intv1 = float(intvs[1])
-	if intv1 - intv0 != float(report_interval):
-		return False
-	return True
+def handle_iperf_udp_line(data, line, conns, singles):
+	handle_iperf_udp_block(data, line.rstrip("\n") + "\n", conns, singles)
 
-def iperf_udp_thread(data, port, singles):
-	print "\niPerf UDP server listening on port {}".format(port)
+"""
+Start an iperf TCP server on port: mux dispatches its reports in blocks
+"""
+def iperf_tcp_source(mux, data, port, singles):
+	print "\niPerf TCP server listening on port {}".format(port)
 	report_interval = IPERF_REPORT_INTERVAL
-	cmd = "iperf -s -i{} -fk -yC -u -p{}".format(report_interval, port)
-
-	tzeros = {}
-	
-	for line in runPexpect(cmd):
-		if stop.is_set():
-			break
-		"""
-		example line: (len=14)
-		0              1             2    3             4     5    6     7       8       9     10 11  12    13
-		20150803222713,192.168.100.4,5002,192.168.100.2,36823,3, 5.0-6.0,24990,  199920, 0.011,0, 17, 0.000,0
-		20150804101346,10.100.13.162,5002,10.100.13.214,47833,11,4.0-5.0,1249500,9996000,0.025,0, 850,0.000,0
-
-		0:  timestamp
-		1:  server_ip
-		2:  server_port
-		3:  client_ip
-		4:  client_port
-		5:  connection-id (for iperf)
-		6:  time-interval
-		7:  bytes ?
-		8:  bandwidth ?
-		9:  jitter ?
-		10: lost datagrams ?
-		11: total datagrams ?
-		12: lost percentage ?
-		13: out-of-order diagrams ?
-		"""
+	cmd = "iperf -s -i{} -fk -yC -p{}".format(report_interval, port)
 
-		cols = line.split(",")
-		if not is_valid_iperf_udp_line(cols,report_interval):
-			continue
+	conns = new_iperf_conns()
 
-		uid, val_udp= str(cols[3]), int(cols[8])
+	def handle_block(block):
+		handle_iperf_tcp_block(data, block, conns, singles)
 
-		# iperf date is formatted, get the corresponding unix timestamp
-		stamp = time.time()-t0
+	mux.add("iPerf TCP server (port {})".format(port), cmd, handle_block, restart=True, blocks=True)
 
-		with sem_data:
-			if uid not in data:
-				data[uid] = new_client_data()
+"""
+Start an iperf UDP server on port: mux dispatches its reports in blocks
+"""
+def iperf_udp_source(mux, data, port, singles):
+	print "\niPerf UDP server listening on port {}".format(port)
+	report_interval = IPERF_REPORT_INTERVAL
+	cmd = "iperf -s -i{} -fk -yC -u -p{}".format(report_interval, port)
 
+	conns = new_iperf_conns()
 
-			intvs = cols[6].split("-")
-			intv0 = float(intvs[0])
-			intv1 = float(intvs[1])
-			
-			"""
-			UDP is connectionless so the first sample may be lost
-			We take as t0 the first datagram effectively arrived
-			"""         
-			if intv0 == 0.0 or uid not in tzeros:
-				tzeros[uid] = stamp - report_interval
+	def handle_block(block):
+		handle_iperf_udp_block(data, block, conns, singles)
 
-			stamp = tzeros[uid] + intv1
+	mux.add("iPerf UDP server (port {})".format(port), cmd, handle_block, restart=True, blocks=True)
 
-			if uid not in singles:
-				singles[uid] = []
-			singles[uid] = update_sum(data[uid],
-				t=stamp, val=val_udp, uid=uid, prot="udp", singles=singles[uid])
+"""
+Start bwm-ng on interface: mux dispatches its reports
+"""
+def bwm_ng_source(mux, data, interface):
+	print "\nbwm-ng started, measuring {} input traffic".format(interface)
+	cmd = "bwm-ng -u bits -T rate -t 1000 -I {} -d 0 -c 0 -o csv".format(interface)
 
-	print "iPerf UDP server (port {}) terminated".format(port)
+	def handle_lines(lines):
+		for line in lines:
+			handle_bwm_ng_line(data, line)
 
+	mux.add("bwm-ng", cmd, handle_lines, restart=True)
 
-def bwm_ng_thread(data, interface):
-	print "\nbwm-ng thread started, measuring {} input traffic".format(interface)
-	cmd = "bwm-ng -u bits -T rate -t 1000 -I {} -d 0 -c 0 -o csv".format(interface)
 
-	for line in runPexpect(cmd):
-		if stop.is_set():
-			break
-		"""
-		example line: 
-		0          1    2       3         4         5     6   7     8      9      10 11 12  13  14 15
-		1437515226;eth0;1620.00;123595.00;125215.00;24719;324;25.00;110.00;135.00;22;5;0.00;0.00;0;0
-		1437515226;total;1620.00;123595.00;125215.00;24719;324;25.00;110.00;135.00;22;5;0.00;0.00;0;0
-
-		0: unix timestamp   *
-		1: interface
-		2: bytes_out/s      *
-		3: bytes_in/s
-		4: bytes_total/s
-		5: bytes_in
-		6: bytes_out
-		7: packets_out/s
-		8: packets_in/s
-		9: packets_total/s
-		10: packets_in
-		11: packets_out
-		12: errors_out/s
-		13: errors_in/s
-		14: errors_in
-		15: errors_out 
-
-		Timestamps has a resolution in seconds, so we take a report every second
-
-		bwm t0:1437516400.0
-		png t0:1437517839.21
-
-		ping stamp:0.200218200684
-		bwm stamp: 1.0
-
-		The first (like) 10 timestamps comes at 1ms distance, 
-		the others every 1sec
-
-		Also if passing the -u bits option, rate reamins is in byte/s
 
-		"""
-		# Parsing
-		if line.find("total") == -1 : #only reports, not the total
-			cols = line.split(";")
-			stamp = int(cols[0]) - t0 
-			rate = float(cols[3])*8 # conversion byte/s --> bit/s
+"""
+Parse a bwm-ng report and update the SUM of data
+"""
+def handle_bwm_ng_line(data, line):
+	"""
+	example line: 
+	0          1    2       3         4         5     6   7     8      9      10 11 12  13  14 15
+	1437515226;eth0;1620.00;123595.00;125215.00;24719;324;25.00;110.00;135.00;22;5;0.00;0.00;0;0
+	1437515226;total;1620.00;123595.00;125215.00;24719;324;25.00;110.00;135.00;22;5;0.00;0.00;0;0
+
+	0: unix timestamp   *
+	1: interface
+	2: bytes_out/s      *
+	3: bytes_in/s
+	4: bytes_total/s
+	5: bytes_in
+	6: bytes_out
+	7: packets_out/s
+	8: packets_in/s
+	9: packets_total/s
+	10: packets_in
+	11: packets_out
+	12: errors_out/s
+	13: errors_in/s
+	14: errors_in
+	15: errors_out 
+
+	Timestamps has a resolution in seconds, so we take a report every second
+
+	bwm t0:1437516400.0
+	png t0:1437517839.21
+
+	ping stamp:0.200218200684
+	bwm stamp: 1.0
+
+	The first (like) 10 timestamps comes at 1ms distance, 
+	the others every 1sec
+
+	Also if passing the -u bits option, rate reamins is in byte/s
 
-			with sem_data:
-				data["SUM"]["total"]["t"].append(stamp)
-				data["SUM"]["total"]["val"].append(rate)
+	"""
+	# Parsing
+	if line.find("total") == -1 : #only reports, not the total
+		cols = line.split(";")
+		stamp = int(cols[0]) - t0 
+		rate = float(cols[3])*8 # conversion byte/s --> bit/s
 
-				now = int(time.time()-t0)
-				for uid in data:
-					if uid != "SUM":
-						for prot in ["tcp", "udp", "total"]:
-							update_death_flows(data[uid][prot], now)
+		# the death of the flows is checked when the record is applied
+		submit(data, None, ("SUM", None, stamp, rate))
 
-	print "bwm-ng thread terminated"
+"""
+Handle a sample of the interface counters (see NetDevSampler):
+the input rate of the interface is the SUM of the users
+"""
+def handle_net_dev_sample(data, t, rx, tx):
+	if not np.isnan(rx[0]):
+		submit(data, None, ("SUM", None, t - t0, rx[0]))
 
 
 def keyboard_listener_thread(do_visualize):
@@ -632,19 +768,227 @@ def keyboard_listener_thread(do_visualize):
 	finally:
 		print "Keyboard listener terminated"
 
+"""
+Create the lines of a user:
+raw tcp (solid) and udp (dashed) rates, and the total
+(unless the total subplot is a heatmap)
+"""
+def add_user_lines(lines, ax, src, total=True):
+	lines[src] = {}
+	lines[src]["tcp"], = ax["tcp-udp"].plot([],[], label=src)
+	src_color = lines[src]["tcp"].get_color()
+	lines[src]["udp"], = ax["tcp-udp"].plot([],[], color = src_color, linestyle = "--")
+	if total:
+		lines[src]["total"], = ax["total"].plot([],[], color = src_color, antialiased = True)
 
-def execute_matplotlib(data, window_size):
+"""
+Remove the lines of an inactive user (or no more in the top_k)
+"""
+def remove_user_lines(lines, ax, src):
+	if lines[src]["tcp"] in ax["tcp-udp"].lines:
+		ax["tcp-udp"].lines.remove(lines[src]["tcp"])
+	if lines[src]["udp"] in ax["tcp-udp"].lines:
+		ax["tcp-udp"].lines.remove(lines[src]["udp"])
+	if "total" in lines[src] and lines[src]["total"] in ax["total"].lines:
+		ax["total"].lines.remove(lines[src]["total"])
+	del(lines[src])
 
-	x_lim_left = 0 
-	x_lim_right = 1
-	wtw = 2 # white time window
-	wus = 1.1 # white upper space
+"""
+Users drawn as lines among the active ones (scores: user --> max 
+rate in the window): all of them, or the top_k with a background
+"""
+def shown_users(scores, background):
+	if background is None:
+		return set(scores)
+	return set(top_keys(scores, top_k))
+
+"""
+Draw the active users not drawn as lines in the background 
+(all of them in a heatmap, a row each): rows(names) returns 
+their rows, binned in x if x is given
+"""
+def update_background(background, active, shown, rows, x_lim_left, x_lim_right, x=None):
+	names = sorted(active)
+	if background.kind == "collection":
+		names = [name for name in names if name not in shown]
+	if x is None:
+		background.update(rows(names), x_lim_left, x_lim_right, shown)
+	else:
+		background.update_binned(names, x, rows(names), x_lim_left, x_lim_right, shown)
+
+"""
+Update axis and lines from the per-user series.
+lod is the dict of the Decimator of each raw line: (src, key) --> Decimator
+(None to draw all the samples).
+smoothers is the dict of the StreamingSmoother of each user (None to smooth
+from scratch), horizons the stable horizon of the total of each user
+(see stable_horizon, computed without singles if missing).
+background is the FlowView of the totals (None to draw a line for each 
+user): only the top_k users by max rate get their lines
+"""
+def update_series_lines(data, lines, ax, x_lim_left, x_lim_right, wus, sticky=False, lod=None,
+	smoothers=None, horizons=None, background=None):
+	if smoothers is None:
+		smoothers = {}
+	if horizons is None:
+		horizons = {}
+	heatmap = background is not None and background.kind == "heatmap"
+
+	active = [uid for uid in data if uid != "SUM" and len(data[uid]["total"]) > 0 
+		and data[uid]["total"].last_t() >= x_lim_left]
+	shown = shown_users(dict((uid, data[uid]["total"].max_since(x_lim_left)) for uid in active), 
+		background)
+
+	"""
+	Dinamically set the graph height and width
+	(from the windowed max of the totals)
+	"""
+	for key in ax:
+		if key=="tcp-udp" and len(data["SUM"]["total"]) > 0:
+			"""
+			Use bwm-ng data
+			"""
+			max_y = window_max([data["SUM"]["total"]], x_lim_left)
+		else:
+			"""
+			Search the max y value in sums
+			"""
+			max_y = window_max([data[uid]["total"] for uid in data if uid != "SUM"], x_lim_left)
+
+		if not (heatmap and key == "total"):
+			set_limits(ax[key], x_lim_left, x_lim_right, max_y*wus, sticky)
+
+
+	"""
+	Update lines
+	"""
+	for src in data:
+
+		"""
+		Remove inactive lines (and the ones out of the top_k)
+		"""
+		if src != "SUM":
+			if src in lines and src not in shown:
+				remove_user_lines(lines, ax, src)
+				smoothers.pop(src, None)
+				if lod is not None:
+					for key in data[src]:
+						lod.pop((src, key), None)
+			if src not in shown:
+				continue
+
+
+		"""
+		Add new lines
+		"""
+		if src!= "SUM" and src not in lines:
+			add_user_lines(lines, ax, src, total=not heatmap)
+
+
+		"""
+		Smooth lines
+		"""
+		for key in data[src]:
+			if len(data[src]["total"]) <= 0 or key not in lines[src]:
+				continue
+			if data[src]["total"].last_t() >= x_lim_left:
+				first_index = max(0,first_index_geq(data[src][key].t, x_lim_left)-2)
+				last_index = max(0,len(data[src][key])-1)
+				x = data[src][key].t[first_index:last_index]
+				y = data[src][key].val[first_index:last_index]
+				if src!="SUM" and key=="total":
+					if src not in smoothers:
+						smoothers[src] = StreamingSmoother(1.0 / DENSITY_LINSPACE, SMOOTH_WINDOW, 
+							smoothing, HISTORY_WINDOW)
+					horizon = horizons.get(src)
+					if horizon is None:
+						horizon = stable_horizon(data[src]["total"])
+					smoothers[src].update(data[src]["total"], horizon)
+					lines[src][key].set_data(*smoothers[src].view(x_lim_left))
+				elif lod is not None:
+					if (src, key) not in lod:
+						lod[(src, key)] = Decimator(settle=DEATH_TOLERANCE)
+					lines[src][key].set_data(*lod[(src, key)].reduce(x, y, 
+						x_lim_left, x_lim_right, int(lines[src][key].axes.bbox.width)))
+				else:							
+					lines[src][key].set_data(x,y)
+
+	if background is not None:
+		update_background(background, active, shown, 
+			lambda names: [(uid,) + data[uid]["total"].window_view(x_lim_left) for uid in names],
+			x_lim_left, x_lim_right)
+
+"""
+Update axis and lines from the binned aggregation:
+per-user totals are the sum of the protocol rows,
+the iperf SUM is the sum of all the users
+(background as in update_series_lines)
+"""
+def update_grid_lines(grid, sum_series, lines, ax, x_lim_left, x_lim_right, wus, sticky=False,
+	background=None):
+	heatmap = background is not None and background.kind == "heatmap"
+	x = grid.times()
+	begin = max(0, int(np.searchsorted(x, x_lim_left)) - 1)
+	x = x[begin:]
+
+	iperf_sum = grid.total()[begin:]
+	lines["SUM"]["iperf"].set_data(x, iperf_sum)
+
+	max_y = {"tcp-udp" : np.max(iperf_sum) if len(x) > 0 else 1, "total" : 1}
+	if len(sum_series) > 0:
+		max_y["tcp-udp"] = window_max([sum_series], x_lim_left, max_y["tcp-udp"])
+		lines["SUM"]["total"].set_data(*sum_series.window_view(x_lim_left))
+
+	totals = {} # totals of the active users
+	for src in grid.keys:
+		total = grid.key_total(src)[begin:]
+		if total.any():
+			totals[src] = total
+			max_y["total"] = max(max_y["total"], np.max(total))
+	shown = shown_users(dict((src, np.max(total)) for src, total in totals.items()), background)
+
+	for src in grid.keys:
+
+		"""
+		Remove inactive lines (and the ones out of the top_k)
+		"""
+		if src not in shown:
+			if src in lines:
+				remove_user_lines(lines, ax, src)
+			continue
+
+		"""
+		Add new lines
+		"""
+		if src not in lines:
+			add_user_lines(lines, ax, src, total=not heatmap)
+
+		for key in ["tcp", "udp"]:
+			lines[src][key].set_data(x, grid.view(src, key)[begin:])
+		if "total" in lines[src]:
+			lines[src]["total"].set_data(x, totals[src])
+
+	if background is not None:
+		update_background(background, list(totals), shown, 
+			lambda names: np.array([totals[src] for src in names]).reshape(len(names), len(x)),
+			x_lim_left, x_lim_right, x)
+
+	for key in ax:
+		if not (heatmap and key == "total"):
+			set_limits(ax[key], x_lim_left, x_lim_right, max(1,max_y[key])*wus, sticky)
+
+
+"""
+Create the figure, the subplots and the SUM lines.
+Return fig, ax (axes or subplots), lines (lines to plot) and 
+the FlowView of the totals (None with a line for each user)
+"""
+def init_figure(window_size):
+	import matplotlib.pyplot as plt, matplotlib.ticker
 	lines = {} # lines to plot
 	ax = {} # axes or subplots
-	w_size = window_size
-	
-	fig = plt.figure(1, figsize=w_size)
-	plt.ion()
+
+	fig = plt.figure(1, figsize=window_size)
 
 	subplots = {
 		"tcp-udp" : {
@@ -654,12 +998,18 @@ def execute_matplotlib(data, window_size):
 		},
 		"total" : {
 			"position"  : 212,
-			"title"     : "Per-user smoothed rate ({}s window)".format((SMOOTH_WINDOW*IPERF_REPORT_INTERVAL)/DENSITY_LINSPACE),
+			"title"     : "Per-user smoothed rate ({}, {}s window)".format(smoothing, 
+				(SMOOTH_WINDOW*IPERF_REPORT_INTERVAL)/float(DENSITY_LINSPACE)),
 			"xlabel"	: "time [s]",
 			"ylabel"    : "bit-rate [bit/s]"
 		}
 	}
 
+	if grid is not None or view == "heatmap":
+		subplots["total"]["title"] = "Per-user rate ({}s bins)".format(IPERF_REPORT_INTERVAL)
+	if view == "heatmap":
+		subplots["total"]["ylabel"] = "users"
+
 	# format bitrates on y axis
 	mkfunc = lambda x, pos: '%1.1fM' % (x*1e-6) if x>=1e6 else '%1.1fK' % (x*1e-3) if x>=1e3 else '%1.1f' % x
 	mkformatter = matplotlib.ticker.FuncFormatter(mkfunc)
@@ -682,28 +1032,71 @@ def execute_matplotlib(data, window_size):
 
 	lines["SUM"] = {}
 	lines["SUM"]["total"], = ax["tcp-udp"].plot([],[], label="SUM", color="black")
+	if grid is not None:
+		lines["SUM"]["iperf"], = ax["tcp-udp"].plot([],[], label="iperf SUM", color="black", linestyle=":")
 	print_legend(ax["tcp-udp"],0)
 
+	background = None
+	if view != "lines":
+		background = FlowView(ax["total"], view, IPERF_REPORT_INTERVAL, fmt=mkformatter)
+
+	return fig, ax, lines, background
+
+
+"""
+Main plot cycle.
+Each frame draws the latest snapshot of publisher:
+the plot never takes the lock of the data.
+With blit, the lines are blitted on a cached background:
+the x window moves by steps, the y limits are sticky and the legend
+is rebuilt only when the number of users changes, so the whole
+figure is redrawn only when something else than the lines changes.
+"""
+def execute_matplotlib(publisher, window_size, blit=False):
+
+	x_lim_left = 0 
+	x_lim_right = 1
+	wtw = 2 # white time window
+	wus = 1.1 # white upper space
+	num_users = 0 # users in the legend
+	legend_keys = set() # lines in the legend
+	lod = {} # Decimator of each raw line
+	smoothers = {} # StreamingSmoother of each user
+
+	import matplotlib.pyplot as plt
+	fig, ax, lines, background = init_figure(window_size)
+	plt.ion()
+
 	plt.show()
 
+	renderer = None
+	if blit:
+		renderer = BlitManager(fig)
+
 	# ------------------------------- MAIN PLOT CICLE -----------------------------
 	while not stop.is_set():
 
 		time.sleep(IPERF_REPORT_INTERVAL)
 
 		if screenshot.is_set():
-			plt.savefig('plot-{}.pdf'.format(time.time()), format="PDF")
+			if renderer is not None:
+				renderer.savefig('plot-{}.pdf'.format(time.time()), format="PDF")
+			else:
+				plt.savefig('plot-{}.pdf'.format(time.time()), format="PDF")
 			screenshot.clear()
 
 		if pause.is_set():
 			continue
 
-		now = int(time.time()-t0)
+		now = int(clock()-t0)
 
 		"""
 		Update axis and do reset
 		"""
-		x_lim_right = int(now + wtw)
+		if renderer is not None:
+			x_lim_right = stepped(now + wtw, X_STEP)
+		else:
+			x_lim_right = int(now + wtw)
 
 		"""
 		If x_lim_right exceed MAX_TIME_WINDOW,
@@ -717,88 +1110,27 @@ def execute_matplotlib(data, window_size):
 		"""
 		Update the plot
 		"""
-		with sem_data:
-
-			"""
-			Dinamically set the graph height and width
-			"""
-			for key in subplots:
-				if key=="tcp-udp" and len(data["SUM"]["total"]["val"]) > 0:
-					"""
-					Use bwm-ng data
-					"""
-					index = first_index_geq(data["SUM"]["total"]["t"], x_lim_left)
-					max_y = np.max(data["SUM"]["total"]["val"][index:])
-				else:
-					"""
-					Search the max y value in sums
-					"""
-					max_y = 1
-					for uid in data:
-						if uid!="SUM" and len(data[uid]["total"]["val"]) > 0:  
-							index = first_index_geq(data[uid]["total"]["t"], x_lim_left)
-							max_y = max(max_y, np.max(data[uid]["total"]["val"][index:]))
-
-				ax[key].set_ylim(0, max(1,max_y)*wus)  
-				ax[key].set_xlim(x_lim_left, x_lim_right)  
-
+		snapshot = publisher.latest
+		if snapshot is None:
+			continue
 
-			"""
-			Update lines
-			"""
-			for src in data:
-
-				"""
-				Remove inactive lines
-				"""
-				if src != "SUM":
-					if data[src]["total"]["t"][-1] < x_lim_left and src in lines:
-						if lines[src]["tcp"] in ax["tcp-udp"].lines:
-							ax["tcp-udp"].lines.remove(lines[src]["tcp"])
-						if lines[src]["udp"] in ax["tcp-udp"].lines:
-							ax["tcp-udp"].lines.remove(lines[src]["udp"])
-						if lines[src]["total"] in ax["total"].lines:
-							ax["total"].lines.remove(lines[src]["total"])
-						del(lines[src])
-
-
-				"""
-				Add new lines
-				"""
-				if src!= "SUM" and src not in lines and data[src]["total"]["t"][-1] >= x_lim_left:
-					lines[src]={}
-					src_color = ""
-					for key in sorted(data[src]):
-						if key == "tcp":
-							lines[src][key], = ax["tcp-udp"].plot([],[], label=src)
-							src_color = lines[src][key].get_color()
-						elif key == "total":
-							lines[src][key], = ax["total"].plot([],[], color = src_color, antialiased = True)
-						elif key == "udp":
-							lines[src][key], = ax["tcp-udp"].plot([],[], color = src_color, linestyle = "--")
-
-
-				"""
-				Smooth lines
-				"""
-				for key in data[src]:
-					if len(data[src]["total"]["t"]) <= 0:
-						continue
-					if data[src]["total"]["t"][-1] >= x_lim_left:
-						first_index = max(0,first_index_geq(data[src][key]["t"], x_lim_left)-2)
-						last_index = max(0,len(data[src][key]["t"])-1)
-						x = list(data[src][key]["t"][first_index:last_index])
-						y = list(data[src][key]["val"][first_index:last_index])
-						if src!="SUM" and key=="total" and len(x)>(SMOOTH_WINDOW/DENSITY_LINSPACE)+1:
-							f = interpolate.interp1d(x,y)
-							new_x = np.linspace(min(x),max(x), (x_lim_right - x_lim_left)*DENSITY_LINSPACE )
-							new_y = smooth(f(new_x), SMOOTH_WINDOW)
-							lines[src][key].set_data(new_x,new_y)
-						else:							
-							lines[src][key].set_data(x,y)
-		
-		print_legend(ax["tcp-udp"],count_users(data))
-		fig.canvas.draw()  
+		if snapshot.grid is not None:
+			update_grid_lines(snapshot.grid, snapshot.data["SUM"]["total"], lines, ax, 
+				x_lim_left, x_lim_right, wus, sticky=blit, background=background)
+		else:
+			update_series_lines(snapshot.data, lines, ax, x_lim_left, x_lim_right, wus, 
+				sticky=blit, lod=lod, smoothers=smoothers, horizons=snapshot.horizons,
+				background=background)
+
+		if renderer is not None:
+			new_users = count_users(snapshot)
+			if new_users != num_users or set(lines) != legend_keys:
+				print_legend(ax["tcp-udp"], new_users)
+				num_users, legend_keys = new_users, set(lines)
+			renderer.update()
+		else:
+			print_legend(ax["tcp-udp"],count_users(snapshot))
+			fig.canvas.draw()  
 
 	plt.close()
 	print "Matplotlib terminated"
@@ -806,34 +1138,161 @@ def execute_matplotlib(data, window_size):
 
 #--------------------- MAIN PROGRAM -----------------------------
 
+"""
+Worker process of a sharded server: runs the iperf servers of 
+its ports and adds their rates to shard, its shared grid,
+one batch of records at a time.
+The parsed samples are recorded in record_file (None not to record).
+The worker stops when shard_stop is set
+"""
+def run_shard(shard, tcp_ports, udp_ports, shard_stop, record_file=None):
+	global grid, shards, aggregator, publisher, recorder
+	grid, shards, publisher, recorder = shard, None, None, None
+	if record_file is not None:
+		recorder = Recorder(record_file)
+	data = set_data()
+	singles = {}
+
+	def apply_batch(records):
+		shard.begin_write()
+		try:
+			apply_records(data, singles, records)
+		finally:
+			shard.end_write()
+
+	# parsing and aggregation run in the thread of the multiplexer
+	aggregator = RecordBatch(apply_batch)
+	mux = ProcessMux(shard_stop, after_dispatch=aggregator.flush)
+	try:
+		for tcp_port in tcp_ports:
+			iperf_tcp_source(mux, data, tcp_port, singles)
+		for udp_port in udp_ports:
+			iperf_udp_source(mux, data, udp_port, singles)
+		mux.run()
+	except (KeyboardInterrupt):
+		pass
+	finally:
+		mux.close()
+		aggregator.flush()
+		if recorder is not None:
+			recorder.close()
+
+"""
+Start n_shards worker processes sharing the ports (see run_shard).
+With record_file, each worker records its samples in its own
+file, record_file.shard<i>.
+Return the workers
+"""
+def start_shards(n_shards, tcp_ports, udp_ports, shard_stop, record_file=None):
+	global shards
+	shards = []
+	workers = []
+	for i in range(n_shards):
+		shard = SharedTimeGrid(IPERF_REPORT_INTERVAL, HISTORY_WINDOW, ["tcp", "udp"], 
+			phase=t0 % IPERF_REPORT_INTERVAL)
+		shard_file = None if record_file is None else shard_record_file(record_file, i)
+		worker = multiprocessing.Process(target=run_shard, 
+			args=(shard, tcp_ports[i::n_shards], udp_ports[i::n_shards], shard_stop, shard_file))
+		worker.daemon = True
+		worker.start()
+		shards.append(shard)
+		workers.append(worker)
+	return workers
+
+def shard_record_file(record_file, i):
+	return "{}.shard{}".format(record_file, i)
+
+"""
+The records of the shards do not go through the aggregator
+of this process: merge their grids (no lock needed, see 
+SharedTimeGrid) and publish them periodically
+"""
+def publish_shards_thread(publisher):
+	global shards_grid
+	while not stop.wait(PUBLISH_INTERVAL):
+		merged = merge_grids([shard.read() for shard in shards])
+		with sem_data:
+			shards_grid = merged
+			publisher.update()
+
 
 def run_server(intf, tcp_ports, udp_ports, duration, 
-	do_visualize, do_check, expected_users, check_t, window_size):
+	do_visualize, do_check, expected_users, check_t, window_size, binned=False,
+	record_file=None, blit=False, smooth_kind="hann", n_shards=0, 
+	sample_period=SAMPLE_PERIOD, use_bwm_ng=False, group="host", view_kind="lines", top=TOP_K):
 
 	pause.clear() # clear the pause plot event
 	stop.clear() # clear the stop event
 	screenshot.clear()
 	data = set_data() # initialize the data structure
-	singles = {} # timestamps of sums executed without an element for each uid
+	singles = {} # Singles (sums executed without an element) for each uid
 	threads = {} # dict of threads	
 	killall("iperf") # Delete any previous process
 	killall("bwm-ng") # Delete any previous process
 	global t0 # use a single global initial time stamp
 	t0 = time.time() # t0 is now
 
-	threads["bwm-ng"] = threading.Thread(
-		target=bwm_ng_thread, 
-		args=(data,intf))
+	"""
+	Binned aggregation: bins are aligned to the whole seconds 
+	of the unix time, like the bwm-ng timestamps
+	"""
+	# before the shards are forked: their workers inherit them
+	global smoothing, group_by, view, top_k
+	smoothing = smooth_kind
+	group_by = group
+	view, top_k = view_kind, top
+
+	global grid
+	grid = None
+	if binned or n_shards > 0:
+		grid = TimeGrid(IPERF_REPORT_INTERVAL, HISTORY_WINDOW, ["tcp", "udp"], 
+			phase=t0 % IPERF_REPORT_INTERVAL)
 
+	"""
+	Sharded server: the iperf servers run in n_shards worker processes
+	(started before any other thread), this process runs bwm-ng
+	and merges their grids
+	"""
+	global shards, shards_grid
+	shards = shards_grid = None
+	workers = []
+	shard_stop = multiprocessing.Event()
+	n_shards = min(n_shards, len(tcp_ports) + len(udp_ports))
+	if n_shards > 0:
+		workers = start_shards(n_shards, tcp_ports, udp_ports, shard_stop, record_file)
+		tcp_ports, udp_ports = [], []
+
+	global recorder
+	recorder = None
+	if record_file is not None:
+		recorder = Recorder(record_file)
+
+	# readers (plot, checks) take the published snapshots, not data
+	global publisher
+	publisher = new_publisher(data, singles)
+
+	# the parsers only parse: the aggregator applies their records
+	global aggregator
+	aggregator = Aggregator(lambda records: apply_records(data, singles, records), sem_data,
+		publisher=publisher)
+	aggregator.start()
+
+	# one thread reads the output of all the iperf servers (and bwm-ng)
+	mux = ProcessMux(stop)
+	if use_bwm_ng:
+		bwm_ng_source(mux, data, intf)
+	else:
+		print "\nSampling {} input traffic every {}s".format(intf, sample_period)
+		sampler = NetDevSampler([intf],
+			lambda t, rx, tx: handle_net_dev_sample(data, t, rx, tx), stop, sample_period)
+		threads["sampler"] = threading.Thread(target=sampler.run)
 	for tcp_port in tcp_ports:
-		threads["iperf_tcp_"+str(tcp_port)] = threading.Thread(
-			target=iperf_tcp_thread, 
-			args=(data,tcp_port,singles))
-
+		iperf_tcp_source(mux, data, tcp_port, singles)
 	for udp_port in udp_ports:
-		threads["iperf_udp_"+str(udp_port)] = threading.Thread(
-			target=iperf_udp_thread, 
-			args=(data,udp_port,singles))
+		iperf_udp_source(mux, data, udp_port, singles)
+	threads["mux"] = threading.Thread(target=mux.run)
+	if shards is not None:
+		threads["shards"] = threading.Thread(target=publish_shards_thread, args=(publisher,))
 
 	stop_timer = Timer(duration, stop_server)
 	if duration > 0:		
@@ -844,16 +1303,16 @@ def run_server(intf, tcp_ports, udp_ports, duration,
 			args=(do_visualize,))
 
 	if do_check and expected_users > 0 and check_t > 0:
-		check_timer = Timer(check_t, check_number_of_users, args=(data, expected_users))
+		check_timer = Timer(check_t, check_number_of_users, args=(publisher, expected_users))
 		check_timer.start()
 	
-	# start iperf and keyboard threads
+	# start the multiplexer and keyboard threads
 	for t in threads:
 		threads[t].start()
 
 	# start the plot
 	if do_visualize:
-		execute_matplotlib(data, window_size)
+		execute_matplotlib(publisher, window_size, blit)
 
 	# wait until the end of the test
 	try:
@@ -866,45 +1325,99 @@ def run_server(intf, tcp_ports, udp_ports, duration,
 	finally:
 		print "Server terminated!"
 		stop_timer.cancel()
+		threads["mux"].join()
+		shard_stop.set()
+		for worker in workers:
+			worker.join()
 		killall("iperf")
 		killall("bwm-ng")
+		aggregator.stop()
+		aggregator = None
+		if recorder is not None:
+			recorder.close()
+			print "Samples recorded in {}".format(record_file)
+			for i in range(len(workers)):
+				print "Samples of shard {} recorded in {}".format(i, shard_record_file(record_file, i))
 		return data
 	
 
 
-parser = argparse.ArgumentParser(description='Plot incoming iPerf rates')
+"""
+Parse the command line (argv, sys.argv by default) and run the server
+"""
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Plot incoming iPerf rates')
+
+	parser.add_argument('-i', dest='intf', nargs='?', default='wlp8s0',
+		help='The network interface name receiving data')
+
+	parser.add_argument('-t', dest='tcp_ports', nargs='+', default=[5001], type=int, 
+		help='List of listening TCP ports')
+
+	parser.add_argument('-u', dest='udp_ports', nargs='+', default=[5201], type=int, 
+		help='List of listening UDP ports')
+
+	parser.add_argument('-d', dest='duration', nargs='?', default=-1, type=int, 
+		help='Duration of the test [seconds]. Default infinite')
+
+	parser.add_argument('--no-plot', dest='do_visualize', action='store_false',
+		help='Do not show the plot')
+	parser.set_defaults(do_visualize=True)
+
+	parser.add_argument('--do-check', dest='do_check', action='store_true',
+		help='Check the number of active users at a given instant')
+	parser.set_defaults(do_check=False)
+
+	parser.add_argument('-c', dest='check_t', nargs='?', default=1, type=int, 
+		help='Instant to check the number of active users')
+
+	parser.add_argument('-e', dest='expected_users', nargs='?', default=1, type=int, 
+		help='Number of expected active users at the check time')
+
+	parser.add_argument('-w', dest='window_size', nargs=2, default=[11,8], type=int, 
+		help='Width and height of the window [inch]')
+
+	parser.add_argument('--binned', dest='binned', action='store_true',
+		help='Aggregate rates in aligned bins of the iperf report interval')
+	parser.set_defaults(binned=False)
+
+	parser.add_argument('--record', dest='record_file', nargs='?', default=None,
+		help='Record the parsed samples in a binary file (with --shards, the iperf samples '
+			'of each shard in FILE.shard<i>)')
 
-parser.add_argument('-i', dest='intf', nargs='?', default='wlp8s0',
-	help='The network interface name receiving data')
+	parser.add_argument('--blit', dest='blit', action='store_true',
+		help='Redraw only the lines at each frame (faster rendering)')
+	parser.set_defaults(blit=False)
 
-parser.add_argument('-t', dest='tcp_ports', nargs='+', default=[5001], type=int, 
-	help='List of listening TCP ports')
+	parser.add_argument('--smooth', dest='smooth_kind', choices=StreamingSmoother.KINDS, default='hann',
+		help='Filter of the per-user smoothed rates: Hann FIR, EWMA or causal moving average')
 
-parser.add_argument('-u', dest='udp_ports', nargs='+', default=[5201], type=int, 
-	help='List of listening UDP ports')
+	parser.add_argument('--shards', dest='n_shards', nargs='?', default=0, type=int,
+		help='Parse the iperf ports in this many worker processes (implies --binned)')
 
-parser.add_argument('-d', dest='duration', nargs='?', default=-1, type=int, 
-	help='Duration of the test [seconds]. Default infinite')
+	parser.add_argument('--sample-period', dest='sample_period', nargs='?', default=SAMPLE_PERIOD, type=float,
+		help='Seconds between two samples of the interface counters')
 
-parser.add_argument('--no-plot', dest='do_visualize', action='store_false',
-	help='Do not show the plot')
-parser.set_defaults(do_visualize=True)
+	parser.add_argument('--bwm-ng', dest='use_bwm_ng', action='store_true',
+		help='Measure the interface with bwm-ng instead of reading /proc/net/dev')
+	parser.set_defaults(use_bwm_ng=False)
 
-parser.add_argument('--do-check', dest='do_check', action='store_true',
-	help='Check the number of active users at a given instant')
-parser.set_defaults(do_check=False)
+	parser.add_argument('--group-by', dest='group_by', choices=GROUP_BY, default='host',
+		help='Plot a user for each client host or for each connection')
 
-parser.add_argument('-c', dest='check_t', nargs='?', default=1, type=int, 
-	help='Instant to check the number of active users')
+	parser.add_argument('--view', dest='view', choices=VIEWS, default='lines',
+		help='Draw a line for each user, or only the top users and the others in a single collection or heatmap')
 
-parser.add_argument('-e', dest='expected_users', nargs='?', default=1, type=int, 
-	help='Number of expected active users at the check time')
+	parser.add_argument('--top', dest='top_k', nargs='?', default=TOP_K, type=int,
+		help='Users drawn as lines in the collection and heatmap views')
 
-parser.add_argument('-w', dest='window_size', nargs=2, default=[11,8], type=int, 
-	help='Width and height of the window [inch]')
+	args = parser.parse_args(argv)
 
+	run_server(args.intf, args.tcp_ports, args.udp_ports, args.duration, 
+		args.do_visualize, args.do_check, args.expected_users, args.check_t, args.window_size,
+		args.binned, args.record_file, args.blit, args.smooth_kind, args.n_shards,
+		args.sample_period, args.use_bwm_ng, args.group_by, args.view, args.top_k)
 
-args = parser.parse_args()
 
-run_server(args.intf, args.tcp_ports, args.udp_ports, args.duration, 
-	args.do_visualize, args.do_check, args.expected_users, args.check_t, args.window_size)
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,322 @@
+import math, heapq
+import numpy as np
+
+"""
+Rendering helpers shared by plot_server and plot_client
+(matplotlib is imported by the helpers that draw)
+"""
+
+# views of the flows of a subplot (see FlowView)
+VIEWS = ["lines", "collection", "heatmap"]
+
+# flows drawn as lines in the collection and heatmap views
+TOP_K = 10
+
+# color of the flows of a LineCollection
+OTHERS_COLOR = "0.7"
+
+"""
+Return the smallest multiple of step >= x:
+with a stepped x window the limits change once every step seconds
+instead of at every frame
+"""
+def stepped(x, step):
+	return int(math.ceil(x / float(step))) * step
+
+"""
+Return the top of a scale for the data max y_top: the old top,
+unless the data exceed it or fall below half of it
+"""
+def sticky_top(old_top, y_top):
+	if old_top / 2 < y_top <= old_top:
+		return old_top
+	return y_top
+
+"""
+Set the limits of a subplot (y from 0 to y_top).
+With sticky the y limit only grows when the data exceed it,
+and shrinks when they fall below half of it:
+small variations do not change the axes
+"""
+def set_limits(ax, x_left, x_right, y_top, sticky=False):
+	bottom, old_top = ax.get_ylim()
+	if sticky:
+		y_top = sticky_top(old_top, y_top)
+	if tuple(ax.get_xlim()) != (x_left, x_right):
+		ax.set_xlim(x_left, x_right)
+	if (bottom, old_top) != (0, y_top):
+		ax.set_ylim(0, y_top)
+
+
+"""
+Return the max of the series from t_left on (at least floor),
+read from their windowed max (see TimeSeries.max_since)
+"""
+def window_max(series, t_left, floor=1):
+	top = floor
+	for s in series:
+		m = s.max_since(t_left)
+		if m is not None and m > top:
+			top = m
+	return top
+
+
+"""
+Return the k keys of scores (dict key --> score) with the highest score
+"""
+def top_keys(scores, k):
+	return heapq.nlargest(k, scores, key=scores.get)
+
+"""
+Return the means of flows (a list of (t, val)) in the time bins of
+bin_width seconds from x_left: a row per flow, n_bins columns
+(nan where a flow has no samples).
+The samples of all the flows are binned at once
+"""
+def bin_flows(flows, x_left, bin_width, n_bins):
+	if len(flows) == 0:
+		return np.zeros((0, n_bins))
+	rows = np.repeat(np.arange(len(flows)), [len(ft) for ft, fval in flows])
+	t = np.concatenate([ft for ft, fval in flows])
+	val = np.concatenate([fval for ft, fval in flows]).astype(np.float64)
+	col = np.floor((t - x_left) / bin_width).astype(np.int64)
+	ok = (col >= 0) & (col < n_bins) & ~np.isnan(val)
+	cell = rows[ok] * n_bins + col[ok]
+	size = len(flows) * n_bins
+	sums = np.bincount(cell, weights=val[ok], minlength=size)
+	counts = np.bincount(cell, minlength=size).astype(np.float64) # float even if empty
+	with np.errstate(invalid="ignore"):
+		return (sums / counts).reshape(len(flows), n_bins)
+
+"""
+Background view of the flows of a subplot, in place of a Line2D
+per flow (see the views of the plots):
+	- "collection": the flows are the segments of a single LineCollection
+	- "heatmap": image of the flows over time (a row per flow, in the
+	  given order, with its mean in bins of bin_width seconds and a 
+	  colorbar formatted by fmt); the y axis counts the flows, 
+	  and the highlighted ones are named on it
+The cost of drawing does not grow with an artist per flow
+"""
+class FlowView(object):
+
+	def __init__(self, ax, kind, bin_width, fmt=None):
+		self.ax = ax
+		self.kind = kind
+		self.bin_width = float(bin_width)
+		self._ticks = None # highlighted rows and their names
+		if kind == "collection":
+			from matplotlib.collections import LineCollection
+			self.artist = LineCollection([], colors=OTHERS_COLOR, linewidths=0.5, antialiaseds=False)
+			ax.add_collection(self.artist)
+		else:
+			self.artist = ax.imshow(np.full((1, 1), np.nan), aspect="auto", origin="lower",
+				interpolation="nearest", extent=(0, 1, 0, 1), vmin=0, vmax=1)
+			ax.figure.colorbar(self.artist, ax=ax, pad=0.01, format=fmt)
+			ax.grid(False)
+
+	"""
+	Draw flows, a list of (name, t, val) in the x window [x_left, x_right].
+	With a heatmap, the flows named in top are highlighted
+	"""
+	def update(self, flows, x_left, x_right, top=()):
+		if self.kind == "collection":
+			self.artist.set_segments([np.column_stack((t, val)) for name, t, val in flows])
+			return
+		n_bins = max(1, int(math.ceil((x_right - x_left) / self.bin_width)))
+		matrix = bin_flows([(t, val) for name, t, val in flows], x_left, self.bin_width, n_bins)
+		self._show([name for name, t, val in flows], matrix, 
+			x_left, x_left + n_bins * self.bin_width, x_left, x_right, top)
+
+	"""
+	Draw the flows names already binned: the rows of matrix,
+	with a column for each bin centered in x (see update)
+	"""
+	def update_binned(self, names, x, matrix, x_left, x_right, top=()):
+		if self.kind == "collection":
+			self.artist.set_segments([np.column_stack((x, row)) for row in matrix])
+			return
+		half = self.bin_width / 2
+		begin, end = (x[0] - half, x[-1] + half) if len(x) > 0 else (x_left, x_right)
+		self._show(names, matrix, begin, end, x_left, x_right, top)
+
+	"""
+	Show matrix as the image from begin to end
+	"""
+	def _show(self, names, matrix, begin, end, x_left, x_right, top):
+		n = len(names)
+		self.artist.set_data(matrix if n > 0 and matrix.shape[1] > 0 else np.full((1, 1), np.nan))
+		self.artist.set_extent((begin, end, 0, max(1, n)))
+		finite = matrix[np.isfinite(matrix)]
+		vmax = max(1, finite.max()) if len(finite) > 0 else 1
+		self.artist.set_clim(0, sticky_top(self.artist.get_clim()[1], vmax))
+		set_limits(self.ax, x_left, x_right, max(1, n))
+
+		rows = [i for i, name in enumerate(names) if name in top]
+		ticks = ([i + 0.5 for i in rows], [names[i] for i in rows])
+		if ticks != self._ticks:
+			self.ax.set_yticks(ticks[0])
+			self.ax.set_yticklabels(ticks[1], fontsize="x-small")
+			self._ticks = ticks
+
+
+"""
+Blitting renderer of a figure.
+The lines (and the collections and images of the flows) are 
+animated artists: the static part of the figure (axes, ticks, grid, 
+legend) is drawn once and cached, then each frame restores the 
+cached background and draws only the animated artists.
+The whole figure is redrawn only when the cache is no longer valid:
+limits, ticks or color scales changed, lines added or removed, new legend.
+"""
+class BlitManager(object):
+
+	def __init__(self, fig):
+		self.fig = fig
+		self.canvas = fig.canvas
+		self._background = None
+		self._state = None # state of the axes when the background was cached
+		self.full_draws = 0
+		self.canvas.mpl_connect("draw_event", self._on_draw)
+
+	"""
+	What is cached in the background: limits, ticks, color scales,
+	lines and legend of each axes
+	"""
+	def _axes_state(self):
+		return [(ax.get_xlim(), ax.get_ylim(), tuple(ax.get_yticks()), 
+			tuple(image.get_clim() for image in ax.images),
+			tuple(map(id, ax.lines)), id(ax.get_legend()))
+			for ax in self.fig.axes]
+
+	"""
+	Animated artists of an axes, in drawing order
+	"""
+	def _artists(self, ax):
+		return ax.images + ax.collections + ax.lines
+
+	def _animate_lines(self):
+		for ax in self.fig.axes:
+			for artist in self._artists(ax):
+				if not artist.get_animated():
+					artist.set_animated(True)
+
+	def _draw_lines(self):
+		for ax in self.fig.axes:
+			for artist in self._artists(ax):
+				ax.draw_artist(artist)
+
+	"""
+	Any draw of the whole figure (also a resize) refreshes the background
+	"""
+	def _on_draw(self, event):
+		self._background = self.canvas.copy_from_bbox(self.fig.bbox)
+		self._draw_lines()
+
+	"""
+	Force a full redraw at the next update
+	"""
+	def invalidate(self):
+		self._state = None
+
+	"""
+	Draw a frame: only the lines if the background is still valid
+	"""
+	def update(self):
+		state = self._axes_state()
+		if self._background is None or state != self._state:
+			self._animate_lines()
+			self.canvas.draw()
+			self._state = state
+			self.full_draws += 1
+		else:
+			self.canvas.restore_region(self._background)
+			self._draw_lines()
+		self.canvas.blit(self.fig.bbox)
+		self.canvas.flush_events()
+
+	"""
+	Save the figure: animated lines are not drawn by savefig
+	"""
+	def savefig(self, *args, **kwargs):
+		artists = [artist for ax in self.fig.axes for artist in self._artists(ax)]
+		for artist in artists:
+			artist.set_animated(False)
+		self.fig.savefig(*args, **kwargs)
+		for artist in artists:
+			artist.set_animated(True)
+		self.invalidate()
+
+
+"""
+Level of detail of a dense series: min/max decimation.
+The x axis is divided in buckets of one pixel, aligned to the
+absolute time; each bucket is reduced to its min and max samples
+(in time order), so about two points per pixel are drawn and
+the peaks are preserved.
+Buckets older than settle seconds from the last sample do not
+change any more: they are cached and only the new ones are computed.
+The drawing cost depends on the width of the axes, not on the samples.
+"""
+class Decimator(object):
+
+	def __init__(self, settle=0):
+		self.settle = settle
+		self._reset(None)
+
+	def _reset(self, width):
+		self._width = width # time width of a bucket
+		self._k = np.zeros(0, dtype=np.int64) # bucket of each cached pair of points
+		self._x = np.zeros(0)
+		self._y = np.zeros(0)
+		self._done = None # last cached (final) bucket
+
+	"""
+	Return the min and max points of the buckets of t, val
+	"""
+	def _buckets(self, t, val):
+		k = np.floor(t / self._width).astype(np.int64)
+		# by bucket, then by value: the first of a bucket is its min, the last its max
+		order = np.lexsort((val, k))
+		starts = np.r_[0, np.flatnonzero(np.diff(k)) + 1]
+		ends = np.r_[starts[1:], len(k)] - 1
+		i_min, i_max = order[starts], order[ends]
+		first, second = np.minimum(i_min, i_max), np.maximum(i_min, i_max)
+		x = np.column_stack((t[first], t[second])).ravel()
+		y = np.column_stack((val[first], val[second])).ravel()
+		return k[starts], x, y
+
+	"""
+	Return the (x, y) to draw for the samples t, val (sorted by t)
+	in the x window [x_left, x_right] of pixels width
+	"""
+	def reduce(self, t, val, x_left, x_right, pixels):
+		if len(t) <= 2 * pixels:
+			return t, val
+		width = (x_right - x_left) / float(max(1, pixels))
+		if width != self._width:
+			self._reset(width)
+
+		# cached buckets still in the window (one more on the left border)
+		k_left = int(math.floor(x_left / width)) - 1
+		keep = np.searchsorted(self._k, k_left)
+		if keep > 0:
+			self._k, self._x, self._y = self._k[keep:], self._x[2 * keep:], self._y[2 * keep:]
+
+		k_begin = k_left
+		if self._done is not None:
+			k_begin = max(k_left, self._done + 1)
+		begin = int(np.searchsorted(t, k_begin * width))
+		if begin >= len(t):
+			return self._x, self._y
+		k, x, y = self._buckets(t[begin:], val[begin:])
+
+		# buckets that will not change any more
+		k_final = int(math.floor((t[-1] - self.settle) / width)) - 1
+		final = int(np.searchsorted(k, k_final, side="right"))
+		if final > 0:
+			self._k = np.r_[self._k, k[:final]]
+			self._x = np.r_[self._x, x[:2 * final]]
+			self._y = np.r_[self._y, y[:2 * final]]
+			self._done = k[final - 1]
+		return np.r_[self._x, x[2 * final:]], np.r_[self._y, y[2 * final:]]
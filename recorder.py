@@ -0,0 +1,243 @@
+#!/usr/bin/python
+import sys, os, struct, mmap, threading, time
+import argparse
+import numpy as np
+
+"""
+Binary recorder of the parsed samples.
+The file is append-only and columnar:
+
+	header      : MAGIC
+	series      : "S" | id (u16) | name length (u16) | name
+	data block  : "D" | id (u16) | count (u32) | base t (f64)
+	              | count * t offsets from base [us] (u32)
+	              | count * values (f32)
+	index       : "I" | count (u32) | count * (id (u16), block offset (u64),
+	              samples (u32), first t (f64), last t (f64))
+	trailer     : index offset (u64) | INDEX_MAGIC
+
+The timestamps of a block are stored as its base (the first 
+in time) plus u32 offsets from it, not as deltas between 
+consecutive samples: the samples of a block may be out of order.
+Samples are buffered in memory and written in blocks by a
+background thread, off the parsing path.
+The index is written when the recorder is closed: a file without
+it (e.g. the program was killed) is read scanning the blocks.
+"""
+
+MAGIC = "PIPERFR1"
+INDEX_MAGIC = "PIPERFIX"
+
+SERIES_HEADER = struct.Struct("<cHH")
+BLOCK_HEADER = struct.Struct("<cHId")
+INDEX_HEADER = struct.Struct("<cI")
+INDEX_ENTRY = struct.Struct("<HQIdd")
+TRAILER = struct.Struct("<Q8s")
+
+FLUSH_INTERVAL = 1 # seconds between two writes
+
+# max time span of a block: offsets from the base are u32 microseconds
+MAX_BLOCK_SPAN = (2**32 - 1) / 10.0**6
+
+
+class Recorder(object):
+
+	def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+		self.path = path
+		self.flush_interval = flush_interval
+		self.ids = {} # series name --> id
+		self.index = [] # (id, offset, samples, first t, last t) of each block
+		self._buffers = {} # id --> ([t], [val]) waiting to be written
+		self._declared = [] # series not yet written in the file
+		self._lock = threading.Lock()
+		self._stop = threading.Event()
+		self._file = open(path, "wb")
+		self._file.write(MAGIC)
+		self._writer = threading.Thread(target=self._writer_thread)
+		self._writer.daemon = True
+		self._writer.start()
+
+	"""
+	Record a sample of the series name (cheap: the sample is only buffered)
+	"""
+	def record(self, name, t, val):
+		with self._lock:
+			buf = self._get_buffer(name)
+			buf[0].append(t)
+			buf[1].append(val)
+
+	"""
+	Record a batch of samples of the series name
+	"""
+	def record_batch(self, name, ts, vals):
+		with self._lock:
+			buf = self._get_buffer(name)
+			buf[0].extend(ts)
+			buf[1].extend(vals)
+
+	def _get_buffer(self, name):
+		if name not in self.ids:
+			self.ids[name] = len(self.ids)
+			self._declared.append(name)
+		sid = self.ids[name]
+		if sid not in self._buffers:
+			self._buffers[sid] = ([], [])
+		return self._buffers[sid]
+
+	def _writer_thread(self):
+		while not self._stop.wait(self.flush_interval):
+			self.flush()
+
+	"""
+	Write the buffered samples in the file
+	"""
+	def flush(self):
+		with self._lock:
+			declared, self._declared = self._declared, []
+			buffers, self._buffers = self._buffers, {}
+
+		for name in declared:
+			self._file.write(SERIES_HEADER.pack("S", self.ids[name], len(name)))
+			self._file.write(name)
+
+		for sid in sorted(buffers):
+			ts = np.array(buffers[sid][0], dtype=np.float64)
+			vals = np.array(buffers[sid][1], dtype=np.float32)
+			begin = 0
+			while begin < len(ts):
+				end = self._block_end(ts, begin)
+				self._write_block(sid, ts[begin:end], vals[begin:end])
+				begin = end
+		self._file.flush()
+
+	"""
+	Return the end of the block starting at begin:
+	all the offsets from the base must fit in a u32
+	"""
+	def _block_end(self, ts, begin):
+		lo = np.minimum.accumulate(ts[begin:])
+		hi = np.maximum.accumulate(ts[begin:])
+		too_wide = np.flatnonzero(hi - lo > MAX_BLOCK_SPAN)
+		if len(too_wide) == 0:
+			return len(ts)
+		return begin + too_wide[0]
+
+	def _write_block(self, sid, ts, vals):
+		base = ts.min()
+		offsets = np.round((ts - base) * 10**6).astype("<u4")
+		self.index.append((sid, self._file.tell(), len(ts), ts[0], ts[-1]))
+		self._file.write(BLOCK_HEADER.pack("D", sid, len(ts), base))
+		self._file.write(offsets.tostring())
+		self._file.write(vals.astype("<f4").tostring())
+
+	"""
+	Write the last samples and the index, then close the file
+	"""
+	def close(self):
+		self._stop.set()
+		self._writer.join()
+		self.flush()
+		index_offset = self._file.tell()
+		self._file.write(INDEX_HEADER.pack("I", len(self.index)))
+		for entry in self.index:
+			self._file.write(INDEX_ENTRY.pack(*entry))
+		self._file.write(TRAILER.pack(index_offset, INDEX_MAGIC))
+		self._file.close()
+
+
+"""
+Reader of a recorded file: the file is mapped in memory
+and the samples of a series are read only when requested
+"""
+class RecordReader(object):
+
+	def __init__(self, path):
+		self._f = open(path, "rb")
+		self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+		if self._mm[:len(MAGIC)] != MAGIC:
+			raise ValueError("{} is not a recorded file".format(path))
+		self.ids = {} # series name --> id
+		self.blocks = {} # id --> list of (offset, samples)
+		self._scan()
+
+	def _scan(self):
+		mm = self._mm
+		end = len(mm)
+		if end >= len(MAGIC) + TRAILER.size:
+			index_offset, magic = TRAILER.unpack_from(mm, end - TRAILER.size)
+			if magic == INDEX_MAGIC:
+				end = index_offset
+				self._read_index(index_offset)
+
+		# series declarations (and the blocks, if there is no index)
+		has_index = end != len(mm)
+		pos = len(MAGIC)
+		while pos < end:
+			kind = mm[pos]
+			if kind == "S":
+				if pos + SERIES_HEADER.size > end:
+					break # truncated file
+				_, sid, length = SERIES_HEADER.unpack_from(mm, pos)
+				if pos + SERIES_HEADER.size + length > end:
+					break
+				pos += SERIES_HEADER.size
+				self.ids[mm[pos:pos + length]] = sid
+				pos += length
+			elif kind == "D":
+				if pos + BLOCK_HEADER.size > end:
+					break # truncated file
+				_, sid, count, base = BLOCK_HEADER.unpack_from(mm, pos)
+				if pos + BLOCK_HEADER.size + 8 * count > end:
+					break
+				if not has_index:
+					self.blocks.setdefault(sid, []).append((pos, count))
+				pos += BLOCK_HEADER.size + 8 * count
+			else:
+				break
+
+	def _read_index(self, offset):
+		_, count = INDEX_HEADER.unpack_from(self._mm, offset)
+		offset += INDEX_HEADER.size
+		for i in range(count):
+			sid, pos, samples, first_t, last_t = INDEX_ENTRY.unpack_from(self._mm, offset)
+			self.blocks.setdefault(sid, []).append((pos, samples))
+			offset += INDEX_ENTRY.size
+
+	def names(self):
+		return sorted(self.ids)
+
+	"""
+	Return (t, val) arrays of the series name
+	"""
+	def series(self, name):
+		ts = []
+		vals = []
+		for pos, count in self.blocks.get(self.ids[name], []):
+			_, sid, count, base = BLOCK_HEADER.unpack_from(self._mm, pos)
+			pos += BLOCK_HEADER.size
+			offsets = np.frombuffer(self._mm, dtype="<u4", count=count, offset=pos)
+			ts.append(base + offsets / 10.0**6)
+			vals.append(np.frombuffer(self._mm, dtype="<f4", count=count, offset=pos + 4 * count))
+		if len(ts) == 0:
+			return np.zeros(0), np.zeros(0, dtype=np.float32)
+		return np.concatenate(ts), np.concatenate(vals)
+
+	def close(self):
+		self._mm.close()
+		self._f.close()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Show the content of a recorded file')
+	parser.add_argument('path', help='Recorded file')
+	args = parser.parse_args()
+
+	reader = RecordReader(args.path)
+	for name in reader.names():
+		t, val = reader.series(name)
+		if len(t) > 0:
+			print "{}: {} samples, t=[{:.3f}, {:.3f}], max={}".format(
+				name, len(t), t.min(), t.max(), val.max())
+		else:
+			print "{}: no samples".format(name)
+	reader.close()
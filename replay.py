@@ -0,0 +1,365 @@
+#!/usr/bin/python
+import sys, time, heapq, threading
+import argparse
+from mylib import *
+from plotlib import VIEWS, TOP_K
+
+"""
+This program replays captured logs through the same parsers
+used by plot_server and plot_client:
+	- iperf -yC reports (server, parsed in blocks)
+	- bwm-ng -o csv reports (server and client)
+	- /proc/net/tcpprobe records (client, parsed in blocks)
+	- ping -D reports (client)
+Lines of all the captures are merged by timestamp and replayed
+at full speed or scaled to real time, driving a virtual clock.
+Neither iperf nor root privileges are required.
+"""
+
+"""
+Virtual clock: the time of the last replayed line
+"""
+class ReplayClock(object):
+
+	def __init__(self, t=0.0):
+		self.t = t
+
+	def __call__(self):
+		return self.t
+
+# max lines of a block handed at once to a bulk parser
+REPLAY_BLOCK = 4096
+
+"""
+Handler of a capture parsed in blocks: collects the consecutive 
+lines of the capture and hands them to handler(block) at once,
+when REPLAY_BLOCK lines are collected or at flush().
+With same_instant, a block holds the lines of a single timestamp
+(parsers timing the records with clock(), e.g. iperf)
+"""
+class BlockHandler(object):
+
+	def __init__(self, handler, size=REPLAY_BLOCK, same_instant=False):
+		self.handler = handler
+		self.size = size
+		self.same_instant = same_instant
+		self.lines = []
+
+	def __call__(self, line):
+		self.lines.append(line)
+		if len(self.lines) >= self.size:
+			self.flush()
+
+	def flush(self):
+		if len(self.lines) > 0:
+			block = "".join(self.lines)
+			self.lines = []
+			self.handler(block)
+
+#------------------------- TIMESTAMPS ---------------------------
+# Unix timestamp of a captured line, None if the line has no timestamp
+
+"""
+20150803124132,10.100.13.214,5001,10.100.13.162,56695,4,0.0-1.0,1005453312,463275664
+"""
+def iperf_time(line):
+	try:
+		return time.mktime(time.strptime(line.split(",", 1)[0], "%Y%m%d%H%M%S"))
+	except ValueError:
+		return None
+
+"""
+1437515226;eth0;1620.00;123595.00;125215.00;24719;324;25.00;110.00;135.00;22;5;0.00;0.00;0;0
+"""
+def bwm_ng_time(line):
+	try:
+		return float(line.split(";", 1)[0])
+	except ValueError:
+		return None
+
+"""
+[1437417582.711328] 64 bytes from 10.100.13.214: icmp_seq=21 ttl=64 time=0.104 ms
+"""
+def ping_time(line):
+	if not line.startswith("["):
+		return None
+	try:
+		return float(line[1:line.index("]")])
+	except ValueError:
+		return None
+
+"""
+0.000605295 10.100.13.162:45758 10.100.13.214:5001 32 0xf76a3a5b 0xf7692adb 48 41 292992 1 29312
+tcp-probe times are relative to the insertion of the module
+"""
+def tcp_probe_time(line):
+	try:
+		return float(line.split(" ", 1)[0])
+	except ValueError:
+		return None
+
+#------------------------- REPLAY ---------------------------
+
+"""
+Return the first timestamp of a captured file (None if there is not)
+"""
+def first_time(path, get_time):
+	with open(path) as f:
+		for line in f:
+			t = get_time(line)
+			if t is not None:
+				return t
+	return None
+
+"""
+Yield (t, order, seq, line, handler) for each line of a captured file.
+Lines without a timestamp take the one of the previous line
+"""
+def read_capture(path, get_time, handler, order, offset=0.0):
+	last_t = None
+	with open(path) as f:
+		for seq, line in enumerate(f):
+			t = get_time(line)
+			if t is None:
+				t = last_t
+			else:
+				t += offset
+			if t is None:
+				continue
+			last_t = t
+			yield (t, order, seq, line, handler)
+
+"""
+Replay the merged events:
+	- speed: 0 for full speed, 1 for real time, 2 for double speed...
+	- seek: seconds to skip from the beginning (start)
+	- duration: seconds to replay (-1 until the end)
+Return the number of replayed lines and the elapsed time.
+A BlockHandler is flushed when a line of another capture
+(or of another instant) comes, or before waiting
+"""
+def replay(events, start, speed=0, seek=0, duration=-1, stop=None):
+	clock = ReplayClock(start)
+	set_clock(clock)
+	begin = start + seek
+	lines = 0
+	last_handler, last_t = None, None
+	wall0 = time.time()
+	for t, order, seq, line, handler in events:
+		if stop is not None and stop.is_set():
+			break
+		if t < begin:
+			continue
+		if duration > 0 and t > begin + duration:
+			break
+		if isinstance(last_handler, BlockHandler) and (handler is not last_handler 
+				or (last_handler.same_instant and t != last_t)):
+			last_handler.flush()
+		last_handler, last_t = handler, t
+		if speed > 0:
+			delay = (t - begin) / speed - (time.time() - wall0)
+			if delay > 0:
+				if isinstance(handler, BlockHandler):
+					handler.flush()
+				time.sleep(delay)
+		clock.t = t
+		handler(line)
+		lines += 1
+	if isinstance(last_handler, BlockHandler):
+		last_handler.flush()
+	return lines, time.time() - wall0
+
+"""
+Return the server data structure, the singles of each user and 
+the captures (path, timestamp function, handler) to replay
+"""
+def server_events(srv, tcp_files, udp_files, bwm_file):
+	data = srv.set_data()
+	singles = {}
+	captures = []
+	for path in tcp_files:
+		conns = srv.new_iperf_conns()
+		captures.append((path, iperf_time, BlockHandler(
+			lambda block, conns=conns: srv.handle_iperf_tcp_block(data, block, conns, singles),
+			same_instant=True)))
+	for path in udp_files:
+		conns = srv.new_iperf_conns()
+		captures.append((path, iperf_time, BlockHandler(
+			lambda block, conns=conns: srv.handle_iperf_udp_block(data, block, conns, singles),
+			same_instant=True)))
+	if bwm_file is not None:
+		captures.append((bwm_file, bwm_ng_time, lambda line: srv.handle_bwm_ng_line(data, line)))
+	return data, singles, captures
+
+"""
+Return the client data structure and the captures 
+(path, timestamp function, handler) to replay
+"""
+def client_events(cli, intf, server_ip, bwm_file, tcp_probe_file, ping_file):
+	data = cli.set_data(intf, server_ip, ping=ping_file is not None)
+	captures = []
+	if bwm_file is not None:
+		captures.append((bwm_file, bwm_ng_time,
+			lambda line: cli.handle_bwm_ng_line(data, line, intf)))
+	if ping_file is not None:
+		captures.append((ping_file, ping_time,
+			lambda line: cli.handle_ping_line(data, line, server_ip)))
+	if tcp_probe_file is not None:
+		cwnd_min = [0]
+		def handle(block):
+			cwnd_min[0] = cli.handle_tcp_probe_block(data, block, cwnd_min[0])
+		captures.append((tcp_probe_file, tcp_probe_time, BlockHandler(handle)))
+	return data, captures
+
+
+def print_summary(data, lines, elapsed):
+	rate = lines / elapsed if elapsed > 0 else float("inf")
+	print "\nReplayed {} lines in {:.3f}s ({:.0f} lines/s)".format(lines, elapsed, rate)
+	for key in sorted(data):
+		for sub in sorted(data[key]):
+			if isinstance(data[key][sub], TimeSeries):
+				print "{} {}: {} samples".format(key, sub, len(data[key][sub]))
+			elif sub == "samples":
+				for src in sorted(data[key][sub]):
+					print "{} {}: {} samples".format(key, src, len(data[key][sub][src]))
+
+
+def run_replay(args):
+	if args.side == "server":
+		import plot_server as module
+		data, singles, captures = server_events(module, args.tcp, args.udp, args.bwm)
+		module.smoothing = args.smooth_kind
+		module.group_by = args.group_by
+	else:
+		import plot_client as module
+		data, captures = client_events(module, args.intf, args.server_ip,
+			args.bwm, args.tcpprobe, args.ping)
+	module.view = args.view
+	module.top_k = args.top_k
+
+	if len(captures) == 0:
+		print "Nothing to replay"
+		return
+
+	"""
+	The replay starts at the first timestamp of the captures;
+	tcp-probe times are relative to it
+	"""
+	starts = [first_time(path, get_time) for path, get_time, handler in captures
+		if get_time != tcp_probe_time]
+	starts = [t for t in starts if t is not None]
+	start = min(starts) if len(starts) > 0 else time.time()
+
+	events = heapq.merge(*[
+		read_capture(path, get_time, handler, order,
+			offset=start if get_time == tcp_probe_time else 0.0)
+		for order, (path, get_time, handler) in enumerate(captures)])
+
+	module.t0 = start
+	module.stop.clear()
+	module.pause.clear()
+	module.screenshot.clear()
+	if args.side == "server" and args.binned:
+		module.grid = TimeGrid(module.IPERF_REPORT_INTERVAL, module.HISTORY_WINDOW,
+			["tcp", "udp"], phase=start % module.IPERF_REPORT_INTERVAL)
+	if args.record_file is not None:
+		module.recorder = module.Recorder(args.record_file)
+	module.publisher = None
+	if args.plot:
+		if args.side == "server":
+			module.publisher = module.new_publisher(data, singles)
+		else:
+			module.publisher = module.new_publisher(data)
+
+	result = {}
+	def replay_thread():
+		result["lines"], result["elapsed"] = replay(events, start,
+			args.speed, args.seek, args.duration, module.stop)
+		print_summary(data, result["lines"], result["elapsed"])
+
+	if args.plot:
+		thread = threading.Thread(target=replay_thread)
+		thread.daemon = True
+		thread.start()
+		try:
+			module.execute_matplotlib(module.publisher, args.window_size, args.blit)
+		except (KeyboardInterrupt):
+			module.stop.set()
+	else:
+		replay_thread()
+
+	if module.recorder is not None:
+		module.recorder.close()
+		print "Samples recorded in {}".format(args.record_file)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Replay captured logs through the plot parsers')
+
+	parser.add_argument('side', choices=['server', 'client'],
+		help='Parsers to use: plot_server or plot_client')
+
+	parser.add_argument('-t', dest='tcp', nargs='+', default=[],
+		help='Captured iperf TCP reports (server)')
+
+	parser.add_argument('-u', dest='udp', nargs='+', default=[],
+		help='Captured iperf UDP reports (server)')
+
+	parser.add_argument('-b', dest='bwm', nargs='?', default=None,
+		help='Captured bwm-ng reports')
+
+	parser.add_argument('-p', dest='tcpprobe', nargs='?', default=None,
+		help='Captured /proc/net/tcpprobe records (client)')
+
+	parser.add_argument('-r', dest='ping', nargs='?', default=None,
+		help='Captured ping -D reports (client)')
+
+	parser.add_argument('-i', dest='intf', nargs='?', default='eth0',
+		help='Interface name of the bwm-ng reports (client)')
+
+	parser.add_argument('-c', dest='server_ip', nargs='?', default='server',
+		help='Server IP address of the ping reports (client)')
+
+	parser.add_argument('-s', dest='speed', nargs='?', default=0, type=float,
+		help='Replay speed: 0 full speed (default), 1 real time, 2 double speed...')
+
+	parser.add_argument('--seek', dest='seek', nargs='?', default=0, type=float,
+		help='Seconds to skip from the beginning of the captures')
+
+	parser.add_argument('-d', dest='duration', nargs='?', default=-1, type=float,
+		help='Seconds to replay. Default until the end')
+
+	parser.add_argument('--plot', dest='plot', action='store_true',
+		help='Show the plot while replaying')
+	parser.set_defaults(plot=False)
+
+	parser.add_argument('--blit', dest='blit', action='store_true',
+		help='Redraw only the lines at each frame (with --plot)')
+	parser.set_defaults(blit=False)
+
+	parser.add_argument('--binned', dest='binned', action='store_true',
+		help='Aggregate rates in aligned bins of the iperf report interval (server)')
+	parser.set_defaults(binned=False)
+
+	parser.add_argument('--smooth', dest='smooth_kind', choices=StreamingSmoother.KINDS, default='hann',
+		help='Filter of the per-user smoothed rates (server)')
+
+	parser.add_argument('--group-by', dest='group_by', choices=["host", "connection"], default='host',
+		help='Users of the server plot: client hosts or connections')
+
+	parser.add_argument('--view', dest='view', choices=VIEWS, default='lines',
+		help='View of the flows (with --plot): a line each, or the top ones as lines '
+			'and the others in a single collection or in a heatmap')
+
+	parser.add_argument('--top', dest='top_k', nargs='?', default=TOP_K, type=int,
+		help='Flows drawn as lines in the collection and heatmap views')
+
+	parser.add_argument('--record', dest='record_file', nargs='?', default=None,
+		help='Record the parsed samples in a binary file')
+
+	parser.add_argument('-w', dest='window_size', nargs=2, default=[11,8], type=int,
+		help='Width and height of the window [inch]')
+
+	args = parser.parse_args()
+
+	run_replay(args)
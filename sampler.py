@@ -0,0 +1,262 @@
+#!/usr/bin/python
+import sys, time, threading, traceback, socket, struct
+import argparse
+import numpy as np
+from mylib import clock, monotonic
+
+"""
+In-process samplers of the counters of the kernel,
+in place of measurement tools run as subprocesses:
+	- NetDevSampler: rates of the interfaces from /proc/net/dev (instead of bwm-ng)
+	- TcpInfoSampler: tcp_info of the flows of a port from NETLINK_SOCK_DIAG
+	  (instead of the tcp_probe module)
+"""
+
+NET_DEV = "/proc/net/dev"
+
+# default seconds between two samples
+SAMPLE_PERIOD = 0.2
+
+# columns of an interface in /proc/net/dev
+RX_BYTES = 0
+TX_BYTES = 8
+
+"""
+Sampler run every period seconds, until stop is set.
+Subclasses implement start() (before the first period) and
+sample(t, now): t is the monotonic time now mapped to clock()
+at the start, so a change of the system time does not distort
+the intervals
+"""
+class PeriodicSampler(object):
+
+	def __init__(self, stop, period=SAMPLE_PERIOD):
+		self.stop = stop
+		self.period = period
+		self.samples = 0
+
+	def start(self, now):
+		pass
+
+	def sample(self, t, now):
+		pass
+
+	def run(self):
+		mono0, clock0 = monotonic(), clock()
+		self.start(mono0)
+
+		deadline = mono0
+		while not self.stop.is_set():
+			# sample on a fixed schedule: a late sample does not delay the next ones
+			deadline += self.period
+			delay = deadline - monotonic()
+			if delay > 0:
+				time.sleep(delay)
+			else:
+				deadline = monotonic()
+			if self.stop.is_set():
+				break
+
+			now = monotonic()
+			self.samples += 1
+			try:
+				self.sample(clock0 + now - mono0, now)
+			except Exception:
+				traceback.print_exc()
+
+"""
+Rates of network interfaces, sampled every period seconds.
+A single read of /proc/net/dev covers all the interfaces: the byte
+counters of two samples are differenced as arrays.
+At each sample handler(t, rx, tx) receives the end of the interval
+and the arrays of the rx and tx rates [bit/s] of the interfaces
+(in their order; nan for a missing interface or a counter reset)
+"""
+class NetDevSampler(PeriodicSampler):
+
+	def __init__(self, interfaces, handler, stop, period=SAMPLE_PERIOD, path=NET_DEV):
+		PeriodicSampler.__init__(self, stop, period)
+		self.interfaces = list(interfaces)
+		self.handler = handler
+		self.path = path
+		self._pos = dict((intf, i) for i, intf in enumerate(self.interfaces))
+
+	"""
+	Return the byte counters of the interfaces:
+	array of 2 rows (rx, tx) and a column per interface
+	"""
+	def read(self):
+		counters = np.full((2, len(self.interfaces)), np.nan)
+		with open(self.path) as f:
+			lines = f.readlines()[2:] # 2 header lines
+		for line in lines:
+			name, sep, cols = line.partition(":")
+			i = self._pos.get(name.strip())
+			if i is not None:
+				cols = cols.split()
+				counters[0, i] = float(cols[RX_BYTES])
+				counters[1, i] = float(cols[TX_BYTES])
+		return counters
+
+	def start(self, now):
+		self._last, self._last_t = self.read(), now
+		missing = [intf for intf, rx in zip(self.interfaces, self._last[0]) if np.isnan(rx)]
+		if len(missing) > 0:
+			print "Interfaces not found in {}: {}".format(self.path, ", ".join(missing))
+
+	def sample(self, t, now):
+		counters = self.read()
+		rates = (counters - self._last) * 8 / (now - self._last_t)
+		with np.errstate(invalid="ignore"):
+			rates[rates < 0] = np.nan # counter reset
+		self._last, self._last_t = counters, now
+		self.handler(t, rates[0], rates[1])
+
+#------------------------- SOCK_DIAG ---------------------------
+
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+INET_DIAG_INFO = 2
+TCP_ESTABLISHED = 1
+TCP_INFINITE_SSTHRESH = 0x7fffffff
+
+NLMSG_HEADER = struct.Struct("=IHHII")		# len, type, flags, seq, pid
+INET_DIAG_REQ = struct.Struct("=BBBBI")		# family, protocol, ext, pad, states (+ sockid)
+INET_DIAG_SOCKID_LEN = 48
+INET_DIAG_MSG = struct.Struct("=BBBB2s2s16s16s")	# family, state, timer, retrans, sport, dport, src, dst
+INET_DIAG_MSG_LEN = 72
+RTATTR = struct.Struct("=HH")				# len, type
+
+"""
+Fields of struct tcp_info (linux/tcp.h): name --> (offset, format).
+delivery_rate is in recent kernels only (nan in the older ones)
+"""
+TCP_INFO_FIELDS = {
+	"retransmits"	: (2, "B"),
+	"srtt"			: (68, "I"),		# [us]
+	"ssthresh"		: (76, "I"),		# [segments]
+	"cwnd"			: (80, "I"),		# [segments]
+	"total_retrans"	: (100, "I"),
+	"delivery_rate"	: (160, "Q")		# [byte/s]
+}
+
+def align4(n):
+	return (n + 3) & ~3
+
+"""
+tcp_info of the established TCP sockets connected to port (the
+senders to an iperf server), sampled every period seconds by a dump
+of NETLINK_SOCK_DIAG (a request per address family for all the flows).
+At each sample handler(t, srcs, columns) receives the local
+addresses "ip:port" of the flows and the arrays of the fields of
+TCP_INFO_FIELDS ("flow" is the index in srcs; nan ssthresh while
+in slow start).
+Neither the tcp_probe module nor root privileges are required
+"""
+class TcpInfoSampler(PeriodicSampler):
+
+	def __init__(self, port, handler, stop, period=SAMPLE_PERIOD, families=(socket.AF_INET, socket.AF_INET6)):
+		PeriodicSampler.__init__(self, stop, period)
+		self.port = port
+		self.handler = handler
+		self.families = families
+		self._seq = 0
+		self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_SOCK_DIAG)
+
+	def _request(self, family):
+		self._seq += 1
+		req = INET_DIAG_REQ.pack(family, socket.IPPROTO_TCP, 1 << (INET_DIAG_INFO - 1), 0,
+			1 << TCP_ESTABLISHED) + "\0" * INET_DIAG_SOCKID_LEN
+		self._sock.send(NLMSG_HEADER.pack(NLMSG_HEADER.size + len(req), SOCK_DIAG_BY_FAMILY,
+			NLM_F_REQUEST | NLM_F_DUMP, self._seq, 0) + req)
+
+	"""
+	Yield (family, sport, dport, src, tcp_info) of the sockets of a dump
+	"""
+	def _replies(self):
+		while True:
+			buf = self._sock.recv(2**16)
+			pos = 0
+			while pos + NLMSG_HEADER.size <= len(buf):
+				length, kind = NLMSG_HEADER.unpack_from(buf, pos)[:2]
+				if kind == NLMSG_DONE:
+					return
+				if kind == NLMSG_ERROR:
+					errno = -struct.unpack_from("=i", buf, pos + NLMSG_HEADER.size)[0]
+					raise socket.error(errno, "sock_diag dump failed")
+				msg = pos + NLMSG_HEADER.size
+				family, state, timer, retrans, sport, dport, src, dst = INET_DIAG_MSG.unpack_from(buf, msg)
+				info = None
+				attr = msg + INET_DIAG_MSG_LEN
+				while attr + RTATTR.size <= pos + length:
+					attr_len, attr_type = RTATTR.unpack_from(buf, attr)
+					if attr_len < RTATTR.size:
+						break
+					if attr_type == INET_DIAG_INFO:
+						info = buf[attr + RTATTR.size:attr + attr_len]
+					attr += align4(attr_len)
+				yield family, struct.unpack("!H", sport)[0], struct.unpack("!H", dport)[0], src, info
+				pos += align4(length)
+
+	"""
+	Return (srcs, columns) of the flows of the port (see the class)
+	"""
+	def dump(self):
+		srcs, rows = [], []
+		for family in self.families:
+			self._request(family)
+			for sock_family, sport, dport, src, info in self._replies():
+				if info is None or dport != self.port:
+					continue
+				addr = socket.inet_ntop(sock_family, src[:4] if sock_family == socket.AF_INET else src)
+				srcs.append("{}:{}".format(addr, sport))
+				rows.append([struct.unpack_from("=" + fmt, info, offset)[0]
+					if offset + struct.calcsize(fmt) <= len(info) else np.nan
+					for offset, fmt in TCP_INFO_FIELDS.values()])
+		table = np.array(rows, dtype=float).reshape(len(rows), len(TCP_INFO_FIELDS))
+		columns = dict((name, table[:, i]) for i, name in enumerate(TCP_INFO_FIELDS))
+		columns["ssthresh"][columns["ssthresh"] >= TCP_INFINITE_SSTHRESH] = np.nan
+		columns["flow"] = np.arange(len(srcs))
+		return srcs, columns
+
+	def sample(self, t, now):
+		srcs, columns = self.dump()
+		self.handler(t, srcs, columns)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Print the rates of network interfaces or the tcp_info of the flows of a port')
+
+	parser.add_argument('interfaces', nargs='*',
+		help='Interface names')
+
+	parser.add_argument('-t', dest='port', nargs='?', default=None, type=int,
+		help='Print the tcp_info of the flows to this port')
+
+	parser.add_argument('-p', dest='period', nargs='?', default=SAMPLE_PERIOD, type=float,
+		help='Seconds between two samples')
+
+	args = parser.parse_args()
+
+	def print_rates(t, rx, tx):
+		print "{:.3f} ".format(t) + "  ".join("{} rx {:.0f} tx {:.0f} bit/s".format(intf, r, s)
+			for intf, r, s in zip(args.interfaces, rx, tx))
+
+	def print_flows(t, srcs, columns):
+		for i, src in enumerate(srcs):
+			print "{:.3f} {} ".format(t, src) + " ".join("{} {:.0f}".format(name, columns[name][i])
+				for name in sorted(TCP_INFO_FIELDS))
+
+	stop = threading.Event()
+	if args.port is not None:
+		sampler = TcpInfoSampler(args.port, print_flows, stop, args.period)
+	else:
+		sampler = NetDevSampler(args.interfaces, print_rates, stop, args.period)
+	try:
+		sampler.run()
+	except (KeyboardInterrupt):
+		stop.set()
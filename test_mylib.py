@@ -0,0 +1,267 @@
+#!/usr/bin/python
+import unittest, multiprocessing
+import numpy as np
+from mylib import TimeGrid, SharedTimeGrid, merge_grids, thin_min_max, FlowRegistry, LivenessTracker
+from mylib import TimeSeries
+
+"""
+Tests of the data structures of mylib.
+Run with: python -m unittest test_mylib
+"""
+
+class TimeGridTest(unittest.TestCase):
+
+	"""
+	A new key beyond the capacity grows the grid:
+	its value and the ones of the old keys are kept
+	"""
+	def test_add_grows_past_capacity(self):
+		grid = TimeGrid(1, 60, ["tcp", "udp"], capacity=64)
+		for i in range(70):
+			grid.add("10.0.0.{}".format(i), "tcp", 10, i + 1)
+		self.assertEqual(len(grid.keys), 70)
+		for i in range(70):
+			self.assertEqual(grid.view("10.0.0.{}".format(i), "tcp")[-1], i + 1)
+		self.assertEqual(grid.total()[-1], sum(range(1, 71)))
+
+	def test_merge_grows_past_capacity(self):
+		grid = TimeGrid(1, 60, ["tcp", "udp"], capacity=4)
+		other = grid.empty_like(capacity=8)
+		for i in range(6):
+			other.add(i, "udp", 10, 2)
+		grid.merge(other)
+		self.assertEqual(len(grid.keys), 6)
+		self.assertTrue(np.all(grid.total()[-1:] == 12))
+
+
+"""
+Writer of test_read_while_writing: each batch adds 1 to both
+rows of a key, in separate adds
+"""
+def write_batches(shard, n_batches):
+	for i in range(n_batches):
+		shard.begin_write()
+		key = "10.0.0.{}".format(i % 8)
+		shard.add(key, "tcp", 10, 1)
+		shard.add(key, "udp", 10, 1)
+		shard.end_write()
+
+class SharedTimeGridTest(unittest.TestCase):
+
+	def test_read(self):
+		shard = SharedTimeGrid(1, 60, ["tcp", "udp"])
+		shard.begin_write()
+		shard.add("10.0.0.1", "tcp", 10, 3)
+		shard.add("10.0.0.2", "udp", 11, 4)
+		shard.end_write()
+		grid = shard.read()
+		self.assertEqual(sorted(grid.keys), ["10.0.0.1", "10.0.0.2"])
+		self.assertEqual(list(grid.view("10.0.0.1", "tcp")[-2:]), [3, 0])
+		self.assertEqual(list(grid.view("10.0.0.2", "udp")[-2:]), [0, 4])
+		self.assertEqual(shard.records(), 2)
+
+	"""
+	Changes in progress are not visible: after the timeout
+	read() returns the last consistent copy
+	"""
+	def test_read_during_write(self):
+		shard = SharedTimeGrid(1, 60, ["tcp", "udp"])
+		shard.begin_write()
+		shard.add("10.0.0.1", "tcp", 10, 3)
+		shard.end_write()
+		last = shard.read()
+		shard.begin_write()
+		shard.add("10.0.0.2", "tcp", 10, 5)
+		self.assertIs(shard.read(timeout=0.01), last)
+		shard.end_write()
+		self.assertEqual(sorted(shard.read().keys), ["10.0.0.1", "10.0.0.2"])
+
+	"""
+	A reader in another process never sees half a batch
+	"""
+	def test_read_while_writing(self):
+		shard = SharedTimeGrid(1, 60, ["tcp", "udp"])
+		n_batches = 20000
+		writer = multiprocessing.Process(target=write_batches, args=(shard, n_batches))
+		writer.start()
+		reads = 0
+		while writer.is_alive() or reads == 0:
+			grid = shard.read()
+			reads += 1
+			for key in grid.keys:
+				self.assertEqual(grid.view(key, "tcp").sum(), grid.view(key, "udp").sum())
+		writer.join()
+		self.assertEqual(shard.read().total().sum(), 2 * n_batches)
+
+	def test_dropped_beyond_capacity(self):
+		shard = SharedTimeGrid(1, 60, ["tcp", "udp"], capacity=2)
+		shard.begin_write()
+		for i in range(3):
+			shard.add("10.0.0.{}".format(i), "tcp", 10, 1)
+		shard.end_write()
+		self.assertEqual(len(shard.read().keys), 2)
+		self.assertEqual(shard.dropped(), 1)
+
+class MergeGridsTest(unittest.TestCase):
+
+	"""
+	The grids of two shards are summed by key, 
+	on the bins of the newest one
+	"""
+	def test_merge_shards(self):
+		shards = [SharedTimeGrid(1, 10, ["tcp", "udp"]) for i in range(2)]
+		for shard, keys, t in zip(shards, [["a", "b"], ["b", "c"]], [20, 21]):
+			shard.begin_write()
+			for key in keys:
+				shard.add(key, "tcp", t, 1)
+				shard.add(key, "udp", t, 2)
+			shard.end_write()
+		merged = merge_grids([shard.read() for shard in shards])
+		self.assertEqual(sorted(merged.keys), ["a", "b", "c"])
+		self.assertEqual(merged.times()[-1], 21)
+		self.assertEqual(list(merged.key_total("a")[-2:]), [3, 0])
+		self.assertEqual(list(merged.key_total("b")[-2:]), [3, 3])
+		self.assertEqual(list(merged.key_total("c")[-2:]), [0, 3])
+		self.assertEqual(list(merged.total()[-2:]), [6, 6])
+
+	"""
+	Bins out of the window of the newest shard are dropped
+	"""
+	def test_merge_old_bins(self):
+		old, new = TimeGrid(1, 10, ["tcp", "udp"]), TimeGrid(1, 10, ["tcp", "udp"])
+		old.add("a", "tcp", 5, 1)
+		old.add("a", "tcp", 18, 1)
+		new.add("b", "tcp", 25, 1)
+		merged = merge_grids([old, new])
+		self.assertEqual(merged.times()[-1], 25)
+		self.assertEqual(merged.key_total("a").sum(), 1)
+		self.assertEqual(merged.total().sum(), 2)
+
+class TimeSeriesExtremesTest(unittest.TestCase):
+
+	def check_extremes(self, series):
+		for t_left in series.t[::7]:
+			mine = series.t >= t_left
+			self.assertEqual(series.max_since(t_left), series.val[mine].max())
+			self.assertEqual(series.min_since(t_left), series.val[mine].min())
+
+	"""
+	Late inserts and values raised (late reports, solved singles)
+	keep the max up to date without a rebuild
+	"""
+	def test_insert_and_raise(self):
+		rng = np.random.RandomState(1)
+		series = TimeSeries(100, 64, extremes=True)
+		for t in range(300):
+			series.insort(t + 0.5 * rng.rand(), rng.rand())
+			late = t - 3 * rng.rand()
+			if series.index(late) < 0:
+				series.insort(late, rng.rand())
+			pos = rng.randint(len(series), size=3)
+			series.set_val(pos, series.val[pos] + rng.rand(3).astype(np.float32))
+			self.assertFalse(series._max.stale)
+			self.check_extremes(series)
+
+	def test_lower_and_delete(self):
+		series = TimeSeries(100, 64, extremes=True)
+		series.extend(np.arange(10.0), np.arange(10.0) % 4)
+		series.set_val(3, 0)
+		self.assertTrue(series._max.stale)
+		self.check_extremes(series)
+		series.delete(2, 5)
+		self.assertTrue(series._min.stale)
+		self.check_extremes(series)
+		frozen = series.freeze()
+		series.append(20, 9)
+		self.check_extremes(frozen)
+		self.check_extremes(series)
+
+class ThinMinMaxTest(unittest.TestCase):
+
+	"""
+	Each bucket keeps its min and max, in time order
+	"""
+	def test_thin(self):
+		t = np.arange(0, 1, 0.01)
+		val = np.sin(t * 37)
+		thin_t, thin_val = thin_min_max(t, val, 0.1)
+		self.assertTrue(np.all(np.diff(thin_t) > 0))
+		self.assertLessEqual(len(thin_t), 2 * 10)
+		buckets = np.floor(t / 0.1)
+		for b in range(10):
+			mine = np.floor(thin_t / 0.1) == b
+			self.assertEqual(thin_val[mine].max(), val[buckets == b].max())
+			self.assertEqual(thin_val[mine].min(), val[buckets == b].min())
+
+	def test_sparse(self):
+		t, val = np.array([0.0, 0.05, 0.5]), np.array([1.0, 2.0, 3.0])
+		thin_t, thin_val = thin_min_max(t, val, 0.1)
+		self.assertIs(thin_t, t)
+		thin_t, thin_val = thin_min_max(t[:0], val[:0], 0.1)
+		self.assertEqual(len(thin_t), 0)
+
+class FlowRegistryTest(unittest.TestCase):
+
+	def test_ids(self):
+		conns = FlowRegistry(lambda key: key[0], capacity=2)
+		ids = conns.ids([("a", 1), ("b", 2), ("a", 1), ("c", 3)])
+		self.assertEqual(list(ids), [0, 1, 0, 2])
+		self.assertEqual(list(conns["label"]), ["a", "b", "c"])
+
+	"""
+	With connections coming and going the dead ones are released
+	and their ids reused: the arrays do not grow
+	"""
+	def test_churn(self):
+		conns = FlowRegistry(timeout=10, capacity=4)
+		conns.add_array("tzero", float, np.nan)
+		for t in range(1000):
+			ids = conns.ids([("conn", t // 5)])
+			conns["tzero"][ids] = t
+			conns.seen(ids, np.array([float(t)]))
+			conns.expire(t)
+		self.assertEqual(len(conns), 3)
+		self.assertEqual(len(conns["tzero"]), 4)
+		self.assertEqual(len(conns.liveness.last), 3)
+
+	def test_release(self):
+		conns = FlowRegistry(timeout=10)
+		conns.add_array("tzero", float, np.nan)
+		ids = conns.ids(["a", "b"])
+		conns["tzero"][ids] = 1
+		conns.seen(ids, np.array([0.0, 5.0]))
+		self.assertEqual(conns.expire(12), ["a"])
+		self.assertEqual(len(conns), 1)
+		self.assertEqual(list(conns.ids(["c"])), [0])
+		self.assertTrue(np.isnan(conns["tzero"][0]))
+		self.assertEqual(list(conns.ids(["b"])), [1])
+		self.assertEqual(conns.expire(20), ["b"])
+
+class LivenessTrackerTest(unittest.TestCase):
+
+	def test_revived(self):
+		flows = LivenessTracker(2, resolution=0.5)
+		self.assertIsNone(flows.seen("a", 1))
+		self.assertEqual(flows.advance(2), [])
+		self.assertEqual(flows.advance(3), [("a", 1)])
+		self.assertFalse(flows.is_alive("a"))
+		self.assertEqual(flows.seen("a", 5), 1)
+		self.assertIsNone(flows.seen("a", 6))
+		self.assertTrue(flows.is_alive("a"))
+
+	"""
+	A key dead for forget_after seconds is dropped:
+	seen again, it is a new key
+	"""
+	def test_forget_after(self):
+		flows = LivenessTracker(2, resolution=0.5, forget_after=10)
+		for i in range(100):
+			flows.seen(i, i)
+			flows.advance(i)
+		self.assertLessEqual(len(flows.last), 14)
+		self.assertEqual(len(flows), 2)
+		self.assertIsNone(flows.seen(0, 100))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+import unittest
+import numpy as np
+import plot_client as cli
+
+"""
+Tests of the series of the client.
+Run with: python -m unittest test_plot_client
+"""
+
+class FlowSamplesTest(unittest.TestCase):
+
+	"""
+	At 10k ACKs per second the series of a flow still
+	covers the whole history window
+	"""
+	def test_dense_flow_keeps_window(self):
+		data = cli.set_data("eth0", "server")
+		rate, block = 10000, 0.1
+		end = cli.HISTORY_WINDOW + 10
+		for begin in np.arange(0, end, block):
+			t = begin + np.arange(int(rate * block)) / float(rate)
+			cli.apply_flow_samples(data, "rtt", "10.0.0.1:45000", t, 10 + np.sin(t * 50))
+		series = data["rtt"]["samples"]["10.0.0.1:45000"]
+		self.assertLess(series.t[0], end - cli.HISTORY_WINDOW + 0.01)
+		self.assertLessEqual(len(series), cli.PROBE_CAPACITY)
+		self.assertAlmostEqual(series.val.max(), 11, places=3)
+		self.assertAlmostEqual(series.val.min(), 9, places=3)
+
+class TcpProbeParseTest(unittest.TestCase):
+
+	"""
+	A line with a non-numeric value is skipped,
+	the other lines of the block are kept
+	"""
+	def test_malformed_line(self):
+		block = ("0.000605 10.0.0.1:45758 10.0.0.9:5001 32 0xf76a3a5b 0xf7692adb 48 41 292992 1 29312\n"
+			"0.000700 10.0.0.2:45760 10.0.0.9:5001 32 0xf76a3a5b 0xf7692adb xx 41 292992 1 29312\n"
+			"0.000800 10.0.0.3:45762 10.0.0.9:5001 32 0xf76a3a5b 0xf7692adb 50 41 292992 2 29312\n")
+		srcs, columns = cli.parse_tcp_probe_block(block)
+		self.assertEqual(srcs, ["10.0.0.1:45758", "10.0.0.3:45762"])
+		self.assertEqual(list(columns["flow"]), [0, 1])
+		for name, col in cli.TCP_PROBE_COLUMNS.items():
+			self.assertEqual(len(columns[name]), 2)
+
+class CwndRevivalTest(unittest.TestCase):
+
+	"""
+	A flow is declared dead with a zero (cwnd_min) after its last
+	sample, and restarts from a zero when it is back
+	"""
+	def test_revival(self):
+		data = cli.set_data("eth0", "server")
+		src = "10.0.0.1:45000"
+		cli.apply_cwnd_samples(data, src, np.array([1.0, 2.0]), np.array([10.0, 20.0]), 1)
+		cli.apply_cwnd_samples(data, src, np.array([10.0, 11.0]), np.array([30.0, 40.0]), 1)
+		series = data["cwnd"]["samples"][src]
+		self.assertEqual(list(series.t), [1, 2, 3, 9, 10, 11])
+		self.assertEqual(list(series.val), [10, 20, 1, 1, 30, 40])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+import unittest, time, argparse, multiprocessing
+import plot_server as srv
+from mylib import SharedTimeGrid, set_command_source
+from loadgen import FakeSource
+
+"""
+Tests of the sharded server, on the fake iperf servers of loadgen.
+Run with: python -m unittest test_plot_server
+"""
+
+N_CLIENTS = 4
+
+class RevivalTest(unittest.TestCase):
+
+	def setUp(self):
+		self.grid, self.recorder = srv.grid, srv.recorder
+		srv.grid = srv.recorder = None
+
+	def tearDown(self):
+		srv.grid, srv.recorder = self.grid, self.recorder
+
+	"""
+	A series is declared dead with a 0 after its last report,
+	and restarts from a 0 when it is back
+	"""
+	def test_revival(self):
+		data, singles = srv.set_data(), {}
+		srv.apply_records(data, singles, [("tcp", "10.0.0.1", t, 100.0) for t in (1, 2)])
+		srv.expire_flows(data, 10)
+		srv.apply_records(data, singles, [("tcp", "10.0.0.1", t, 100.0) for t in (12, 13)])
+		for name in ("tcp", "total"):
+			series = data["10.0.0.1"][name]
+			self.assertEqual(list(series.t), [1, 2, 3, 11, 12, 13])
+			self.assertEqual(list(series.val), [100, 100, 0, 0, 100, 100])
+
+
+class ShardTest(unittest.TestCase):
+
+	def setUp(self):
+		args = argparse.Namespace(flows=2, rate=10**6, server_ip="10.0.0.100", churn=0, 
+			disorder=0, nan=0, acks=100, rtt=0.5, seed=1, ports=2, tcp_port=5001)
+		set_command_source(FakeSource(args, N_CLIENTS))
+		srv.t0 = time.time()
+		self.group_by = srv.group_by
+
+	def tearDown(self):
+		set_command_source(None)
+		srv.group_by = self.group_by
+
+	"""
+	Run a shard with a TCP and a UDP port until its grid has
+	the reports of some seconds, return the grid
+	"""
+	def run_shard(self, records=4 * N_CLIENTS * 2):
+		shard = SharedTimeGrid(srv.IPERF_REPORT_INTERVAL, srv.HISTORY_WINDOW, ["tcp", "udp"],
+			phase=srv.t0 % srv.IPERF_REPORT_INTERVAL)
+		shard_stop = multiprocessing.Event()
+		worker = multiprocessing.Process(target=srv.run_shard, args=(shard, [5001], [5101], shard_stop))
+		worker.start()
+		deadline = time.time() + 20
+		while shard.records() < records and time.time() < deadline:
+			time.sleep(0.1)
+		shard_stop.set()
+		worker.join(10)
+		self.assertFalse(worker.is_alive())
+		return shard.read()
+
+	def test_shard(self):
+		grid = self.run_shard()
+		self.assertEqual(sorted(grid.keys), sorted("10.0.0.{}".format(i + 1) for i in range(N_CLIENTS)))
+		for key in grid.keys:
+			self.assertGreater(grid.view(key, "tcp").sum(), 0)
+			self.assertGreater(grid.view(key, "udp").sum(), 0)
+
+	"""
+	The worker labels the flows with the options of the server
+	"""
+	def test_shard_group_by_connection(self):
+		srv.group_by = "connection"
+		grid = self.run_shard()
+		self.assertGreater(len(grid.keys), N_CLIENTS)
+		self.assertTrue(all(":" in key for key in grid.keys))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+import os, shutil, tempfile, unittest
+import numpy as np
+from recorder import Recorder, RecordReader, MAGIC, TRAILER
+
+"""
+Tests of the binary recorder.
+Run with: python -m unittest test_recorder
+"""
+
+class RecordReaderTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, "samples.rec")
+		recorder = Recorder(self.path)
+		recorder.record_batch("cwnd/10.0.0.1:45000", np.arange(10.0), np.arange(10.0))
+		recorder.record_batch("rtt/10.0.0.1:45000", np.arange(10.0), np.ones(10))
+		recorder.close()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	"""
+	Record several series, in batches and one sample at a time,
+	across flushes and blocks wider than MAX_BLOCK_SPAN
+	"""
+	def record_series(self, path):
+		rng = np.random.RandomState(1)
+		expected = {
+			"tcp/10.0.0.1" : (1.5e9 + np.arange(100.0), rng.rand(100) * 1e6),
+			"udp/10.0.0.2" : (1.5e9 + np.sort(rng.rand(50)) * 1e4, rng.rand(50)),
+			"SUM"          : (np.array([3.25, 1.0, 2.5]), np.array([7.0, 8.0, 9.0])),
+		}
+		recorder = Recorder(path)
+		for name in ["tcp/10.0.0.1", "udp/10.0.0.2"]:
+			t, val = expected[name]
+			recorder.record_batch(name, t[:30], val[:30])
+			recorder.flush()
+			recorder.record_batch(name, t[30:], val[30:])
+		for t, val in zip(*expected["SUM"]):
+			recorder.record("SUM", t, val)
+		recorder.close()
+		return expected
+
+	def check_series(self, reader, expected):
+		self.assertEqual(reader.names(), sorted(expected))
+		for name, (t, val) in expected.items():
+			read_t, read_val = reader.series(name)
+			self.assertTrue(np.allclose(read_t, t, rtol=0, atol=1e-6))
+			self.assertTrue(np.array_equal(read_val, val.astype(np.float32)))
+
+	def test_round_trip(self):
+		path = os.path.join(self.dir, "round_trip.rec")
+		expected = self.record_series(path)
+		reader = RecordReader(path)
+		self.check_series(reader, expected)
+		reader.close()
+
+	"""
+	Without the index (e.g. the program was killed)
+	the series are read scanning the blocks
+	"""
+	def test_round_trip_without_index(self):
+		path = os.path.join(self.dir, "round_trip.rec")
+		expected = self.record_series(path)
+		with open(path, "rb") as f:
+			content = f.read()
+		index_offset, magic = TRAILER.unpack_from(content, len(content) - TRAILER.size)
+		with open(path, "wb") as f:
+			f.write(content[:index_offset])
+		reader = RecordReader(path)
+		self.check_series(reader, expected)
+		reader.close()
+
+	"""
+	A file cut anywhere (e.g. the program was killed) is read
+	up to its last complete declaration or block
+	"""
+	def test_truncated_file(self):
+		with open(self.path, "rb") as f:
+			content = f.read()
+		cut = os.path.join(self.dir, "cut.rec")
+		for size in range(len(MAGIC), len(content)):
+			with open(cut, "wb") as f:
+				f.write(content[:size])
+			reader = RecordReader(cut)
+			for name in reader.names():
+				self.assertIn(name, ["cwnd/10.0.0.1:45000", "rtt/10.0.0.1:45000"])
+				t, val = reader.series(name)
+				self.assertEqual(len(t), len(val))
+			reader.close()
+
+
+if __name__ == "__main__":
+	unittest.main()